@@ -0,0 +1,594 @@
+"""Retention, archival and compaction for the chat history stores.
+
+Nothing in the history providers ever deletes a conversation, so chat_history.sqlite3
+and the Redis history keys grow until queries slow down. Run this job periodically
+(e.g. hourly from cron) to keep the store at a steady size:
+
+  - age-based retention: sessions idle for longer than ``--max-age-days`` are removed,
+  - size-based retention: while the store holds more than ``--max-store-mb`` of
+    messages, the longest-idle sessions are removed,
+  - removed sessions are archived first, to zstd-compressed JSONL files with one
+    session per line (read them with ``zstd -dc FILE | jq``),
+  - sessions with more than ``--max-messages`` messages have all but the newest
+    ``--keep-last`` replaced with one summary message written by the LLM,
+  - space is given back in small steps: incremental VACUUM for SQLite, UNLINK in
+    pipelined batches for Redis, with a pause between batches so live traffic
+    isn't starved.
+
+SQLite rows carry no timestamps, so the job tracks activity in a session_activity
+table of its own: a session's idle time counts from the first run that saw its
+newest message. In Redis, idle time is the OBJECT IDLETIME of the message list.
+
+Providers that cache decoded messages keep serving a compacted session's old
+messages from memory until the cache entry is evicted; windowed providers recompute
+their window cursor on the next turn.
+
+Run:
+    uv run examples/agent_history_maintenance.py --dry-run --max-age-days 30 --max-messages 200
+    uv run examples/agent_history_maintenance.py --max-age-days 30 --max-store-mb 500
+    uv run examples/agent_history_maintenance.py --store redis --max-messages 200 --keep-last 20
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import time
+from collections.abc import Awaitable, Callable, Sequence
+from dataclasses import dataclass
+from typing import Any, Protocol
+
+import redis.asyncio as redis
+import zstandard
+from agent_framework import Message
+from agent_framework.openai import OpenAIChatClient
+from agent_history_sqlite import MessageCodec, estimate_tokens
+from agent_summarization import SUMMARY_HEADER, is_summary
+from azure.identity.aio import DefaultAzureCredential, get_bearer_token_provider
+from dotenv import load_dotenv
+from rich import print
+from rich.logging import RichHandler
+from rich.table import Table
+
+# Setup logging
+handler = RichHandler(show_path=False, rich_tracebacks=True, show_level=False)
+logging.basicConfig(level=logging.WARNING, handlers=[handler], force=True, format="%(message)s")
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# Configure OpenAI client based on environment
+load_dotenv(override=True)
+API_HOST = os.getenv("API_HOST", "github")
+HISTORY_STORE = os.getenv("HISTORY_STORE", "sqlite")  # "sqlite" or "redis"
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379")
+REDIS_SHARD_URLS = [url for url in os.getenv("REDIS_SHARD_URLS", "").split(",") if url]
+
+async_credential = None
+if API_HOST == "azure":
+    async_credential = DefaultAzureCredential()
+    token_provider = get_bearer_token_provider(async_credential, "https://cognitiveservices.azure.com/.default")
+    client = OpenAIChatClient(
+        base_url=f"{os.environ['AZURE_OPENAI_ENDPOINT']}/openai/v1/",
+        api_key=token_provider,
+        model_id=os.environ["AZURE_OPENAI_CHAT_DEPLOYMENT"],
+    )
+elif API_HOST == "github":
+    client = OpenAIChatClient(
+        base_url="https://models.github.ai/inference",
+        api_key=os.environ["GITHUB_TOKEN"],
+        model_id=os.getenv("GITHUB_MODEL", "openai/gpt-4.1-mini"),
+    )
+else:
+    client = OpenAIChatClient(
+        api_key=os.environ["OPENAI_API_KEY"], model_id=os.environ.get("OPENAI_MODEL", "gpt-4.1-mini")
+    )
+
+
+@dataclass
+class SessionInfo:
+    """A stored session: how many messages it has, their stored bytes and how long it has been idle."""
+
+    session_id: str
+    messages: int
+    size: int
+    idle_seconds: float
+
+
+class HistoryStore(Protocol):
+    """The operations the maintenance job needs from a history store."""
+
+    name: str
+
+    async def sessions(self) -> list[SessionInfo]: ...
+
+    async def load(self, session_id: str) -> tuple[list[Message], Any]:
+        """Return the session's messages and a version token for ``replace_prefix``."""
+        ...
+
+    async def delete(self, session_ids: Sequence[str]) -> None: ...
+
+    async def replace_prefix(self, session_id: str, version: Any, count: int, summary: Message) -> bool:
+        """Replace the first ``count`` messages with ``summary``. Returns False if the session changed since loaded."""
+        ...
+
+    async def reclaim(self) -> None:
+        """Give the space freed by deletes back to the system."""
+        ...
+
+    async def footprint(self) -> int:
+        """Bytes the store currently occupies (on disk or in memory)."""
+        ...
+
+    async def close(self) -> None: ...
+
+
+class SQLiteStore:
+    """Maintains the ``messages`` table written by agent_history_sqlite.py and agent_history_tiered.py."""
+
+    name = "sqlite"
+
+    def __init__(self, db_path: str, *, pause: float = 0.05, vacuum_pages: int = 256, full_vacuum: bool = False):
+        self.db_path = db_path
+        self.pause = pause
+        self.vacuum_pages = vacuum_pages
+        self.full_vacuum = full_vacuum
+        self._conn = sqlite3.connect(db_path)
+        # Wait for the providers' writers instead of failing while they commit
+        self._conn.execute("PRAGMA busy_timeout = 5000")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS session_activity (
+                session_id TEXT PRIMARY KEY,
+                last_id INTEGER NOT NULL,
+                last_active REAL NOT NULL
+            )
+            """
+        )
+        dictionaries = []
+        if self._conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'codec_dictionaries'").fetchone():
+            dictionaries = [row[0] for row in self._conn.execute("SELECT data FROM codec_dictionaries")]
+        self._codec = MessageCodec(dictionaries=dictionaries)
+
+    async def sessions(self) -> list[SessionInfo]:
+        """List sessions, first recording as active now every session whose newest message is new since last run."""
+        now = time.time()
+        rows = self._conn.execute(
+            """
+            SELECT m.session_id, m.messages, m.last_id, m.size, a.last_id, a.last_active
+            FROM (
+                SELECT session_id, COUNT(*) AS messages, MAX(id) AS last_id,
+                       SUM(LENGTH(CAST(message_json AS BLOB))) AS size
+                FROM messages GROUP BY session_id
+            ) AS m
+            LEFT JOIN session_activity AS a USING (session_id)
+            """
+        ).fetchall()
+        with self._conn:
+            self._conn.executemany(
+                "INSERT INTO session_activity (session_id, last_id, last_active) VALUES (?, ?, ?) "
+                "ON CONFLICT (session_id) DO UPDATE SET last_id = excluded.last_id, last_active = excluded.last_active",
+                [(sid, last_id, now) for sid, _, last_id, _, seen_id, _ in rows if seen_id != last_id],
+            )
+        return [
+            SessionInfo(sid, count, size, now - seen_at if seen_id == last_id else 0.0)
+            for sid, count, last_id, size, seen_id, seen_at in rows
+        ]
+
+    async def load(self, session_id: str) -> tuple[list[Message], Any]:
+        rows = self._conn.execute(
+            "SELECT message_json FROM messages WHERE session_id = ? ORDER BY id", (session_id,)
+        ).fetchall()
+        # Appends don't touch the prefix being replaced, so no version check is needed
+        return [self._codec.decode(row[0]) for row in rows], None
+
+    async def delete(self, session_ids: Sequence[str]) -> None:
+        with self._conn:
+            self._conn.executemany("DELETE FROM messages WHERE session_id = ?", [(sid,) for sid in session_ids])
+            self._conn.executemany("DELETE FROM session_activity WHERE session_id = ?", [(sid,) for sid in session_ids])
+
+    async def replace_prefix(self, session_id: str, version: Any, count: int, summary: Message) -> bool:
+        row = self._conn.execute(
+            "SELECT id FROM messages WHERE session_id = ? ORDER BY id LIMIT 1 OFFSET ?", (session_id, count - 1)
+        ).fetchone()
+        if row is None:
+            return False
+        with self._conn:
+            self._conn.execute("DELETE FROM messages WHERE session_id = ? AND id <= ?", (session_id, row[0]))
+            # The summary takes the id of the newest replaced message, so it sorts before the kept ones.
+            # It's stored as JSON text, which every provider's codec still reads.
+            self._conn.execute(
+                "INSERT INTO messages (id, session_id, message_json, tokens) VALUES (?, ?, ?, ?)",
+                (row[0], session_id, self._codec.encode(summary), estimate_tokens(summary)),
+            )
+        return True
+
+    async def reclaim(self) -> None:
+        """Release free pages a few at a time, then truncate the WAL."""
+        (mode,) = self._conn.execute("PRAGMA auto_vacuum").fetchone()
+        if mode != 2:  # INCREMENTAL
+            if not self.full_vacuum:
+                logger.warning(
+                    "%s was created without auto_vacuum = INCREMENTAL: freed pages are reused but the file won't "
+                    "shrink. Run once with --full-vacuum to convert it (rewrites the file, blocking writers).",
+                    self.db_path,
+                )
+                return
+            logger.info("Converting %s to incremental auto-vacuum with a full VACUUM...", self.db_path)
+            self._conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            self._conn.execute("VACUUM")
+        while self._conn.execute("PRAGMA freelist_count").fetchone()[0]:
+            # Each step frees one page, so fetch all of them
+            self._conn.execute(f"PRAGMA incremental_vacuum({self.vacuum_pages})").fetchall()
+            await asyncio.sleep(self.pause)
+        self._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchall()
+
+    async def footprint(self) -> int:
+        paths = [self.db_path, f"{self.db_path}-wal"]
+        return sum(os.path.getsize(path) for path in paths if os.path.exists(path))
+
+    async def close(self) -> None:
+        self._conn.close()
+
+
+class RedisStore:
+    """Maintains the message lists written by agent_history_redis.py (and their :tokens and :seq keys)."""
+
+    name = "redis"
+
+    def __init__(self, redis_urls: Sequence[str], key_prefix: str = "chat_messages", *, page_size: int = 500):
+        self.key_prefix = key_prefix
+        self.page_size = page_size
+        self._clients = [redis.from_url(url) for url in redis_urls]
+        self._owners: dict[str, redis.Redis] = {}  # session id -> the server holding it
+        self._codec = MessageCodec()
+
+    def _key(self, session_id: str) -> str:
+        return f"{self.key_prefix}:{session_id}"
+
+    async def sessions(self) -> list[SessionInfo]:
+        infos = []
+        warned = False
+        for client in self._clients:
+            cursor = 0
+            while True:
+                cursor, keys = await client.scan(
+                    cursor, match=f"{self.key_prefix}:*", count=self.page_size, _type="list"
+                )
+                keys = [key.decode() for key in keys if not key.endswith(b":tokens")]
+                async with client.pipeline(transaction=False) as pipe:
+                    for key in keys:
+                        pipe.llen(key)
+                        pipe.object("idletime", key)
+                        pipe.memory_usage(key)
+                        pipe.memory_usage(f"{key}:tokens")
+                    results = await pipe.execute(raise_on_error=False)
+                for i, key in enumerate(keys):
+                    count, idle, size, tokens_size = results[4 * i : 4 * i + 4]
+                    if isinstance(idle, Exception):
+                        # OBJECT IDLETIME isn't available under an LFU maxmemory-policy
+                        if not warned:
+                            logger.warning("Cannot read idle times (%s); age-based retention is skipped", idle)
+                            warned = True
+                        idle = 0
+                    session_id = key[len(self.key_prefix) + 1 :]
+                    self._owners[session_id] = client
+                    infos.append(SessionInfo(session_id, count, (size or 0) + (tokens_size or 0), float(idle)))
+                if cursor == 0:
+                    break
+        return infos
+
+    async def load(self, session_id: str) -> tuple[list[Message], Any]:
+        key = self._key(session_id)
+        client = self._owners[session_id]
+        async with client.pipeline(transaction=True) as pipe:
+            pipe.get(f"{key}:seq")
+            pipe.llen(key)
+            seq, length = await pipe.execute()
+        values = []
+        # Read in pages, so one huge session doesn't produce one huge reply
+        for start in range(0, length, self.page_size):
+            values.extend(await client.lrange(key, start, min(start + self.page_size, length) - 1))
+        return [self._codec.decode(value) for value in values], (int(seq or 0), length)
+
+    async def delete(self, session_ids: Sequence[str]) -> None:
+        # UNLINK frees the memory in a background thread, so big lists don't block the server
+        by_client: dict[redis.Redis, list[str]] = {}
+        for session_id in session_ids:
+            by_client.setdefault(self._owners[session_id], []).append(self._key(session_id))
+        for client, keys in by_client.items():
+            await client.unlink(*(name for key in keys for name in (key, f"{key}:tokens", f"{key}:seq")))
+
+    async def replace_prefix(self, session_id: str, version: Any, count: int, summary: Message) -> bool:
+        key = self._key(session_id)
+        async with self._owners[session_id].pipeline(transaction=True) as pipe:
+            # Fail the transaction if a save lands between the checks below and EXEC
+            await pipe.watch(key, f"{key}:tokens", f"{key}:seq")
+            seq, length, counted = await pipe.get(f"{key}:seq"), await pipe.llen(key), await pipe.llen(f"{key}:tokens")
+            if (int(seq or 0), length) != version:
+                await pipe.unwatch()
+                return False
+            pipe.multi()
+            pipe.ltrim(key, count, -1)
+            pipe.lpush(key, self._codec.encode(summary))
+            if counted >= length - count:
+                # Token counts are aligned with the messages from the tail
+                pipe.ltrim(f"{key}:tokens", -(length - count), -1)
+                pipe.lpush(f"{key}:tokens", estimate_tokens(summary))
+            try:
+                await pipe.execute()
+            except redis.WatchError:
+                return False
+        return True
+
+    async def reclaim(self) -> None:
+        """Nothing to do: UNLINK already returns the memory."""
+
+    async def footprint(self) -> int:
+        return sum([(await client.info("memory"))["used_memory"] for client in self._clients])
+
+    async def close(self) -> None:
+        for client in self._clients:
+            await client.aclose()
+
+
+class Archive:
+    """Appends removed sessions to a zstd-compressed JSONL file, one session per line."""
+
+    def __init__(self, directory: str, store_name: str):
+        self.path = os.path.join(directory, f"history-{store_name}-{time.strftime('%Y%m%d-%H%M%S')}.jsonl.zst")
+        self._file = None
+        self._writer = None
+
+    def write(self, session_id: str, reason: str, messages: Sequence[Message]) -> None:
+        if self._writer is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self._file = open(self.path, "ab")
+            self._writer = zstandard.ZstdCompressor(level=10).stream_writer(self._file, closefd=False)
+        record = {
+            "session_id": session_id,
+            "reason": reason,
+            "archived_at": time.time(),
+            "messages": [message.to_dict() for message in messages],
+        }
+        self._writer.write(json.dumps(record).encode() + b"\n")
+
+    def sync(self) -> None:
+        """End the zstd frame and fsync, so the archived sessions are on disk before they are deleted."""
+        if self._writer is not None:
+            self._writer.flush(zstandard.FLUSH_FRAME)
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def close(self) -> None:
+        if self._writer is not None:
+            self._writer.close()
+            self._file.close()
+
+
+@dataclass
+class RetentionPolicy:
+    max_age_days: float | None = None
+    max_store_mb: float | None = None
+    max_messages: int | None = None
+    keep_last: int = 20
+
+
+@dataclass
+class MaintenanceReport:
+    sessions: int = 0
+    archived: int = 0
+    deleted: int = 0
+    summarized: int = 0
+    messages_summarized: int = 0
+    skipped: int = 0
+    footprint_before: int = 0
+    footprint_after: int = 0
+
+
+SUMMARIZE_PROMPT = (
+    "You are a summarization assistant. Condense the following conversation "
+    "into a concise summary that preserves all key facts, decisions, and context "
+    "needed to continue the conversation. Write the summary in third person. "
+    "Keep specific names, places, dates, numbers, and tool results that were discussed. "
+    "If a current summary is given, return it updated with the newer messages."
+)
+
+
+async def summarize(messages: Sequence[Message]) -> Message:
+    """Ask the LLM for a summary of ``messages``, as a message that can stand in for them.
+
+    The message is marked like the running summary of SummarizationMiddleware
+    (agent_summarization.py), so either of them folds the other's summary into its next one.
+    """
+    current = messages[0].text.removeprefix(SUMMARY_HEADER) if messages and is_summary(messages[0]) else None
+    lines = []
+    for message in messages[1:] if current is not None else messages:
+        for content in message.contents:
+            if content.type == "text" and content.text:
+                lines.append(f"{message.role}: {content.text}")
+            elif content.type == "function_call":
+                lines.append(f"{message.role}: called {content.name}({content.arguments})")
+            elif content.type == "function_result":
+                lines.append(f"tool result: {str(content.result)[:500]}")
+    response = await client.get_response(
+        [
+            Message(role="system", text=SUMMARIZE_PROMPT),
+            Message(
+                role="user",
+                text=(
+                    f"Current summary:\n{current}\n\nNewer messages:\n\n"
+                    if current is not None
+                    else "Summarize this conversation:\n\n"
+                )
+                + "\n".join(lines),
+            ),
+        ]
+    )
+    return Message(role="assistant", text=SUMMARY_HEADER + response.text, additional_properties={"summary": True})
+
+
+def split_point(messages: Sequence[Message], keep_last: int) -> int:
+    """How many leading messages to replace so the newest ``keep_last`` remain.
+
+    The kept part never starts with a tool result, since a result without its
+    tool call is rejected by the model; the call is kept with it instead.
+    """
+    split = max(len(messages) - keep_last, 0)
+    while split > 0 and messages[split].role == "tool":
+        split -= 1
+    return split
+
+
+async def run_maintenance(
+    store: HistoryStore,
+    policy: RetentionPolicy,
+    *,
+    archive: Archive | None,
+    summarizer: Callable[[Sequence[Message]], Awaitable[Message]] = summarize,
+    batch_size: int = 100,
+    pause: float = 0.05,
+    concurrency: int = 4,
+    dry_run: bool = False,
+) -> MaintenanceReport:
+    """Apply ``policy`` to every session in ``store``. With ``dry_run``, only count what would change."""
+    report = MaintenanceReport(footprint_before=await store.footprint())
+    sessions = await store.sessions()
+    report.sessions = len(sessions)
+
+    # Retention: pick the sessions to remove, and why
+    remove: dict[str, str] = {}
+    if policy.max_age_days is not None:
+        max_idle = policy.max_age_days * 24 * 3600
+        remove.update((s.session_id, "age") for s in sessions if s.idle_seconds > max_idle)
+    if policy.max_store_mb is not None:
+        budget = policy.max_store_mb * 1024 * 1024
+        total = sum(s.size for s in sessions if s.session_id not in remove)
+        for s in sorted(sessions, key=lambda s: s.idle_seconds, reverse=True):
+            if total <= budget:
+                break
+            if s.session_id not in remove:
+                remove[s.session_id] = "size"
+                total -= s.size
+    logger.info("%d of %d sessions are due for removal", len(remove), len(sessions))
+
+    # Archive and delete in batches, pausing in between
+    session_ids = list(remove)
+    for start in range(0, len(session_ids), batch_size):
+        batch = session_ids[start : start + batch_size]
+        if dry_run:
+            report.deleted += len(batch)
+            continue
+        if archive is not None:
+            archived = []
+            for session_id in batch:
+                try:
+                    messages, _ = await store.load(session_id)
+                except ValueError as e:
+                    logger.warning("Keeping session %s, which can't be decoded for the archive: %s", session_id, e)
+                    report.skipped += 1
+                    continue
+                archive.write(session_id, remove[session_id], messages)
+                archived.append(session_id)
+            archive.sync()
+            batch = archived
+            report.archived += len(batch)
+        await store.delete(batch)
+        report.deleted += len(batch)
+        await asyncio.sleep(pause)
+
+    # Compaction: replace the older part of long sessions with a summary
+    if policy.max_messages is not None:
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def compact(session_id: str) -> None:
+            async with semaphore:
+                try:
+                    messages, version = await store.load(session_id)
+                except ValueError as e:
+                    logger.warning("Not summarizing session %s: %s", session_id, e)
+                    report.skipped += 1
+                    return
+                count = split_point(messages, policy.keep_last)
+                if count == 0:
+                    return
+                if not dry_run:
+                    summary = await summarizer(messages[:count])
+                    if not await store.replace_prefix(session_id, version, count, summary):
+                        logger.info(
+                            "Session %s changed while it was summarized; it will be retried next run", session_id
+                        )
+                        report.skipped += 1
+                        return
+                report.summarized += 1
+                report.messages_summarized += count
+
+        long_sessions = [
+            s.session_id for s in sessions if s.session_id not in remove and s.messages > policy.max_messages
+        ]
+        logger.info("%d sessions are longer than %d messages", len(long_sessions), policy.max_messages)
+        await asyncio.gather(*(compact(session_id) for session_id in long_sessions))
+
+    if not dry_run:
+        await store.reclaim()
+    report.footprint_after = await store.footprint()
+    return report
+
+
+def print_report(store: HistoryStore, report: MaintenanceReport, *, dry_run: bool) -> None:
+    table = Table(title=f"History maintenance ({store.name}{', dry run' if dry_run else ''})")
+    table.add_column("")
+    table.add_column("", justify="right")
+    table.add_row("Sessions", f"{report.sessions:,}")
+    table.add_row("Archived", f"{report.archived:,}")
+    table.add_row("Deleted", f"{report.deleted:,}")
+    table.add_row("Summarized", f"{report.summarized:,} ({report.messages_summarized:,} messages)")
+    table.add_row("Skipped", f"{report.skipped:,}")
+    table.add_row("Store size", f"{report.footprint_before / 1e6:,.1f} MB → {report.footprint_after / 1e6:,.1f} MB")
+    print(table)
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description="Apply retention and compaction to the chat history store.")
+    parser.add_argument("--store", choices=["sqlite", "redis"], default=HISTORY_STORE)
+    parser.add_argument("--db", default="chat_history.sqlite3", help="SQLite database (default: chat_history.sqlite3)")
+    parser.add_argument("--prefix", default="chat_messages", help="Redis key prefix (default: chat_messages)")
+    parser.add_argument("--max-age-days", type=float, help="Remove sessions idle for longer than this")
+    parser.add_argument("--max-store-mb", type=float, help="Remove the longest-idle sessions until under this size")
+    parser.add_argument("--max-messages", type=int, help="Summarize sessions with more messages than this")
+    parser.add_argument("--keep-last", type=int, default=20, help="Messages kept after a summary (default: 20)")
+    parser.add_argument("--archive-dir", default="history_archive", help="Where removed sessions are archived")
+    parser.add_argument("--no-archive", action="store_true", help="Delete removed sessions without archiving them")
+    parser.add_argument("--batch-size", type=int, default=100, help="Sessions removed per batch (default: 100)")
+    parser.add_argument("--pause", type=float, default=0.05, help="Seconds to pause between batches (default: 0.05)")
+    parser.add_argument("--full-vacuum", action="store_true", help="Convert an old SQLite file to incremental vacuum")
+    parser.add_argument("--dry-run", action="store_true", help="Report what would change without changing anything")
+    args = parser.parse_args()
+    if args.keep_last < 1:
+        parser.error("--keep-last must be at least 1")
+
+    if args.store == "redis":
+        store: HistoryStore = RedisStore(REDIS_SHARD_URLS or [REDIS_URL], args.prefix)
+    else:
+        store = SQLiteStore(args.db, pause=args.pause, full_vacuum=args.full_vacuum)
+    archive = None if args.no_archive or args.dry_run else Archive(args.archive_dir, store.name)
+    policy = RetentionPolicy(args.max_age_days, args.max_store_mb, args.max_messages, args.keep_last)
+    try:
+        report = await run_maintenance(
+            store, policy, archive=archive, batch_size=args.batch_size, pause=args.pause, dry_run=args.dry_run
+        )
+    finally:
+        if archive is not None:
+            archive.close()
+        await store.close()
+    print_report(store, report, dry_run=args.dry_run)
+    if report.archived:
+        print(f"[dim]Archived sessions: {archive.path}[/dim]")
+
+    if async_credential:
+        await async_credential.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,13 +1,18 @@
 import asyncio
+import bisect
+import hashlib
 import logging
 import os
 import random
 import uuid
-from typing import Annotated
+from collections.abc import Sequence
+from typing import Annotated, Any
 
-from agent_framework import Agent, tool
+import redis.asyncio as redis
+from agent_framework import Agent, Message, tool
 from agent_framework.openai import OpenAIChatClient
 from agent_framework.redis import RedisHistoryProvider
+from agent_history_sqlite import DecodedMessageCache, MessageCodec, drop_leading_tool_results, estimate_tokens
 from azure.identity.aio import DefaultAzureCredential, get_bearer_token_provider
 from dotenv import load_dotenv
 from pydantic import Field
@@ -24,6 +29,8 @@ logger.setLevel(logging.INFO)
 load_dotenv(override=True)
 API_HOST = os.getenv("API_HOST", "github")
 REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379")
+# Optional comma-separated list of Redis URLs to shard sessions across
+REDIS_SHARD_URLS = [url for url in os.getenv("REDIS_SHARD_URLS", "").split(",") if url]
 
 async_credential = None
 if API_HOST == "azure":
@@ -46,6 +53,276 @@ else:
     )
 
 
+class WindowedRedisHistoryProvider(RedisHistoryProvider):
+    """A RedisHistoryProvider that loads only the newest messages of a session.
+
+    The window holds at most ``window_messages`` messages and/or ``window_tokens``
+    estimated tokens. Next to each session's message list it keeps a parallel list of
+    per-message token counts and a counter of messages ever appended, so the window
+    is sized by reading small integers from the tail, never by decoding messages.
+
+    The window is remembered in session state as a cursor (the counter value it was
+    computed at, plus its size). On the next turn only the messages appended since
+    are counted and the oldest are dropped from the front, so the cost of a turn
+    stays the same however long the conversation runs.
+
+    Messages are stored with ``codec`` (by default MessagePack + zstd). Values
+    written as JSON strings by a plain RedisHistoryProvider still decode.
+
+    Decoded messages are kept in a ``DecodedMessageCache`` of up to ``cache_bytes``
+    (None disables it), so once a session is loaded, later turns are served from
+    memory and only their saves go to Redis.
+
+    Each save is one MULTI/EXEC round trip: RPUSH the messages and their token
+    counts, LTRIM both lists to ``max_messages`` and, with ``ttl_seconds`` set, EXPIRE
+    the session's keys, so idle sessions disappear on their own. With
+    ``window_messages`` set, a load is also one round trip: an LRANGE of that many
+    messages from the tail.
+    """
+
+    def __init__(
+        self,
+        *args: Any,
+        window_messages: int | None = None,
+        window_tokens: int | None = None,
+        page_size: int = 64,
+        codec: MessageCodec | None = None,
+        cache_bytes: int | None = 64 * 1024 * 1024,
+        ttl_seconds: int | None = None,
+        **kwargs: Any,
+    ) -> None:
+        super().__init__(*args, **kwargs)
+        self.ttl_seconds = ttl_seconds
+        self.codec = codec or MessageCodec()
+        self.cache = DecodedMessageCache(cache_bytes) if cache_bytes else None
+        if self.redis_url is None:
+            raise ValueError("WindowedRedisHistoryProvider requires redis_url")
+        # Encoded messages are binary, so replace the client with one that returns bytes
+        self._redis_client = redis.from_url(self.redis_url)
+        self.window_messages = window_messages
+        self.window_tokens = window_tokens
+        self._page_size = page_size
+
+    def _client(self, key: str) -> redis.Redis:
+        """Return the client holding ``key``'s session."""
+        return self._redis_client
+
+    def _fits(self, count: int, tokens: int) -> bool:
+        return (self.window_messages is None or count <= self.window_messages) and (
+            self.window_tokens is None or tokens <= self.window_tokens
+        )
+
+    async def save_messages(self, session_id: str | None, messages: Sequence[Message], **kwargs: Any) -> None:
+        """Append messages, their token counts and the counter in one transaction."""
+        if not messages:
+            return
+        key = self._redis_key(session_id)
+        tokens = [estimate_tokens(m) for m in messages]
+        async with self._client(key).pipeline(transaction=True) as pipe:
+            pipe.rpush(key, *(self.codec.encode(m) for m in messages))
+            pipe.rpush(f"{key}:tokens", *tokens)
+            pipe.incrby(f"{key}:seq", len(messages))
+            if self.max_messages is not None:
+                pipe.ltrim(key, -self.max_messages, -1)
+                pipe.ltrim(f"{key}:tokens", -self.max_messages, -1)
+            if self.ttl_seconds is not None:
+                for name in (key, f"{key}:tokens", f"{key}:seq"):
+                    pipe.expire(name, self.ttl_seconds)
+            seq = (await pipe.execute())[2]
+        if self.cache is not None:
+            self.cache.append(key, seq - len(messages), seq, list(zip(messages, tokens)))
+
+    async def replace_messages(
+        self, session_id: str | None, summary: Message, *, keep: int, state: dict[str, Any] | None = None
+    ) -> None:
+        """Replace all of the session's messages except the newest ``keep`` with ``summary``, in one transaction.
+
+        This is the compaction API driven by SummarizationMiddleware (agent_summarization.py).
+        Messages older than the loaded window are replaced as well. The counter is left
+        alone: it counts messages ever appended, which compaction doesn't change.
+        """
+        key = self._redis_key(session_id)
+        async with self._client(key).pipeline(transaction=True) as pipe:
+            for name in (key, f"{key}:tokens"):
+                # Once a session has been loaded its token list covers every message, so both stay aligned
+                if keep:
+                    pipe.ltrim(name, -keep, -1)
+                else:
+                    pipe.delete(name)
+            pipe.lpush(key, self.codec.encode(summary))
+            pipe.lpush(f"{key}:tokens", estimate_tokens(summary))
+            if self.ttl_seconds is not None:
+                pipe.expire(key, self.ttl_seconds)
+                pipe.expire(f"{key}:tokens", self.ttl_seconds)
+            await pipe.execute()
+        # The counter doesn't change, so neither the cached messages nor the window cursor would notice
+        if self.cache is not None:
+            self.cache.discard(key)
+        if state is not None:
+            state.pop("window", None)
+
+    async def _prepare(self, key: str) -> tuple[int, int]:
+        """Return (counter, list length), first backfilling sessions written without token counts."""
+        client = self._client(key)
+        async with client.pipeline(transaction=False) as pipe:
+            pipe.get(f"{key}:seq")
+            pipe.llen(key)
+            pipe.llen(f"{key}:tokens")
+            seq, length, counted = await pipe.execute()
+        if counted < length:
+            # The token list is aligned with the message list from the tail, so the missing counts are at the head
+            missing = await client.lrange(key, 0, length - counted - 1)
+            counts = [estimate_tokens(self.codec.decode(m)) for m in missing]
+            await client.lpush(f"{key}:tokens", *reversed(counts))
+        return int(seq or 0), length
+
+    async def _find_window(self, key: str, cursor: dict | None) -> dict:
+        """Return the window cursor: the newest ``count`` messages as of counter value ``end``."""
+        client = self._client(key)
+        if cursor is not None:
+            seq = int(await client.get(f"{key}:seq") or 0)
+            window = dict(cursor)
+            added = seq - window["end"]
+            if added < 0 or window["count"] + added > await client.llen(key):
+                cursor = None  # the session was cleared or trimmed under the window
+            else:
+                if added:
+                    counts = await client.lrange(f"{key}:tokens", -added, -1)
+                    window["tokens"] += sum(int(c) for c in counts)
+                    window["count"] += added
+                    window["end"] = seq
+                while not self._fits(window["count"], window["tokens"]):
+                    # Page forward from the oldest message in the window, dropping until it fits
+                    first = -window["count"]
+                    counts = await client.lrange(f"{key}:tokens", first, min(first + self._page_size - 1, -1))
+                    for count in counts:
+                        if self._fits(window["count"], window["tokens"]):
+                            break
+                        window["count"] -= 1
+                        window["tokens"] -= int(count)
+                return window
+
+        seq, length = await self._prepare(key)
+        window = {"end": seq, "count": 0, "tokens": 0}
+        # Page backwards from the tail until the next message would not fit
+        while window["count"] < length:
+            last = -window["count"] - 1
+            counts = await client.lrange(f"{key}:tokens", last - self._page_size + 1, last)
+            for count in reversed(counts):
+                if not self._fits(window["count"] + 1, window["tokens"] + int(count)):
+                    return window
+                window["count"] += 1
+                window["tokens"] += int(count)
+            if not counts:
+                break
+        return window
+
+    async def get_messages(
+        self, session_id: str | None, *, state: dict[str, Any] | None = None, **kwargs: Any
+    ) -> list[Message]:
+        """Retrieve the newest messages of this session that fit in the window."""
+        key = self._redis_key(session_id)
+        if self.cache is not None:
+            cached = self.cache.get(key, self._fits)
+            if cached is not None:
+                return drop_leading_tool_results(cached)
+        if self.window_messages is not None:
+            rows = await self._read_tail(key, state)
+            if rows is not None:
+                return drop_leading_tool_results([message for message, _ in rows])
+        cursor = state.get("window") if state is not None else None
+        while True:
+            window = await self._find_window(key, cursor)
+            async with self._client(key).pipeline(transaction=True) as pipe:
+                pipe.get(f"{key}:seq")
+                if window["count"]:
+                    pipe.lrange(key, -window["count"], -1)
+                    pipe.lrange(f"{key}:tokens", -window["count"], -1)
+                seq, *rest = await pipe.execute()
+            serialized, counts = rest or ([], [])
+            if int(seq or 0) == window["end"]:
+                break
+            cursor = window  # messages were appended in between; extend the window and read again
+        if state is not None:
+            state["window"] = window
+        rows = [(self.codec.decode(m), int(t)) for m, t in zip(serialized, counts)]
+        if self.cache is not None:
+            self.cache.put(key, window["end"], rows)
+        return drop_leading_tool_results([message for message, _ in rows])
+
+    async def _read_tail(self, key: str, state: dict[str, Any] | None) -> list[tuple[Message, int]] | None:
+        """Load the window in one round trip: the last ``window_messages`` messages, trimmed to the token budget.
+
+        Returns None for sessions written without token counts, which take the paging path once to backfill them.
+        """
+        tail = self.window_messages
+        async with self._client(key).pipeline(transaction=True) as pipe:
+            pipe.get(f"{key}:seq")
+            pipe.llen(key)
+            pipe.llen(f"{key}:tokens")
+            pipe.lrange(key, -tail, -1)
+            pipe.lrange(f"{key}:tokens", -tail, -1)
+            seq, length, counted, serialized, counts = await pipe.execute()
+        if counted < length:
+            return None
+        window = {"end": int(seq or 0), "count": 0, "tokens": 0}
+        for count in reversed(counts):
+            if not self._fits(window["count"] + 1, window["tokens"] + int(count)):
+                break
+            window["count"] += 1
+            window["tokens"] += int(count)
+        first = len(counts) - window["count"]
+        rows = [(self.codec.decode(m), int(t)) for m, t in zip(serialized[first:], counts[first:])]
+        if state is not None:
+            state["window"] = window
+        if self.cache is not None:
+            self.cache.put(key, window["end"], rows)
+        return rows
+
+    async def clear(self, session_id: str | None) -> None:
+        """Clear all messages for a session, with their token counts and counter."""
+        key = self._redis_key(session_id)
+        await self._client(key).delete(key, f"{key}:tokens", f"{key}:seq")
+        if self.cache is not None:
+            self.cache.discard(key)
+
+
+class ShardedRedisHistoryProvider(WindowedRedisHistoryProvider):
+    """A WindowedRedisHistoryProvider that spreads sessions over several Redis servers.
+
+    Each session is placed on a shard by consistent hashing: every server gets
+    ``virtual_nodes`` points on a hash ring and a session goes to the first point
+    after the hash of its key. Adding or removing a server only moves the sessions
+    on the ring segments it gains or loses (about 1/n of them), and all of a
+    session's keys live on the same server, so saves stay a single transaction.
+    """
+
+    def __init__(self, redis_urls: Sequence[str], *, virtual_nodes: int = 64, **kwargs: Any) -> None:
+        if not redis_urls:
+            raise ValueError("redis_urls must not be empty")
+        super().__init__(redis_url=redis_urls[0], **kwargs)
+        self.shards = [self._redis_client] + [redis.from_url(url) for url in redis_urls[1:]]
+        self._ring = sorted(
+            (_ring_hash(f"{url}#{node}"), shard)
+            for shard, url in enumerate(redis_urls)
+            for node in range(virtual_nodes)
+        )
+        self._points = [point for point, _ in self._ring]
+
+    def _client(self, key: str) -> redis.Redis:
+        index = bisect.bisect(self._points, _ring_hash(key)) % len(self._ring)
+        return self.shards[self._ring[index][1]]
+
+    async def aclose(self) -> None:
+        """Close the connections to every shard."""
+        for client in self.shards:
+            await client.aclose()
+
+
+def _ring_hash(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), "big")
+
+
 @tool
 def get_weather(
     city: Annotated[str, Field(description="The city to get the weather for.")],
@@ -56,6 +333,20 @@ def get_weather(
     return f"The weather in {city} is {conditions[random.randint(0, 3)]} with a high of {random.randint(10, 30)}°C."
 
 
+def create_history_provider() -> WindowedRedisHistoryProvider:
+    """A Redis history provider with bounded memory and a bounded cost per turn."""
+    options: dict[str, Any] = {
+        "source_id": "redis_chat",
+        "window_tokens": 4_000,  # only the newest messages that fit are sent back to the model each turn
+        "window_messages": 200,  # an upper bound on the window, so a cache miss is read in one round trip
+        "max_messages": 1_000,  # older messages are trimmed from Redis
+        "ttl_seconds": 7 * 24 * 3600,  # sessions idle for a week expire
+    }
+    if REDIS_SHARD_URLS:
+        return ShardedRedisHistoryProvider(REDIS_SHARD_URLS, **options)
+    return WindowedRedisHistoryProvider(redis_url=REDIS_URL, **options)
+
+
 async def example_persistent_session() -> None:
     """A Redis-backed session persists conversation history across application restarts."""
     print("\n[bold]=== Persistent Redis Session ===[/bold]")
@@ -64,7 +355,7 @@ async def example_persistent_session() -> None:
 
     # Phase 1: Start a conversation with a Redis-backed history provider
     print("[bold]--- Phase 1: Starting conversation ---[/bold]")
-    redis_provider = RedisHistoryProvider(source_id="redis_chat", redis_url=REDIS_URL)
+    redis_provider = create_history_provider()
 
     agent = Agent(
         client=client,
@@ -85,7 +376,7 @@ async def example_persistent_session() -> None:
 
     # Phase 2: Simulate an application restart — reconnect using the same session ID in Redis
     print("\n[bold]--- Phase 2: Resuming after 'restart' ---[/bold]")
-    redis_provider2 = RedisHistoryProvider(source_id="redis_chat", redis_url=REDIS_URL)
+    redis_provider2 = create_history_provider()
 
     agent2 = Agent(
         client=client,
@@ -112,8 +403,7 @@ async def main() -> None:
     except Exception as e:
         logger.error(f"Cannot connect to Redis at {REDIS_URL}: {e}")
         logger.error(
-            "Ensure Redis is running (e.g. via the dev container"
-            " or 'docker run -p 6379:6379 redis:7-alpine')."
+            "Ensure Redis is running (e.g. via the dev container or 'docker run -p 6379:6379 redis:7-alpine')."
         )
         return
     finally:
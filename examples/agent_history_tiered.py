@@ -0,0 +1,478 @@
+"""Tiered chat history: active sessions in memory, idle sessions in SQLite or Redis.
+
+InMemoryHistoryProvider keeps every session in RAM forever; the SQLite and Redis
+providers pay I/O on every turn. This provider puts the two together:
+
+  - the hot tier holds active sessions as decoded messages in an LRU, bounded by
+    their estimated size, so a turn on an active session never touches storage,
+  - a background task writes the new messages of sessions idle for ``idle_seconds``
+    back to the cold store in one batch (write-back, not write-through),
+  - when the hot tier is full the least recently used sessions are evicted,
+    after writing back anything they still hold,
+  - a session that is not in memory is loaded from the cold store on its next turn.
+
+The cold stores write the same format as agent_history_sqlite.py (the ``messages``
+table, with a token count per row) and WindowedRedisHistoryProvider in
+agent_history_redis.py (a message list plus the ``:tokens`` and ``:seq`` keys), using
+the same MessageCodec, so either provider can read what this one wrote and back.
+
+Write-back trades durability for speed: messages of an active session live only in
+memory until it goes idle, is evicted, or the provider is closed.
+
+Run:
+    uv run examples/agent_history_tiered.py
+    uv run examples/agent_history_tiered.py --benchmark  (simulated traffic, no LLM calls)
+"""
+
+import asyncio
+import logging
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+from collections import OrderedDict
+from collections.abc import Sequence
+from dataclasses import dataclass, field
+from typing import Annotated, Any, Protocol
+
+import redis.asyncio as redis
+from agent_framework import Agent, BaseHistoryProvider, Message, tool
+from agent_framework.openai import OpenAIChatClient
+from agent_history_sqlite import MessageCodec, estimate_tokens
+from azure.identity.aio import DefaultAzureCredential, get_bearer_token_provider
+from dotenv import load_dotenv
+from pydantic import Field
+from rich import print
+from rich.logging import RichHandler
+
+# Setup logging
+handler = RichHandler(show_path=False, rich_tracebacks=True, show_level=False)
+logging.basicConfig(level=logging.WARNING, handlers=[handler], force=True, format="%(message)s")
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# Configure OpenAI client based on environment
+load_dotenv(override=True)
+API_HOST = os.getenv("API_HOST", "github")
+HISTORY_STORE = os.getenv("HISTORY_STORE", "sqlite")  # "sqlite" or "redis"
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379")
+
+async_credential = None
+if API_HOST == "azure":
+    async_credential = DefaultAzureCredential()
+    token_provider = get_bearer_token_provider(async_credential, "https://cognitiveservices.azure.com/.default")
+    client = OpenAIChatClient(
+        base_url=f"{os.environ['AZURE_OPENAI_ENDPOINT']}/openai/v1/",
+        api_key=token_provider,
+        model_id=os.environ["AZURE_OPENAI_CHAT_DEPLOYMENT"],
+    )
+elif API_HOST == "github":
+    client = OpenAIChatClient(
+        base_url="https://models.github.ai/inference",
+        api_key=os.environ["GITHUB_TOKEN"],
+        model_id=os.getenv("GITHUB_MODEL", "openai/gpt-4.1-mini"),
+    )
+else:
+    client = OpenAIChatClient(
+        api_key=os.environ["OPENAI_API_KEY"], model_id=os.environ.get("OPENAI_MODEL", "gpt-4.1-mini")
+    )
+
+
+def estimate_size(message: Message) -> int:
+    """Estimate the memory a decoded message takes: about 1 KB of objects plus its content."""
+    return 1_000 + 8 * estimate_tokens(message)
+
+
+# ── Cold stores ──────────────────────────────────────────────────────
+
+
+class ColdStore(Protocol):
+    """Durable storage behind the hot tier."""
+
+    async def load(self, session_id: str) -> list[Message]: ...
+
+    async def append(self, batches: dict[str, list[Message]]) -> None:
+        """Append messages to several sessions at once."""
+        ...
+
+    async def close(self) -> None: ...
+
+
+class SQLiteColdStore:
+    """Stores messages in the ``messages`` table used by agent_history_sqlite.py, encoded with ``codec``.
+
+    Compression dictionaries saved in the database by SQLiteHistoryProvider are loaded on startup.
+    """
+
+    def __init__(self, db_path: str, codec: MessageCodec | None = None):
+        self.db_path = db_path
+        self.codec = codec or MessageCodec()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.executescript(
+            """
+            PRAGMA auto_vacuum = INCREMENTAL;
+            PRAGMA journal_mode = WAL;
+            PRAGMA synchronous = NORMAL;
+            PRAGMA busy_timeout = 5000;
+            CREATE TABLE IF NOT EXISTS messages (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                session_id TEXT NOT NULL,
+                message_json TEXT NOT NULL,
+                tokens INTEGER
+            );
+            CREATE INDEX IF NOT EXISTS messages_session_id ON messages (session_id, id);
+            CREATE TABLE IF NOT EXISTS codec_dictionaries (
+                dict_id INTEGER NOT NULL UNIQUE,
+                data BLOB NOT NULL
+            );
+            """
+        )
+        for (data,) in self._conn.execute("SELECT data FROM codec_dictionaries ORDER BY rowid"):
+            self.codec.add_dictionary(data)
+        # One connection, used from one worker thread at a time
+        self._lock = asyncio.Lock()
+
+    async def load(self, session_id: str) -> list[Message]:
+        def read() -> list[Message]:
+            rows = self._conn.execute(
+                "SELECT message_json FROM messages WHERE session_id = ? ORDER BY id", (session_id,)
+            ).fetchall()
+            return [self.codec.decode(row[0]) for row in rows]
+
+        async with self._lock:
+            return await asyncio.to_thread(read)
+
+    async def append(self, batches: dict[str, list[Message]]) -> None:
+        def write() -> None:
+            rows = [
+                (sid, self.codec.encode(m), estimate_tokens(m)) for sid, messages in batches.items() for m in messages
+            ]
+            with self._conn:
+                self._conn.executemany("INSERT INTO messages (session_id, message_json, tokens) VALUES (?, ?, ?)", rows)
+
+        async with self._lock:
+            await asyncio.to_thread(write)
+
+    async def close(self) -> None:
+        async with self._lock:
+            self._conn.close()
+
+
+class RedisColdStore:
+    """Stores each session like WindowedRedisHistoryProvider: encoded messages, token counts and a counter."""
+
+    def __init__(self, redis_url: str, key_prefix: str = "chat_messages", codec: MessageCodec | None = None):
+        self.key_prefix = key_prefix
+        self.codec = codec or MessageCodec()
+        # Encoded messages are binary, so the client returns bytes
+        self._redis = redis.from_url(redis_url)
+
+    async def load(self, session_id: str) -> list[Message]:
+        values = await self._redis.lrange(f"{self.key_prefix}:{session_id}", 0, -1)
+        return [self.codec.decode(value) for value in values]
+
+    async def append(self, batches: dict[str, list[Message]]) -> None:
+        async with self._redis.pipeline(transaction=True) as pipe:
+            for session_id, messages in batches.items():
+                key = f"{self.key_prefix}:{session_id}"
+                pipe.rpush(key, *(self.codec.encode(m) for m in messages))
+                pipe.rpush(f"{key}:tokens", *(estimate_tokens(m) for m in messages))
+                pipe.incrby(f"{key}:seq", len(messages))
+            await pipe.execute()
+
+    async def close(self) -> None:
+        await self._redis.aclose()
+
+
+# ── Tiered provider ──────────────────────────────────────────────────
+
+
+@dataclass
+class HotSession:
+    """A session in the hot tier. The first ``stored`` messages are already in the cold store."""
+
+    messages: list[Message]
+    stored: int
+    size: int
+    last_used: float = field(default_factory=time.monotonic)
+
+    @property
+    def dirty(self) -> bool:
+        return self.stored < len(self.messages)
+
+
+class TieredHistoryProvider(BaseHistoryProvider):
+    """A history provider with an in-memory hot tier in front of a cold store.
+
+    Sessions are kept in an LRU bounded by ``max_hot_bytes`` of estimated message size.
+    New messages are written to the cold store once their session has been idle for
+    ``idle_seconds``, when it is evicted, or on ``close()``.
+    """
+
+    def __init__(
+        self,
+        cold: ColdStore,
+        *,
+        max_hot_bytes: int = 32 * 1024 * 1024,
+        idle_seconds: float = 30.0,
+        source_id: str = "tiered-history",
+    ):
+        super().__init__(source_id)
+        self.cold = cold
+        self.max_hot_bytes = max_hot_bytes
+        self.idle_seconds = idle_seconds
+        self.hot_size = 0
+        self.stats = {
+            "hot_hits": 0,
+            "promotions": 0,
+            "new_sessions": 0,
+            "evictions": 0,
+            "write_backs": 0,
+            "messages_written": 0,
+        }
+        self._hot: OrderedDict[str, HotSession] = OrderedDict()
+        self._promoting: dict[str, asyncio.Task[HotSession]] = {}
+        self._write_back_lock = asyncio.Lock()
+        self._flusher: asyncio.Task | None = None
+        self._closing = asyncio.Event()
+
+    async def _session(self, session_id: str) -> HotSession:
+        """Return the hot session, promoting it from the cold store if needed."""
+        if self._flusher is None:
+            self._flusher = asyncio.create_task(self._flush_idle_sessions())
+        session = self._hot.get(session_id)
+        if session is not None:
+            self.stats["hot_hits"] += 1
+            self._hot.move_to_end(session_id)
+            session.last_used = time.monotonic()
+            return session
+        # Concurrent turns on the same cold session share one load
+        if session_id not in self._promoting:
+            self._promoting[session_id] = asyncio.create_task(self._promote(session_id))
+        try:
+            return await asyncio.shield(self._promoting[session_id])
+        finally:
+            self._promoting.pop(session_id, None)
+
+    async def _promote(self, session_id: str) -> HotSession:
+        messages = await self.cold.load(session_id)
+        self.stats["promotions" if messages else "new_sessions"] += 1
+        session = HotSession(messages, stored=len(messages), size=sum(estimate_size(m) for m in messages))
+        self._hot[session_id] = session
+        self.hot_size += session.size
+        return session
+
+    async def get_messages(self, session_id: str | None, **kwargs: Any) -> list[Message]:
+        """Return the session's messages from memory, loading them from the cold store first if needed."""
+        if session_id is None:
+            return []
+        messages = list((await self._session(session_id)).messages)
+        await self._evict()
+        return messages
+
+    async def save_messages(self, session_id: str | None, messages: Sequence[Message], **kwargs: Any) -> None:
+        """Append messages in memory; they reach the cold store when the session goes idle or is evicted."""
+        if session_id is None or not messages:
+            return
+        session = await self._session(session_id)
+        while self._hot.get(session_id) is not session:
+            # Evicted by another turn before this one resumed; load it again
+            session = await self._session(session_id)
+        session.messages.extend(messages)
+        added = sum(estimate_size(m) for m in messages)
+        session.size += added
+        self.hot_size += added
+        await self._evict()
+
+    async def _evict(self) -> None:
+        """Evict least recently used sessions until the hot tier fits, writing back what they hold."""
+        while self.hot_size > self.max_hot_bytes and len(self._hot) > 1:
+            # Take enough of the least recently used sessions to get back under the limit
+            excess = self.hot_size - self.max_hot_bytes
+            victims: dict[str, float] = {}
+            for session_id, session in self._hot.items():
+                if excess <= 0 or len(victims) == len(self._hot) - 1:
+                    break
+                victims[session_id] = session.last_used
+                excess -= session.size
+            dirty = [session_id for session_id in victims if self._hot[session_id].dirty]
+            if dirty:
+                await self._write_back(dirty)
+            for session_id, last_used in victims.items():
+                session = self._hot.get(session_id)
+                # Keep sessions that were used while their messages were written back
+                if session is not None and not session.dirty and session.last_used == last_used:
+                    del self._hot[session_id]
+                    self.hot_size -= session.size
+                    self.stats["evictions"] += 1
+
+    async def _write_back(self, session_ids: Sequence[str]) -> None:
+        """Append the unsaved messages of these sessions to the cold store in one batch."""
+        async with self._write_back_lock:
+            batches: dict[str, list[Message]] = {}
+            ends: dict[str, int] = {}
+            for session_id in session_ids:
+                session = self._hot.get(session_id)
+                if session is not None and session.dirty:
+                    ends[session_id] = len(session.messages)
+                    batches[session_id] = session.messages[session.stored :]
+            if not batches:
+                return
+            await self.cold.append(batches)
+            for session_id, end in ends.items():
+                # Messages appended during the write stay dirty for the next write-back
+                self._hot[session_id].stored = end
+            self.stats["write_backs"] += 1
+            self.stats["messages_written"] += sum(len(batch) for batch in batches.values())
+
+    async def _flush_idle_sessions(self) -> None:
+        """Background task: write back sessions that have been idle for ``idle_seconds``."""
+        while not self._closing.is_set():
+            try:
+                await asyncio.wait_for(self._closing.wait(), self.idle_seconds / 2)
+            except asyncio.TimeoutError:
+                pass
+            cutoff = time.monotonic() - self.idle_seconds
+            idle = [sid for sid, s in self._hot.items() if s.dirty and s.last_used <= cutoff]
+            if idle:
+                try:
+                    await self._write_back(idle)
+                except Exception:
+                    logger.exception("Writing back idle sessions failed; will retry")
+
+    async def close(self) -> None:
+        """Write back every session and close the cold store."""
+        # Let the flusher finish a write-back in progress rather than cancel it halfway
+        self._closing.set()
+        if self._flusher is not None:
+            await self._flusher
+        await self._write_back(list(self._hot))
+        await self.cold.close()
+
+
+def create_cold_store(db_path: str = "chat_history.sqlite3") -> ColdStore:
+    if HISTORY_STORE == "redis":
+        return RedisColdStore(REDIS_URL)
+    return SQLiteColdStore(db_path)
+
+
+@tool
+def get_weather(
+    city: Annotated[str, Field(description="The city to get the weather for.")],
+) -> str:
+    """Returns weather data for a given city."""
+    logger.info(f"Getting weather for {city}")
+    conditions = ["sunny", "cloudy", "rainy", "stormy"]
+    return f"The weather in {city} is {conditions[random.randint(0, 3)]} with a high of {random.randint(10, 30)}°C."
+
+
+async def main() -> None:
+    """Demonstrate a session served from memory, written back on close, and promoted after a restart."""
+    session_id = str(uuid.uuid4())
+
+    print(f"\n[bold]=== Tiered Session ({HISTORY_STORE} cold store) ===[/bold]")
+    print("[bold]--- Phase 1: Starting conversation (hot tier) ---[/bold]")
+    provider = TieredHistoryProvider(create_cold_store())
+    agent = Agent(
+        client=client,
+        instructions="You are a helpful weather agent.",
+        tools=[get_weather],
+        context_providers=[provider],
+    )
+    session = agent.create_session(session_id=session_id)
+
+    print("[blue]User:[/blue] What's the weather like in Tokyo?")
+    response = await agent.run("What's the weather like in Tokyo?", session=session)
+    print(f"[green]Agent:[/green] {response.text}")
+
+    print("\n[blue]User:[/blue] How about Paris?")
+    response = await agent.run("How about Paris?", session=session)
+    print(f"[green]Agent:[/green] {response.text}")
+    print(f"[dim]{provider.stats}[/dim]")
+
+    # Closing writes the session back to the cold store
+    await provider.close()
+
+    print("\n[bold]--- Phase 2: Resuming after 'restart' (promoted from the cold store) ---[/bold]")
+    provider2 = TieredHistoryProvider(create_cold_store())
+    agent2 = Agent(
+        client=client,
+        instructions="You are a helpful weather agent.",
+        tools=[get_weather],
+        context_providers=[provider2],
+    )
+    session2 = agent2.create_session(session_id=session_id)
+
+    print("[blue]User:[/blue] Which of the cities I asked about had better weather?")
+    response = await agent2.run("Which of the cities I asked about had better weather?", session=session2)
+    print(f"[green]Agent:[/green] {response.text}")
+    print(f"[dim]{provider2.stats}[/dim]")
+    await provider2.close()
+
+    if async_credential:
+        await async_credential.close()
+
+
+async def benchmark(
+    users: int = 5_000, turns: int = 100_000, turns_per_session: int = 20, max_hot_bytes: int = 16 * 1024 * 1024
+) -> None:
+    """Replay skewed traffic (a few users are very active) against a small hot tier over SQLite.
+
+    Each turn loads the session's history and saves a user/assistant pair, like an agent run.
+    A user's session ends after ``turns_per_session`` turns and their next turn starts a new one.
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        provider = TieredHistoryProvider(
+            SQLiteColdStore(os.path.join(tmp, "bench.sqlite3")), max_hot_bytes=max_hot_bytes, idle_seconds=0.5
+        )
+        session_ids = [str(uuid.uuid4()) for _ in range(users)]
+        session_turns = [0] * users
+        # Zipf-like popularity: user i is picked with weight 1 / (i + 1)
+        picks = random.choices(range(users), weights=[1 / (i + 1) for i in range(users)], k=turns)
+        turn = [
+            Message(role="user", text="What's the weather like in Tokyo?"),
+            Message(role="assistant", text="The weather in Tokyo is sunny with a high of 21°C."),
+        ]
+        hot, new, promoted = [], [], []
+        start = time.perf_counter()
+        for user in picks:
+            if session_turns[user] == turns_per_session:
+                session_ids[user], session_turns[user] = str(uuid.uuid4()), 0
+            session_turns[user] += 1
+            session_id = session_ids[user]
+            promotions, new_sessions = provider.stats["promotions"], provider.stats["new_sessions"]
+            turn_start = time.perf_counter()
+            await provider.get_messages(session_id)
+            await provider.save_messages(session_id, turn)
+            if provider.stats["promotions"] > promotions:
+                promoted.append(time.perf_counter() - turn_start)
+            elif provider.stats["new_sessions"] > new_sessions:
+                new.append(time.perf_counter() - turn_start)
+            else:
+                hot.append(time.perf_counter() - turn_start)
+            await asyncio.sleep(0)  # a real turn would wait on the model here, letting the write-back task run
+        seconds = time.perf_counter() - start
+        stats = provider.stats
+        print(f"[bold]Turns:[/bold] {turns:,} from {users:,} users in {seconds:.1f}s ({turns / seconds:,.0f}/s)")
+        print(
+            f"  hot turns: {len(hot):,}, p50 {statistics.median(hot) * 1e6:.0f} µs | "
+            f"promoted from SQLite: {len(promoted):,}, p50 {statistics.median(promoted) * 1e3:.2f} ms | "
+            f"new sessions: {len(new):,}"
+        )
+        print(
+            f"  hot tier: {provider.hot_size / 1e6:.1f} MB of {max_hot_bytes / 1e6:.1f} MB, "
+            f"{len(provider._hot):,} sessions, {stats['evictions']:,} evictions"
+        )
+        await provider.close()
+        print(f"  {stats['messages_written']:,} messages written back in {stats['write_backs']:,} batches")
+
+
+if __name__ == "__main__":
+    if "--benchmark" in sys.argv:
+        asyncio.run(benchmark())
+    else:
+        asyncio.run(main())
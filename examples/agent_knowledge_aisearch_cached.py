@@ -0,0 +1,411 @@
+"""
+Knowledge retrieval using Azure AI Search with a session-scoped retrieval cache.
+
+Diagram:
+
+ Input ──▶ Agent ──────────────────────────────▶ LLM ──▶ Response
+             │                                    ▲
+             │  normalized query                  │ grounding
+             ▼                                    │
+     ┌──────────────────┐   hit / reuse           │
+     │ Retrieval cache  │─────────────────────────┤
+     │ (session.state)  │                         │
+     └───────┬──────────┘                         │
+             │ miss                               │
+             ▼                                    │
+     ┌──────────────────┐                         │
+     │ Search transport │─────────────────────────┘
+     │ (Azure AI Search │
+     │  or local fake)  │
+     └──────────────────┘
+
+agent_knowledge_aisearch.py uses agentic mode, which issues a full
+Knowledge Base retrieval round-trip on every turn — even for follow-ups
+that the previous turn's grounding already answers. This example wraps
+the retrieval in a caching context provider that:
+
+  1. Memoizes results per session and per normalized query, so a repeated
+     (or reworded) question never goes back to the search service.
+  2. Reuses the previous turn's grounding when the follow-up's key terms
+     are already covered by it.
+  3. Records cache outcomes, retrieval latency, and query units saved as
+     OpenTelemetry metrics (export them with OTEL_EXPORTER_OTLP_ENDPOINT,
+     see agent_otel_aspire.py).
+
+On a miss, the transport is given the recent conversation along with the
+query, as AzureAISearchContextProvider would see it, so a follow-up like
+"how do I apply it?" keeps its referent. Run with
+``--fake-search`` to use a local in-process fake search endpoint instead
+of Azure AI Search (no Azure resources needed for retrieval).
+
+Requires (unless --fake-search is used):
+  - An Azure AI Search service with a Knowledge Base
+
+Environment variables:
+  - AZURE_SEARCH_ENDPOINT: Your Azure AI Search endpoint
+  - AZURE_SEARCH_KNOWLEDGE_BASE_NAME: Your Knowledge Base name
+  - Plus the standard API_HOST / model config (see other examples)
+
+Run:
+    uv run examples/agent_knowledge_aisearch_cached.py
+    uv run examples/agent_knowledge_aisearch_cached.py --fake-search
+"""
+
+import asyncio
+import contextlib
+import logging
+import os
+import re
+import sys
+import time
+from typing import Any, Protocol
+
+from agent_framework import (
+    Agent,
+    AgentSession,
+    BaseContextProvider,
+    InMemoryHistoryProvider,
+    Message,
+    SessionContext,
+    SupportsAgentRun,
+)
+from agent_framework.azure import AzureAISearchContextProvider
+from agent_framework.observability import configure_otel_providers, get_meter
+from agent_framework.openai import OpenAIChatClient
+from azure.identity.aio import DefaultAzureCredential, get_bearer_token_provider
+from dotenv import load_dotenv
+from rich import print
+from rich.logging import RichHandler
+
+# ── Logging ──────────────────────────────────────────────────────────
+handler = RichHandler(show_path=False, rich_tracebacks=True, show_level=False)
+logging.basicConfig(level=logging.WARNING, handlers=[handler], force=True, format="%(message)s")
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# ── Configuration ────────────────────────────────────────────────────
+load_dotenv(override=True)
+API_HOST = os.getenv("API_HOST", "github")
+USE_FAKE_SEARCH = "--fake-search" in sys.argv
+
+# Exporters are configured from OTEL_* environment variables (no-op when unset)
+configure_otel_providers()
+
+# ── OpenAI client ────────────────────────────────────────────────────
+
+async_credential = None
+if API_HOST == "azure":
+    async_credential = DefaultAzureCredential()
+    token_provider = get_bearer_token_provider(async_credential, "https://cognitiveservices.azure.com/.default")
+    client = OpenAIChatClient(
+        base_url=f"{os.environ['AZURE_OPENAI_ENDPOINT']}/openai/v1/",
+        api_key=token_provider,
+        model_id=os.environ["AZURE_OPENAI_CHAT_DEPLOYMENT"],
+    )
+elif API_HOST == "github":
+    client = OpenAIChatClient(
+        base_url="https://models.github.ai/inference",
+        api_key=os.environ["GITHUB_TOKEN"],
+        model_id=os.getenv("GITHUB_MODEL", "openai/gpt-4.1-mini"),
+    )
+else:
+    client = OpenAIChatClient(
+        api_key=os.environ["OPENAI_API_KEY"], model_id=os.environ.get("OPENAI_MODEL", "gpt-4.1-mini")
+    )
+
+
+# ── Search transports ────────────────────────────────────────────────
+
+
+class SearchTransport(Protocol):
+    """Anything that can turn a conversation into a list of grounding passages.
+
+    ``messages`` are the recent user and assistant messages, oldest first, ending
+    with the query being answered.
+    """
+
+    async def retrieve(self, messages: list[Message]) -> list[str]: ...
+
+
+class AzureAISearchTransport:
+    """Transport that delegates retrieval to the built-in AzureAISearchContextProvider.
+
+    The provider is driven through its public ``before_run`` hook with a scratch
+    SessionContext holding the recent conversation, so any retrieval mode it supports
+    (semantic or agentic) works, and agentic mode trims it to its own
+    ``agentic_message_history_count`` as usual.
+    """
+
+    def __init__(self, provider: AzureAISearchContextProvider):
+        self.provider = provider
+
+    async def retrieve(self, messages: list[Message]) -> list[str]:
+        scratch = SessionContext(input_messages=messages)
+        await self.provider.before_run(
+            agent=None,  # type: ignore[arg-type]
+            session=AgentSession(),
+            context=scratch,
+            state={},
+        )
+        passages = [msg.text for msg in scratch.get_messages() if msg.text]
+        # The first message is the provider's context prompt, not a passage
+        return passages[1:] if passages and passages[0] == self.provider.context_prompt else passages
+
+
+FAKE_DOCUMENTS = [
+    "Zava Premium Interior Paint (Eggshell, $42.99/gal): low-VOC acrylic paint for living rooms and bedrooms. "
+    "Apply two coats with a 3/8-inch nap roller for smooth walls; one gallon covers about 400 sq ft.",
+    "Zava Matte Ceiling Paint ($36.50/gal): flat white paint that hides imperfections. "
+    "Apply with an extension pole and roller.",
+    "ProRoll Paint Roller Kit ($18.99): 9-inch roller frame, two 3/8-inch nap covers, and a paint tray. "
+    "Recommended supplies for applying interior paint.",
+    "EdgeMaster Angled Brush 2.5-inch ($12.49): for cutting in corners and trim when you apply paint.",
+    "ClearLine Painter's Tape ($6.99): protects trim and windows; remove within 7 days.",
+    "SafeCover Canvas Drop Cloth 9x12 ($24.00): reusable drop cloth to protect floors while you paint.",
+]
+
+
+class FakeSearchTransport:
+    """A local fake search endpoint: keyword scoring over a few product documents.
+
+    Simulates the round-trip latency of a real retrieval call so the cache savings
+    are visible without provisioning Azure AI Search. Like semantic mode, the query
+    is the recent conversation joined together.
+    """
+
+    def __init__(self, documents: list[str], latency_seconds: float = 0.8, top_k: int = 3):
+        self.documents = documents
+        self.latency_seconds = latency_seconds
+        self.top_k = top_k
+        self.calls = 0
+
+    async def retrieve(self, messages: list[Message]) -> list[str]:
+        self.calls += 1
+        await asyncio.sleep(self.latency_seconds)
+        terms = content_terms(" ".join(msg.text for msg in messages))
+        scored = [(len(terms & content_terms(doc)), doc) for doc in self.documents]
+        ranked = sorted((item for item in scored if item[0] > 0), key=lambda item: item[0], reverse=True)
+        return [doc for _, doc in ranked[: self.top_k]]
+
+
+# ── Query normalization ──────────────────────────────────────────────
+
+STOPWORDS = {
+    "a", "an", "and", "any", "are", "can", "do", "does", "for", "have", "how", "i", "in", "is", "it",
+    "kind", "me", "my", "of", "on", "or", "should", "that", "the", "them", "these", "this", "those",
+    "to", "what", "which", "with", "you", "your",
+}  # fmt: skip
+
+
+def content_terms(text: str) -> set[str]:
+    """Lowercased alphanumeric terms minus stopwords, with a naive plural strip."""
+    terms = set()
+    for word in re.findall(r"[a-z0-9]+", text.lower()):
+        if word in STOPWORDS or len(word) < 2:
+            continue
+        terms.add(word[:-1] if len(word) > 3 and word.endswith("s") and not word.endswith("ss") else word)
+    return terms
+
+
+def normalize_query(text: str) -> str:
+    """Order-insensitive cache key, so rewordings of the same question share an entry."""
+    return " ".join(sorted(content_terms(text)))
+
+
+# ── Caching context provider ─────────────────────────────────────────
+
+meter = get_meter("agent_knowledge_aisearch_cached")
+lookup_counter = meter.create_counter(
+    "search_cache.lookups", unit="1", description="Retrieval lookups by outcome (hit, reuse, miss)"
+)
+retrieval_duration = meter.create_histogram(
+    "search_cache.retrieval.duration", unit="s", description="Time to produce grounding, by outcome"
+)
+query_units_saved = meter.create_counter(
+    "search_cache.query_units_saved", unit="1", description="Search query units avoided by the cache"
+)
+latency_saved = meter.create_counter(
+    "search_cache.latency_saved", unit="s", description="Estimated retrieval latency avoided by the cache"
+)
+
+
+class CachedSearchContextProvider(BaseContextProvider):
+    """Context provider that memoizes search results per session and per normalized query.
+
+    Cache entries live in the provider-scoped session state, so they are isolated
+    per session and survive ``AgentSession.to_dict()`` / ``from_dict()`` round-trips.
+
+    On each turn the provider either:
+      - hits: the normalized query was already retrieved in this session,
+      - reuses: the previous turn's grounding covers at least ``reuse_threshold``
+        of the query's key terms, or
+      - misses: calls the transport with the last ``history_messages`` user and
+        assistant messages of the conversation, and stores the result.
+
+    Register it after the agent's history provider, so the conversation loaded for
+    this turn is in the context.
+    """
+
+    def __init__(
+        self,
+        transport: SearchTransport,
+        *,
+        source_id: str = "cached-search",
+        context_prompt: str = "Use the following context to answer the question:",
+        max_entries: int = 32,
+        reuse_threshold: float = 0.6,
+        query_units_per_retrieval: int = 1,
+        history_messages: int = 10,
+    ):
+        super().__init__(source_id=source_id)
+        self.transport = transport
+        self.context_prompt = context_prompt
+        self.max_entries = max_entries
+        self.reuse_threshold = reuse_threshold
+        self.query_units_per_retrieval = query_units_per_retrieval
+        self.history_messages = history_messages
+        # Running average of real retrieval latency, used to estimate savings
+        self._miss_seconds = 0.0
+        self._miss_count = 0
+
+    def _lookup(self, state: dict[str, Any], user_text: str) -> tuple[str, list[str] | None]:
+        """Return (outcome, passages) from the session cache without calling the transport."""
+        entries: dict[str, list[str]] = state.setdefault("entries", {})
+        key = normalize_query(user_text)
+        if key in entries:
+            # Move to the end to keep most-recently-used ordering
+            entries[key] = entries.pop(key)
+            return "hit", entries[key]
+
+        last_grounding: list[str] = state.get("last_grounding", [])
+        terms = content_terms(user_text)
+        if last_grounding and terms:
+            covered = terms & content_terms(" ".join(last_grounding))
+            if len(covered) / len(terms) >= self.reuse_threshold:
+                return "reuse", last_grounding
+        return "miss", None
+
+    def _store(self, state: dict[str, Any], user_text: str, passages: list[str]) -> None:
+        entries: dict[str, list[str]] = state.setdefault("entries", {})
+        entries[normalize_query(user_text)] = passages
+        while len(entries) > self.max_entries:
+            entries.pop(next(iter(entries)))
+
+    async def before_run(
+        self,
+        *,
+        agent: SupportsAgentRun,
+        session: AgentSession,
+        context: SessionContext,
+        state: dict[str, Any],
+    ) -> None:
+        """Serve grounding from the session cache when possible, otherwise retrieve and cache it."""
+        user_text = next(
+            (msg.text for msg in reversed(context.input_messages) if msg.role == "user" and msg.text), None
+        )
+        if not user_text:
+            return
+
+        start = time.perf_counter()
+        outcome, passages = self._lookup(state, user_text)
+        if passages is None:
+            conversation = [
+                msg
+                for msg in context.get_messages(include_input=True)
+                if msg.role in ("user", "assistant") and msg.text and msg.text.strip()
+            ]
+            passages = await self.transport.retrieve(conversation[-self.history_messages :])
+            self._miss_count += 1
+            self._miss_seconds += time.perf_counter() - start
+            self._store(state, user_text, passages)
+        elif outcome == "hit":
+            self._store(state, user_text, passages)
+        elapsed = time.perf_counter() - start
+
+        attributes = {"outcome": outcome, "source_id": self.source_id}
+        lookup_counter.add(1, attributes)
+        retrieval_duration.record(elapsed, attributes)
+        if outcome != "miss":
+            query_units_saved.add(self.query_units_per_retrieval, attributes)
+            if self._miss_count:
+                latency_saved.add(self._miss_seconds / self._miss_count - elapsed, attributes)
+        logger.info("[🔎 Search cache] %s in %.1f ms for: %s", outcome, elapsed * 1000, user_text)
+
+        state["last_grounding"] = passages
+        if not passages:
+            return
+        context.extend_messages(
+            self.source_id,
+            [Message(role="user", text=self.context_prompt), *(Message(role="user", text=p) for p in passages)],
+        )
+
+
+# ── Transport + agent setup ──────────────────────────────────────────
+
+search_credential = None
+search_provider = None
+if USE_FAKE_SEARCH:
+    transport: SearchTransport = FakeSearchTransport(FAKE_DOCUMENTS)
+    KNOWLEDGE_BASE_NAME = "local fake"
+else:
+    KNOWLEDGE_BASE_NAME = os.environ["AZURE_SEARCH_KNOWLEDGE_BASE_NAME"]
+    search_credential = DefaultAzureCredential()
+    search_provider = AzureAISearchContextProvider(
+        endpoint=os.environ["AZURE_SEARCH_ENDPOINT"],
+        credential=search_credential,
+        knowledge_base_name=KNOWLEDGE_BASE_NAME,
+        mode="agentic",
+    )
+    transport = AzureAISearchTransport(search_provider)
+
+cached_search = CachedSearchContextProvider(transport)
+
+agent = Agent(
+    client=client,
+    name="cached-search-agent",
+    instructions=(
+        "You are a helpful home improvement shopping assistant. "
+        "Answer customer questions using the product information provided in the context. "
+        "If no relevant products are found, say you don't have information about that item. "
+    ),
+    # The history provider runs first, so the cache sees the conversation when it retrieves
+    context_providers=[InMemoryHistoryProvider(), cached_search],
+)
+
+
+async def main() -> None:
+    """Demonstrate cache misses, follow-up reuse, and normalized-query hits in one session."""
+    print("\n[bold]=== Knowledge Retrieval with a session-scoped search cache ===[/bold]")
+    print(f"[dim]Knowledge Base: {KNOWLEDGE_BASE_NAME}[/dim]\n")
+
+    async with contextlib.AsyncExitStack() as stack:
+        if search_provider is not None:
+            await stack.enter_async_context(search_provider)
+
+        session = agent.create_session()
+        user_messages = [
+            # Miss: first retrieval in this session
+            "What kind of interior paint do you have for a living room?",
+            # Follow-up: answered from the previous turn's grounding when its key terms are covered
+            "What supplies do I need to apply it?",
+            # Hit: same normalized query as turn 1, worded differently
+            "For a living room, what interior paint do you have?",
+        ]
+        for user_msg in user_messages:
+            print(f"[blue]User:[/blue] {user_msg}")
+            response = await agent.run(user_msg, session=session)
+            print(f"[green]Agent:[/green] {response.text}\n")
+
+    if search_credential:
+        await search_credential.close()
+    if async_credential:
+        await async_credential.close()
+
+
+if __name__ == "__main__":
+    if "--devui" in sys.argv:
+        from agent_framework.devui import serve
+
+        serve(entities=[agent], auto_open=True)
+    else:
+        asyncio.run(main())
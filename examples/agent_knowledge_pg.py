@@ -26,11 +26,13 @@ See also: agent_knowledge_sqlite.py for a simpler SQLite-only (keyword search) v
 """
 
 import asyncio
+import base64
 import logging
 import os
 import sys
 from typing import Any
 
+import numpy as np
 import psycopg
 from openai import OpenAI
 from pgvector.psycopg import register_vector
@@ -93,10 +95,23 @@ else:
     embed_model = "text-embedding-3-small"
 
 
-def get_embedding(text: str) -> list[float]:
-    """Get an embedding vector for the given text."""
-    response = embed_client.embeddings.create(input=text, model=embed_model, dimensions=EMBEDDING_DIMENSIONS)
-    return response.data[0].embedding
+def get_embeddings(texts: list[str]) -> np.ndarray:
+    """Get embeddings for a batch of texts as a (len(texts), EMBEDDING_DIMENSIONS) float32 matrix.
+
+    Requesting base64 returns the raw float32 bytes, which decode straight into the matrix.
+    """
+    response = embed_client.embeddings.create(
+        input=texts, model=embed_model, dimensions=EMBEDDING_DIMENSIONS, encoding_format="base64"
+    )
+    matrix = np.empty((len(texts), EMBEDDING_DIMENSIONS), dtype=np.float32)
+    for item in response.data:
+        matrix[item.index] = np.frombuffer(base64.b64decode(item.embedding), dtype=np.float32)
+    return matrix
+
+
+def get_embedding(text: str) -> np.ndarray:
+    """Get an embedding vector for the given text as a float32 array."""
+    return get_embeddings([text])[0]
 
 
 # ── Knowledge store (PostgreSQL + pgvector) ──────────────────────────
@@ -201,12 +216,15 @@ def create_knowledge_db(conn: psycopg.Connection) -> None:
     )
 
     logger.info("[📚 Knowledge] Generating embeddings for %d products...", len(PRODUCTS))
-    for product in PRODUCTS:
-        text_for_embedding = f"{product['name']} - {product['category']}: {product['description']}"
-        embedding = get_embedding(text_for_embedding)
-        conn.execute(
+    embeddings = get_embeddings([f"{p['name']} - {p['category']}: {p['description']}" for p in PRODUCTS])
+    # pgvector's adapter takes the float32 rows directly
+    with conn.cursor() as cursor:
+        cursor.executemany(
             "INSERT INTO products (name, category, price, description, embedding) VALUES (%s, %s, %s, %s, %s)",
-            (product["name"], product["category"], product["price"], product["description"], embedding),
+            [
+                (product["name"], product["category"], product["price"], product["description"], embedding)
+                for product, embedding in zip(PRODUCTS, embeddings)
+            ],
         )
 
     conn.commit()
@@ -0,0 +1,529 @@
+"""
+Metrics middleware: OpenTelemetry histograms and counters for agent, chat and function calls.
+
+The logging middleware in agent_middleware.py shows what happens on one run; these
+record it as metrics, so latency percentiles, token spend and error rates can be
+graphed and alerted on:
+
+ ┌─────────────────────────────────────────────────────────────────────┐
+ │ MetricsAgentMiddleware      agent.run.duration       histogram (s)  │
+ │                             agent.run.errors         counter        │
+ │  ┌───────────────────────────────────────────────────────────────┐  │
+ │  │ MetricsChatMiddleware    agent.chat.duration      histogram (s)│  │
+ │  │                          agent.chat.messages      histogram    │  │
+ │  │                          agent.chat.tokens        counter      │  │
+ │  │                          agent.chat.errors        counter      │  │
+ │  │  ┌─────────────────────────────────────────────────────────┐  │  │
+ │  │  │ MetricsFunctionMiddleware agent.tool.duration histogram │  │  │
+ │  │  │                           agent.tool.errors   counter   │  │  │
+ │  │  └─────────────────────────────────────────────────────────┘  │  │
+ │  └───────────────────────────────────────────────────────────────┘  │
+ └─────────────────────────────────────────────────────────────────────┘
+
+Every metric is labelled with ``agent.name``, tool metrics also with ``tool.name``
+and token counts with ``token.type`` (input or output). The metrics are collected
+by an OpenTelemetry MeterProvider and served in the Prometheus text format on
+http://127.0.0.1:9464/metrics. Adding an OTLP reader to the same MeterProvider
+would also send them to the Aspire Dashboard (see agent_otel_aspire.py).
+
+Run:
+    uv run examples/agent_middleware_metrics.py              # a few runs, then print the metrics
+    uv run examples/agent_middleware_metrics.py --serve      # ...and keep serving /metrics
+    uv run examples/agent_middleware_metrics.py --benchmark  # overhead per call, no LLM calls
+"""
+
+import asyncio
+import logging
+import math
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections.abc import Awaitable, Callable, Mapping
+from contextvars import ContextVar
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Annotated, Any
+
+from agent_framework import (
+    Agent,
+    AgentContext,
+    AgentMiddleware,
+    ChatContext,
+    ChatMiddleware,
+    ChatResponse,
+    ChatResponseUpdate,
+    FunctionInvocationContext,
+    FunctionMiddleware,
+    Message,
+    tool,
+)
+from agent_framework.openai import OpenAIChatClient
+from azure.identity.aio import DefaultAzureCredential, get_bearer_token_provider
+from dotenv import load_dotenv
+from opentelemetry.metrics import Meter
+from opentelemetry.sdk.metrics import MeterProvider
+from opentelemetry.sdk.metrics.export import HistogramDataPoint, InMemoryMetricReader, NumberDataPoint
+from pydantic import Field
+from rich import print
+from rich.logging import RichHandler
+from rich.table import Table
+
+# Setup logging
+handler = RichHandler(show_path=False, rich_tracebacks=True, show_level=False)
+logging.basicConfig(level=logging.WARNING, handlers=[handler], force=True, format="%(message)s")
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# Configure OpenAI client based on environment
+load_dotenv(override=True)
+API_HOST = os.getenv("API_HOST", "github")
+
+async_credential = None
+if API_HOST == "azure":
+    async_credential = DefaultAzureCredential()
+    token_provider = get_bearer_token_provider(async_credential, "https://cognitiveservices.azure.com/.default")
+    client = OpenAIChatClient(
+        base_url=f"{os.environ['AZURE_OPENAI_ENDPOINT']}/openai/v1/",
+        api_key=token_provider,
+        model_id=os.environ["AZURE_OPENAI_CHAT_DEPLOYMENT"],
+    )
+elif API_HOST == "github":
+    client = OpenAIChatClient(
+        base_url="https://models.github.ai/inference",
+        api_key=os.environ["GITHUB_TOKEN"],
+        model_id=os.getenv("GITHUB_MODEL", "openai/gpt-4.1-mini"),
+    )
+else:
+    client = OpenAIChatClient(api_key=os.environ["OPENAI_API_KEY"], model_id=os.environ.get("OPENAI_MODEL", "gpt-4o"))
+
+
+# ---- Tools ----
+
+
+@tool
+def get_weather(
+    city: Annotated[str, Field(description="The city to get the weather for.")],
+) -> dict:
+    """Return weather data for a given city, a dictionary with temperature and description."""
+    if random.random() < 0.05:
+        return {"temperature": 72, "description": "Sunny"}
+    else:
+        return {"temperature": 60, "description": "Rainy"}
+
+
+@tool
+def get_current_date() -> str:
+    """Get the current date from the system and return as a string in format YYYY-MM-DD."""
+    return datetime.now().strftime("%Y-%m-%d")
+
+
+# ---- Metrics ----
+
+# Bucket boundaries: seconds for latencies (LLM calls take seconds, tools milliseconds), and message counts
+DURATION_BUCKETS = [0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60]
+MESSAGE_BUCKETS = [1, 2, 4, 8, 16, 32, 64, 128, 256]
+
+# The running agent's name, set by MetricsAgentMiddleware for the chat and function calls it makes
+current_agent_name: ContextVar[str] = ContextVar("current_agent_name", default="")
+
+
+class AgentMetrics:
+    """The instruments the metrics middleware record to, created from one OpenTelemetry Meter.
+
+    Measurements go straight into the instruments, so the cost of recording is paid
+    on the request path: the SDK validates and hashes the attributes and takes a lock
+    for each one (``--benchmark`` shows what that adds per call). Attribute dicts are
+    built once per label combination and reused.
+    """
+
+    def __init__(self, meter: Meter) -> None:
+        self.run_duration = meter.create_histogram(
+            "agent.run.duration",
+            unit="s",
+            description="Duration of agent runs",
+            explicit_bucket_boundaries_advisory=DURATION_BUCKETS,
+        )
+        self.run_errors = meter.create_counter("agent.run.errors", description="Agent runs that raised an exception")
+        self.chat_duration = meter.create_histogram(
+            "agent.chat.duration",
+            unit="s",
+            description="Duration of chat client requests",
+            explicit_bucket_boundaries_advisory=DURATION_BUCKETS,
+        )
+        self.chat_messages = meter.create_histogram(
+            "agent.chat.messages",
+            description="Messages sent per chat client request",
+            explicit_bucket_boundaries_advisory=MESSAGE_BUCKETS,
+        )
+        self.chat_tokens = meter.create_counter("agent.chat.tokens", description="Tokens reported by the model")
+        self.chat_errors = meter.create_counter("agent.chat.errors", description="Chat requests that raised")
+        self.tool_duration = meter.create_histogram(
+            "agent.tool.duration",
+            unit="s",
+            description="Duration of tool calls",
+            explicit_bucket_boundaries_advisory=DURATION_BUCKETS,
+        )
+        self.tool_errors = meter.create_counter("agent.tool.errors", description="Tool calls that raised")
+        self._labels: dict[tuple[str, str | None], dict[str, str]] = {}
+        self._token_labels: dict[str, tuple[dict[str, str], dict[str, str]]] = {}
+
+    def labels(self, agent_name: str, tool_name: str | None = None) -> dict[str, str]:
+        """Return the attributes for an agent, or for one of its tools."""
+        attributes = self._labels.get((agent_name, tool_name))
+        if attributes is None:
+            attributes = {"agent.name": agent_name}
+            if tool_name is not None:
+                attributes["tool.name"] = tool_name
+            self._labels[(agent_name, tool_name)] = attributes
+        return attributes
+
+    def token_labels(self, agent_name: str) -> tuple[dict[str, str], dict[str, str]]:
+        """Return the attributes for an agent's input and output tokens."""
+        labels = self._token_labels.get(agent_name)
+        if labels is None:
+            labels = self._token_labels[agent_name] = (
+                {"agent.name": agent_name, "token.type": "input"},
+                {"agent.name": agent_name, "token.type": "output"},
+            )
+        return labels
+
+
+class MetricsAgentMiddleware(AgentMiddleware):
+    """Agent middleware that records run latency and errors, labelled by agent name.
+
+    A streaming run only makes its chat and tool calls while the stream is iterated,
+    after ``process`` has returned. So for streaming runs the agent name stays set
+    until the stream ends, and the latency, or the error that ended the stream, is
+    recorded from a cleanup hook then (result hooks only run if the caller asks for
+    the final response).
+    """
+
+    def __init__(self, metrics: AgentMetrics) -> None:
+        self.metrics = metrics
+
+    async def process(
+        self,
+        context: AgentContext,
+        call_next: Callable[[], Awaitable[None]],
+    ) -> None:
+        """Time the run, making the agent name available to the chat and function middleware."""
+        attributes = self.metrics.labels(getattr(context.agent, "name", None) or "")
+        previous = current_agent_name.get()
+        token = current_agent_name.set(attributes["agent.name"])
+        start = time.perf_counter()
+        try:
+            await call_next()
+        except Exception:
+            self.metrics.run_errors.add(1, attributes)
+            current_agent_name.reset(token)
+            raise
+
+        if not context.stream:
+            current_agent_name.reset(token)
+            self.metrics.run_duration.record(time.perf_counter() - start, attributes)
+            return
+
+        def cleanup() -> None:
+            if _stream_error() is None:
+                self.metrics.run_duration.record(time.perf_counter() - start, attributes)
+            else:
+                self.metrics.run_errors.add(1, attributes)
+            # Iteration may continue in another task, where the token can't be reset
+            current_agent_name.set(previous)
+
+        context.stream_cleanup_hooks.append(cleanup)
+
+
+def _stream_error() -> BaseException | None:
+    """Return the exception that ended a stream, when called from one of its cleanup hooks.
+
+    A ResponseStream runs its cleanup hooks from the ``except`` block that caught the end of
+    the stream, so the exception being handled is StopAsyncIteration unless iteration failed.
+    """
+    error = sys.exc_info()[1]
+    return None if error is None or isinstance(error, StopAsyncIteration) else error
+
+
+class MetricsChatMiddleware(ChatMiddleware):
+    """Chat middleware that records request latency, messages sent, tokens used and errors.
+
+    Token counts come from the response's ``usage_details``, so they are exactly what
+    the model reported. For streaming requests they are added up from the usage in the
+    updates, and recorded with the latency, or the error raised while the stream was
+    iterated, when the stream ends.
+    """
+
+    def __init__(self, metrics: AgentMetrics) -> None:
+        self.metrics = metrics
+
+    async def process(
+        self,
+        context: ChatContext,
+        call_next: Callable[[], Awaitable[None]],
+    ) -> None:
+        """Count the messages going out, then time the request and count the tokens coming back."""
+        attributes = self.metrics.labels(current_agent_name.get())
+        self.metrics.chat_messages.record(len(context.messages), attributes)
+        start = time.perf_counter()
+        try:
+            await call_next()
+        except Exception:
+            self.metrics.chat_errors.add(1, attributes)
+            raise
+
+        if not context.stream:
+            self._record(getattr(context.result, "usage_details", None), start, attributes)
+            return
+
+        usage: dict[str, int] = {}
+
+        def count(update: ChatResponseUpdate) -> ChatResponseUpdate:
+            for content in update.contents:
+                if content.type == "usage" and content.usage_details:
+                    for key in ("input_token_count", "output_token_count"):
+                        usage[key] = usage.get(key, 0) + (content.usage_details.get(key) or 0)
+            return update
+
+        def cleanup() -> None:
+            if _stream_error() is None:
+                self._record(usage, start, attributes)
+            else:
+                self.metrics.chat_errors.add(1, attributes)
+
+        context.stream_transform_hooks.append(count)
+        context.stream_cleanup_hooks.append(cleanup)
+
+    def _record(self, usage: Mapping[str, Any] | None, start: float, attributes: dict[str, str]) -> None:
+        self.metrics.chat_duration.record(time.perf_counter() - start, attributes)
+        if usage:
+            input_labels, output_labels = self.metrics.token_labels(attributes["agent.name"])
+            if usage.get("input_token_count"):
+                self.metrics.chat_tokens.add(usage["input_token_count"], input_labels)
+            if usage.get("output_token_count"):
+                self.metrics.chat_tokens.add(usage["output_token_count"], output_labels)
+
+
+class MetricsFunctionMiddleware(FunctionMiddleware):
+    """Function middleware that records tool latency and errors, labelled by agent and tool name."""
+
+    def __init__(self, metrics: AgentMetrics) -> None:
+        self.metrics = metrics
+
+    async def process(
+        self,
+        context: FunctionInvocationContext,
+        call_next: Callable[[], Awaitable[None]],
+    ) -> None:
+        """Time the tool call."""
+        attributes = self.metrics.labels(current_agent_name.get(), context.function.name)
+        start = time.perf_counter()
+        try:
+            await call_next()
+        except Exception:
+            self.metrics.tool_errors.add(1, attributes)
+            raise
+        self.metrics.tool_duration.record(time.perf_counter() - start, attributes)
+
+
+# ---- Prometheus endpoint ----
+
+
+def _prometheus_name(name: str) -> str:
+    return re.sub(r"[^a-zA-Z0-9_:]", "_", name)
+
+
+def _prometheus_labels(attributes: Any, extra: dict[str, str] | None = None) -> str:
+    pairs = {**(attributes or {}), **(extra or {})}
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for value in pairs.values())
+    return "{" + ",".join(f'{_prometheus_name(key)}="{value}"' for key, value in zip(pairs, escaped)) + "}"
+
+
+def _prometheus_value(value: float) -> str:
+    return "+Inf" if value == math.inf else repr(value)
+
+
+class PrometheusEndpoint:
+    """Serves the metrics collected by ``reader`` in the Prometheus text exposition format.
+
+    Metrics are collected when scraped, so nothing runs between scrapes. Names follow the
+    Prometheus conventions: dots become underscores, seconds get a ``_seconds`` suffix and
+    counters a ``_total`` suffix.
+    """
+
+    def __init__(self, reader: InMemoryMetricReader, host: str = "127.0.0.1", port: int = 9464) -> None:
+        self.reader = reader
+        self.host = host
+        self.port = port
+        self._server: ThreadingHTTPServer | None = None
+
+    def render(self) -> str:
+        """Collect the current metrics and return them in the text exposition format."""
+        lines: list[str] = []
+        data = self.reader.get_metrics_data()
+        for resource_metrics in data.resource_metrics if data else []:
+            for scope_metrics in resource_metrics.scope_metrics:
+                for metric in scope_metrics.metrics:
+                    name = _prometheus_name(metric.name) + ("_seconds" if metric.unit == "s" else "")
+                    points = metric.data.data_points
+                    if points and isinstance(points[0], HistogramDataPoint):
+                        lines += [f"# HELP {name} {metric.description}", f"# TYPE {name} histogram"]
+                        for point in points:
+                            cumulative = 0
+                            for bound, count in zip([*point.explicit_bounds, math.inf], point.bucket_counts):
+                                cumulative += count
+                                labels = _prometheus_labels(point.attributes, {"le": _prometheus_value(bound)})
+                                lines.append(f"{name}_bucket{labels} {cumulative}")
+                            labels = _prometheus_labels(point.attributes)
+                            lines.append(f"{name}_sum{labels} {_prometheus_value(point.sum)}")
+                            lines.append(f"{name}_count{labels} {point.count}")
+                    elif points and isinstance(points[0], NumberDataPoint):
+                        monotonic = getattr(metric.data, "is_monotonic", False)
+                        if monotonic:
+                            name += "_total"
+                        lines += [
+                            f"# HELP {name} {metric.description}",
+                            f"# TYPE {name} {'counter' if monotonic else 'gauge'}",
+                        ]
+                        for point in points:
+                            lines.append(
+                                f"{name}{_prometheus_labels(point.attributes)} {_prometheus_value(point.value)}"
+                            )
+        return "\n".join(lines) + "\n"
+
+    def start(self) -> None:
+        """Serve GET /metrics from a background thread."""
+        endpoint = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self) -> None:
+                if self.path != "/metrics":
+                    self.send_error(404)
+                    return
+                body = endpoint.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format: str, *args: Any) -> None:
+                pass  # scrapes would flood the log
+
+        self._server = ThreadingHTTPServer((self.host, self.port), Handler)
+        threading.Thread(target=self._server.serve_forever, name="prometheus-endpoint", daemon=True).start()
+
+    def stop(self) -> None:
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+
+
+# ---- Agent setup ----
+
+metric_reader = InMemoryMetricReader()
+meter_provider = MeterProvider(metric_readers=[metric_reader])
+metrics = AgentMetrics(meter_provider.get_meter(__name__))
+prometheus = PrometheusEndpoint(metric_reader)
+
+agent = Agent(
+    name="metrics-demo",
+    client=client,
+    instructions="You help users plan their weekends. Use the available tools to check the weather and date.",
+    tools=[get_weather, get_current_date],
+    middleware=[
+        MetricsAgentMiddleware(metrics),
+        MetricsChatMiddleware(metrics),
+        MetricsFunctionMiddleware(metrics),
+    ],
+)
+
+
+async def main() -> None:
+    """Run the agent a few times, then show the metrics as Prometheus would scrape them."""
+    prometheus.start()
+    print(f"[dim]Serving metrics on http://{prometheus.host}:{prometheus.port}/metrics[/dim]\n")
+
+    for question in [
+        "What's the weather like this weekend in San Francisco?",
+        "What's today's date, and what's the weather in Portland?",
+        "Should I pack an umbrella for Seattle?",
+    ]:
+        print(f"[blue]User:[/blue] {question}")
+        response = await agent.run(question)
+        print(f"[green]Agent:[/green] {response.text}\n")
+
+    print(prometheus.render())
+
+    if "--serve" in sys.argv:
+        print("[dim]Press Ctrl+C to stop serving.[/dim]")
+        try:
+            await asyncio.Event().wait()
+        finally:
+            prometheus.stop()
+    else:
+        prometheus.stop()
+
+    if async_credential:
+        await async_credential.close()
+
+
+async def benchmark(calls: int = 100_000) -> None:
+    """Measure the time each metrics middleware adds to a call, including recording its measurements."""
+    bench_metrics = AgentMetrics(MeterProvider(metric_readers=[InMemoryMetricReader()]).get_meter(__name__))
+    agent_context = AgentContext(agent=agent, messages=[Message(role="user", text="What's the weather?")])
+    chat_context = ChatContext(
+        client=client, messages=[Message(role="user", text="What's the weather?")] * 4, options=None
+    )
+    function_context = FunctionInvocationContext(function=get_weather, arguments={"city": "Paris"})
+    response = ChatResponse(
+        messages=[Message(role="assistant", text="Sunny.")],
+        usage_details={"input_token_count": 120, "output_token_count": 20},
+    )
+
+    async def call_next() -> None:
+        chat_context.result = response
+
+    async def measure(process: Callable[[Any, Callable[[], Awaitable[None]]], Awaitable[None]], context: Any) -> float:
+        """Return the mean seconds per call, the best of three rounds."""
+        rounds = []
+        for _ in range(3):
+            start = time.perf_counter()
+            for _ in range(calls):
+                await process(context, call_next)
+            rounds.append((time.perf_counter() - start) / calls)
+        return min(rounds)
+
+    async def no_middleware(context: Any, call_next: Callable[[], Awaitable[None]]) -> None:
+        await call_next()
+
+    baseline = await measure(no_middleware, None)
+    table = Table(title=f"Metrics middleware overhead ({calls:,} calls, best of 3)")
+    table.add_column("Middleware")
+    table.add_column("Measurements", justify="right")
+    table.add_column("µs per call", justify="right")
+    for name, measurements, middleware, context in [
+        ("MetricsAgentMiddleware", "1", MetricsAgentMiddleware(bench_metrics), agent_context),
+        ("MetricsChatMiddleware", "4", MetricsChatMiddleware(bench_metrics), chat_context),
+        ("MetricsFunctionMiddleware", "1", MetricsFunctionMiddleware(bench_metrics), function_context),
+    ]:
+        overhead = await measure(middleware.process, context)
+        table.add_row(name, measurements, f"{(overhead - baseline) * 1e6:.2f}")
+    print(table)
+    print(f"[dim]Baseline (awaiting call_next directly): {baseline * 1e6:.2f} µs per call[/dim]")
+    print("[dim]Includes recording into the OpenTelemetry SDK, on the request path.[/dim]")
+
+
+if __name__ == "__main__":
+    if "--benchmark" in sys.argv:
+        asyncio.run(benchmark())
+    elif "--devui" in sys.argv:
+        from agent_framework.devui import serve
+
+        serve(entities=[agent], auto_open=True)
+    else:
+        asyncio.run(main())
@@ -2,10 +2,17 @@
 Context compaction via summarization middleware.
 
 When a conversation grows long, the accumulated messages can exceed the
-model's context window or become expensive. This middleware monitors
-cumulative token usage and, once a threshold is crossed, asks the LLM to
-summarize the conversation so far. The summary replaces the old messages,
-freeing up context space for future turns.
+model's context window or become expensive. This middleware keeps a running
+estimate of each session's context size and, once a threshold is crossed,
+asks the LLM to fold the oldest messages into a running summary. The summary
+replaces those messages, freeing up context space for future turns, while
+the most recent messages stay in the history verbatim.
+
+The summary replaces the messages in the history provider itself, through its
+``replace_messages`` compaction API, so persistent stores shrink too and loading
+a session stays cheap however long it runs. The in-memory provider below, the
+SQLiteHistoryProvider in agent_history_sqlite.py and the WindowedRedisHistoryProvider
+in agent_history_redis.py implement it.
 
 Diagram:
 
@@ -15,11 +22,14 @@ Diagram:
  ┌──────────────────────────────────────────────────┐
  │       SummarizationMiddleware (Agent-level)      │
  │                                                  │
- │  1. Check cumulative token usage                 │
- │  2. If over threshold → summarize old messages   │
- │     via LLM and replace them with summary        │
+ │  1. Load the session's history from its provider │
+ │     and estimate its context tokens              │
+ │  2. If over threshold → fold the oldest messages │
+ │     into the running summary via LLM, and have   │
+ │     the provider replace them with the summary   │
  │  3. call_next() → normal agent execution         │
- │  4. Track new token usage from response          │
+ │  4. Record the session's estimate after the turn │
+ │     (kept in session.state)                      │
  └──────────────────────────────────────────────────┘
  │
  ▼
@@ -35,52 +45,61 @@ import logging
 import os
 import random
 import sys
+import weakref
 from collections.abc import Awaitable, Callable
-from typing import Annotated
+from typing import Annotated, Any, Protocol
 
 from agent_framework import (
     Agent,
     AgentContext,
     AgentMiddleware,
-    AgentResponse,
+    AgentSession,
+    BaseHistoryProvider,
     InMemoryHistoryProvider,
     Message,
     tool,
 )
 from agent_framework.openai import OpenAIChatClient
+from agent_history_sqlite import estimate_tokens
 from azure.identity.aio import DefaultAzureCredential, get_bearer_token_provider
 from dotenv import load_dotenv
 from pydantic import Field
 from rich import print
 from rich.logging import RichHandler
 
-# ── Logging ──────────────────────────────────────────────────────────
-handler = RichHandler(show_path=False, rich_tracebacks=True, show_level=False)
-logging.basicConfig(level=logging.WARNING, handlers=[handler], force=True, format="%(message)s")
+# Logging and the chat client are set up when run as a script, not on import, so other
+# examples can import the classes below without credentials for a chat model
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
-# ── OpenAI client ────────────────────────────────────────────────────
-load_dotenv(override=True)
-API_HOST = os.getenv("API_HOST", "github")
-
-async_credential = None
-if API_HOST == "azure":
-    async_credential = DefaultAzureCredential()
-    token_provider = get_bearer_token_provider(async_credential, "https://cognitiveservices.azure.com/.default")
-    client = OpenAIChatClient(
-        base_url=f"{os.environ['AZURE_OPENAI_ENDPOINT']}/openai/v1/",
-        api_key=token_provider,
-        model_id=os.environ["AZURE_OPENAI_CHAT_DEPLOYMENT"],
-    )
-elif API_HOST == "github":
-    client = OpenAIChatClient(
-        base_url="https://models.github.ai/inference",
-        api_key=os.environ["GITHUB_TOKEN"],
-        model_id=os.getenv("GITHUB_MODEL", "openai/gpt-4.1-mini"),
-    )
-else:
+
+def setup_logging() -> None:
+    handler = RichHandler(show_path=False, rich_tracebacks=True, show_level=False)
+    logging.basicConfig(level=logging.WARNING, handlers=[handler], force=True, format="%(message)s")
+
+
+def create_client() -> tuple[OpenAIChatClient, DefaultAzureCredential | None]:
+    """Create the chat client configured by the environment, and the credential to close after use (if any)."""
+    load_dotenv(override=True)
+    api_host = os.getenv("API_HOST", "github")
+    if api_host == "azure":
+        credential = DefaultAzureCredential()
+        token_provider = get_bearer_token_provider(credential, "https://cognitiveservices.azure.com/.default")
+        client = OpenAIChatClient(
+            base_url=f"{os.environ['AZURE_OPENAI_ENDPOINT']}/openai/v1/",
+            api_key=token_provider,
+            model_id=os.environ["AZURE_OPENAI_CHAT_DEPLOYMENT"],
+        )
+        return client, credential
+    if api_host == "github":
+        client = OpenAIChatClient(
+            base_url="https://models.github.ai/inference",
+            api_key=os.environ["GITHUB_TOKEN"],
+            model_id=os.getenv("GITHUB_MODEL", "openai/gpt-4.1-mini"),
+        )
+        return client, None
     client = OpenAIChatClient(api_key=os.environ["OPENAI_API_KEY"], model_id=os.environ.get("OPENAI_MODEL", "gpt-4o"))
+    return client, None
 
 
 # ── Tools ────────────────────────────────────────────────────────────
@@ -117,58 +136,249 @@ def get_activities(
 
 # ── Summarization Middleware ─────────────────────────────────────────
 
+
 SUMMARIZE_PROMPT = (
     "You are a summarization assistant. Condense the following conversation "
     "into a concise summary that preserves all key facts, decisions, and context "
     "needed to continue the conversation. Write the summary in third person. "
     "Be concise but don't lose important details like specific cities, "
-    "weather conditions, or recommendations that were discussed."
+    "weather conditions, or recommendations that were discussed. "
+    "If a current summary is given, return it updated with the newer messages."
 )
 
+SUMMARY_HEADER = "[Summary of earlier conversation]\n"
+
+
+def is_summary(message: Message) -> bool:
+    """Whether ``message`` is a summary written by SummarizationMiddleware or agent_history_maintenance.py."""
+    return message.additional_properties.get("summary") is True
+
+
+class CompactableHistoryProvider(Protocol):
+    """A history provider whose stored messages can be replaced by a summary.
+
+    ``replace_messages`` must be atomic: a reader sees either the messages or the
+    summary that replaced them, never both or neither.
+    """
+
+    source_id: str
+
+    async def get_messages(
+        self, session_id: str | None, *, state: dict[str, Any] | None = None, **kwargs: Any
+    ) -> list[Message]: ...
+
+    async def replace_messages(
+        self, session_id: str | None, summary: Message, *, keep: int, state: dict[str, Any] | None = None
+    ) -> None:
+        """Replace all of the session's messages except the newest ``keep`` with ``summary``."""
+        ...
+
+
+class CompactableInMemoryHistoryProvider(InMemoryHistoryProvider):
+    """The built-in InMemoryHistoryProvider, plus the compaction API."""
+
+    async def replace_messages(
+        self, session_id: str | None, summary: Message, *, keep: int, state: dict[str, Any] | None = None
+    ) -> None:
+        """Replace all of the session's messages except the newest ``keep`` with ``summary``."""
+        if state is None:
+            return
+        messages = state.get("messages", [])
+        state["messages"] = [summary, *messages[max(len(messages) - keep, 0) :]]
+
 
 class SummarizationMiddleware(AgentMiddleware):
-    """Agent middleware that summarizes conversation history when token usage exceeds a threshold.
+    """Agent middleware that summarizes conversation history when it grows past a token threshold.
 
-    This implements the "context compaction" pattern: once cumulative token
-    usage crosses a configurable threshold, the middleware asks the LLM to
-    produce a summary of the conversation so far and replaces the old
-    messages with that summary. This keeps the context window manageable
+    This implements the "context compaction" pattern: once a session's
+    context crosses a configurable threshold, the middleware asks the LLM to
+    fold the oldest messages into a running summary, kept as the first
+    message of the history. This keeps the context window manageable
     for long-running conversations.
 
-    The middleware accesses session history via ``session.state`` (where the
-    built-in ``InMemoryHistoryProvider`` stores messages) and replaces it
-    with a single summary message before the agent processes the next turn.
+    Compaction is incremental: the newest ``keep_last_messages`` messages (at
+    most ``keep_last_tokens`` tokens of them) stay verbatim, and only the
+    messages before them are sent to the LLM together with the current summary.
+    Each summarization call is therefore bounded by the threshold, however long
+    the conversation gets. A tool call and its results are never split: if
+    the kept part would start with a tool result, its call is kept as well.
+
+    The middleware works with whichever history provider the agent uses, as long
+    as it implements ``replace_messages`` (see ``CompactableHistoryProvider``). A
+    plain ``InMemoryHistoryProvider``, including the one the agent adds by default,
+    is compacted through ``CompactableInMemoryHistoryProvider``. The history is
+    loaded with the provider's ``get_messages``, so a windowed provider is judged
+    by the window it sends to the model. Compaction replaces everything before the
+    kept messages, including messages that had already left the window.
+
+    Token accounting is per session, so one agent can serve many sessions:
+    each session's estimated context size is kept in its own
+    ``session.state[state_key]``. It is estimated locally from the loaded
+    history, which compaction keeps bounded. (Summing ``usage_details``
+    instead would count the history again on every turn, since each request
+    resends it.)
+
+    With ``background=True``, summarization is taken off the critical path: when a
+    turn leaves the session over the threshold, a summary of its history is
+    started as a background task right after the response is returned, and
+    swapped in at the start of the session's next turn. Messages added in
+    between are kept after the summary; if the history no longer starts with the
+    summarized messages, the summary is dropped. If the next turn arrives before the
+    summary is ready, it waits for it; if it failed, the turn summarizes inline.
     """
 
     def __init__(
         self,
         client: OpenAIChatClient,
         token_threshold: int = 1000,
+        state_key: str = "summarization",
+        background: bool = False,
+        keep_last_messages: int = 6,
+        keep_last_tokens: int | None = None,
     ) -> None:
         """Initialize the summarization middleware.
 
         Args:
             client: The LLM client to use for generating summaries.
-            token_threshold: Summarize when cumulative tokens exceed this value.
+            token_threshold: Summarize when a session's estimated context tokens exceed this value.
+            state_key: The ``session.state`` key under which each session's token count is kept.
+            background: Summarize in a background task after a turn instead of before the next one.
+            keep_last_messages: How many of the newest messages are kept verbatim.
+            keep_last_tokens: Optionally, the most tokens of newest messages kept verbatim.
         """
         self.client = client
         self.token_threshold = token_threshold
-        self.context_tokens = 0
+        self.state_key = state_key
+        self.background = background
+        self.keep_last_messages = keep_last_messages
+        self.keep_last_tokens = keep_last_tokens
+        # Background summaries per session: the summarized messages and the task.
+        # Held here rather than in session.state, which must stay serializable.
+        self._pending: weakref.WeakKeyDictionary[AgentSession, tuple[list[Message], asyncio.Task[str]]] = (
+            weakref.WeakKeyDictionary()
+        )
+
+    def _history_provider(self, agent: Any) -> CompactableHistoryProvider | None:
+        """Return the agent's history provider as a compactable one, or None if it can't be compacted."""
+        for provider in getattr(agent, "context_providers", []):
+            if hasattr(provider, "replace_messages"):
+                return provider
+            if isinstance(provider, InMemoryHistoryProvider):
+                # It holds no state of its own, so a compactable one with the same source_id reads the same history
+                return CompactableInMemoryHistoryProvider(provider.source_id)
+            if isinstance(provider, BaseHistoryProvider):
+                return None
+        # The agent adds the default InMemoryHistoryProvider on its first run
+        return CompactableInMemoryHistoryProvider()
+
+    async def _load(self, provider: CompactableHistoryProvider, session: AgentSession) -> list[Message]:
+        """Load the session's history the way the agent will, and record its estimated tokens."""
+        state = session.state.setdefault(provider.source_id, {})
+        history = await provider.get_messages(session.session_id, state=state)
+        session.state.setdefault(self.state_key, {})["context_tokens"] = sum(estimate_tokens(m) for m in history)
+        return history
+
+    def context_tokens(self, session: AgentSession) -> int:
+        """Return the session's estimated history tokens as of its last turn."""
+        return session.state.get(self.state_key, {}).get("context_tokens", 0)
+
+    def _overflow(self, history: list[Message]) -> list[Message]:
+        """Return the messages at the start of the history to fold into the summary (empty if none).
+
+        That is everything before the newest messages kept verbatim, including the
+        current summary. The kept part is moved back past any leading tool results,
+        so they stay with the tool call that produced them.
+        """
+        start = 1 if history and is_summary(history[0]) else 0
+        split, kept_tokens = len(history), 0
+        while split > start and len(history) - split < self.keep_last_messages:
+            kept_tokens += estimate_tokens(history[split - 1])
+            if self.keep_last_tokens is not None and kept_tokens > self.keep_last_tokens:
+                break
+            split -= 1
+        while start < split < len(history) and history[split].role == "tool":
+            split -= 1
+        return history[:split] if split > start else []
+
+    async def _compact(
+        self,
+        session: AgentSession,
+        provider: CompactableHistoryProvider,
+        history: list[Message],
+        summarized: int,
+        summary_text: str,
+    ) -> None:
+        """Have the provider replace the first ``summarized`` messages of ``history`` with a summary message."""
+        logger.info(
+            "[📝 Summarization] Summary: %s",
+            summary_text[:200] + "..." if len(summary_text) > 200 else summary_text,
+        )
+        summary = Message(role="assistant", text=SUMMARY_HEADER + summary_text, additional_properties={"summary": True})
+        kept = history[summarized:]
+        state = session.state.setdefault(provider.source_id, {})
+        await provider.replace_messages(session.session_id, summary, keep=len(kept), state=state)
+
+        session.state.setdefault(self.state_key, {})["context_tokens"] = sum(
+            estimate_tokens(m) for m in [summary, *kept]
+        )
+        logger.info(
+            "[📝 Summarization] Folded %d messages into the summary; %d recent messages kept verbatim",
+            summarized - int(is_summary(history[0])),
+            len(kept),
+        )
+
+    async def _apply_pending(self, session: AgentSession, provider: CompactableHistoryProvider) -> None:
+        """Swap in the session's background summary, waiting for it if it's still running."""
+        pending = self._pending.pop(session, None)
+        if pending is None:
+            return
+        summarized, task = pending
+        if not task.done():
+            logger.info("[📝 Summarization] Next turn arrived before the background summary; waiting for it")
+        try:
+            summary_text = await task
+        except Exception:
+            logger.exception("[📝 Summarization] Background summarization failed; will summarize inline")
+            return
+
+        # The history must still start with exactly the summarized messages. Stores return new
+        # Message objects, so compare by content; matching a single message could pick a later
+        # copy of a repeated one ("yes") and drop the turns in between.
+        history = await self._load(provider, session)
+        count = len(summarized)
+        if len(history) >= count and all(
+            current.to_dict() == snapshot.to_dict() for current, snapshot in zip(history, summarized)
+        ):
+            await self._compact(session, provider, history, count, summary_text)
+            return
+        logger.info("[📝 Summarization] History changed while it was summarized; dropping the summary")
 
     def _format_messages_for_summary(self, messages: list[Message]) -> str:
         """Format conversation messages into a text block for the summarizer."""
         lines: list[str] = []
         for msg in messages:
-            if msg.text:
-                lines.append(f"{msg.role}: {msg.text}")
+            for content in msg.contents:
+                if content.type == "text" and content.text:
+                    lines.append(f"{msg.role}: {content.text}")
+                elif content.type == "function_call":
+                    lines.append(f"{msg.role} called {content.name}({content.arguments})")
+                elif content.type == "function_result":
+                    lines.append(f"tool result: {content.result}")
         return "\n".join(lines)
 
     async def _summarize(self, messages: list[Message]) -> str:
-        """Call the LLM to summarize the conversation messages."""
-        conversation_text = self._format_messages_for_summary(messages)
+        """Call the LLM to fold the messages into the current summary (their first message, if it is one)."""
+        if messages and is_summary(messages[0]):
+            current_summary = messages[0].text.removeprefix(SUMMARY_HEADER)
+            request = (
+                f"Current summary:\n{current_summary}\n\n"
+                f"Newer messages:\n\n{self._format_messages_for_summary(messages[1:])}"
+            )
+        else:
+            request = f"Summarize this conversation:\n\n{self._format_messages_for_summary(messages)}"
         summary_messages = [
             Message(role="system", text=SUMMARIZE_PROMPT),
-            Message(role="user", text=f"Summarize this conversation:\n\n{conversation_text}"),
+            Message(role="user", text=request),
         ]
         response = await self.client.get_response(summary_messages)
         return response.text or "No summary available."
@@ -178,80 +388,83 @@ class SummarizationMiddleware(AgentMiddleware):
         context: AgentContext,
         call_next: Callable[[], Awaitable[None]],
     ) -> None:
-        """Check token usage and summarize if over threshold, then continue execution."""
+        """Check the session's context size and summarize if over threshold, then continue execution."""
         session = context.session
+        provider = self._history_provider(context.agent)
+        if session is None or provider is None:
+            await call_next()
+            return
+
+        await self._apply_pending(session, provider)
+
+        # Before the agent runs: check if this session's history plus the new input is over the threshold
+        history = await self._load(provider, session)
+        context_tokens = self.context_tokens(session) + sum(estimate_tokens(m) for m in context.messages)
+        overflow = self._overflow(history) if context_tokens > self.token_threshold else []
+        if overflow:
+            logger.info(
+                "[📝 Summarization] Context (~%d tokens) exceeds threshold (%d). Summarizing %d older messages...",
+                context_tokens,
+                self.token_threshold,
+                len(overflow),
+            )
 
-        # Before the agent runs: check if we should compact the history
-        if session and self.context_tokens > self.token_threshold:
-            history = session.state.get(InMemoryHistoryProvider.DEFAULT_SOURCE_ID, {}).get("messages", [])
-            if len(history) > 2:
-                logger.info(
-                    "[📝 Summarization] Token usage (%d) exceeds threshold (%d). "
-                    "Summarizing %d history messages...",
-                    self.context_tokens,
-                    self.token_threshold,
-                    len(history),
-                )
-
-                # Summarize the full history
-                summary_text = await self._summarize(history)
-                logger.info(
-                    "[📝 Summarization] Summary: %s",
-                    summary_text[:200] + "..." if len(summary_text) > 200 else summary_text,
-                )
-
-                # Replace session history with a single summary message
-                session.state[InMemoryHistoryProvider.DEFAULT_SOURCE_ID]["messages"] = [
-                    Message(role="assistant", text=f"[Summary of earlier conversation]\n{summary_text}"),
-                ]
-
-                # Reset token counter after summarization
-                self.context_tokens = 0
-                logger.info("[📝 Summarization] History compacted to 1 summary message")
+            # Fold the older messages into the running summary, keeping the recent ones
+            await self._compact(session, provider, history, len(overflow), await self._summarize(overflow))
         else:
             logger.info(
-                "[📝 Summarization] Token usage: %d / %d threshold. No summarization needed.",
-                self.context_tokens,
+                "[📝 Summarization] Context: ~%d / %d tokens. No summarization needed.",
+                context_tokens,
                 self.token_threshold,
             )
 
-        # Execute the agent (loads history from session, calls LLM, saves response)
+        # Execute the agent (loads history from its provider, calls LLM, saves response)
         await call_next()
 
-        # After the agent runs: track token usage from the response
-        if context.result and isinstance(context.result, AgentResponse) and context.result.usage_details:
-            new_tokens = context.result.usage_details.get("total_token_count", 0) or 0
-            self.context_tokens += new_tokens
-            logger.info(
-                "[📝 Summarization] This turn used %d tokens. Context: %d",
-                new_tokens,
-                self.context_tokens,
-            )
+        # After the agent runs: estimate the session's history with this turn's messages
+        # (persistent providers serve this from their decoded-message cache)
+        history = await self._load(provider, session)
+        context_tokens = self.context_tokens(session)
+        logger.info("[📝 Summarization] Session context after this turn: ~%d tokens", context_tokens)
+
+        # In background mode, start summarizing now, so the next turn finds the summary ready
+        overflow = self._overflow(history) if context_tokens > self.token_threshold else []
+        if self.background and overflow:
+            self._pending[session] = (overflow, asyncio.create_task(self._summarize(overflow)))
+            logger.info("[📝 Summarization] Summarizing %d older messages in the background...", len(overflow))
 
 
 # ── Agent setup ──────────────────────────────────────────────────────
 
-# Use a low threshold for demo purposes so summarization triggers quickly
-summarization_middleware = SummarizationMiddleware(client=client, token_threshold=500)
-
-agent = Agent(
-    name="weekend-planner",
-    client=client,
-    instructions=(
-        "You are a helpful weekend-planning assistant. Help users plan "
-        "their weekends by checking weather and suggesting activities. "
-        "Be friendly and provide detailed recommendations."
-    ),
-    tools=[get_weather, get_activities],
-    middleware=[summarization_middleware],
-)
+
+def create_agent(client: OpenAIChatClient) -> tuple[Agent, SummarizationMiddleware]:
+    """Create the weekend-planning agent and the summarization middleware it runs with."""
+    # Use a low threshold for demo purposes so summarization triggers quickly
+    summarization_middleware = SummarizationMiddleware(
+        client=client, token_threshold=500, background=True, keep_last_messages=6, keep_last_tokens=250
+    )
+    agent = Agent(
+        name="weekend-planner",
+        client=client,
+        instructions=(
+            "You are a helpful weekend-planning assistant. Help users plan "
+            "their weekends by checking weather and suggesting activities. "
+            "Be friendly and provide detailed recommendations."
+        ),
+        tools=[get_weather, get_activities],
+        middleware=[summarization_middleware],
+    )
+    return agent, summarization_middleware
 
 
 async def main() -> None:
     """Run a multi-turn conversation that triggers summarization."""
+    client, async_credential = create_client()
+    agent, summarization_middleware = create_agent(client)
     print("\n[bold]=== Context Compaction with Summarization ===[/bold]")
     print(f"[dim]Token threshold: {summarization_middleware.token_threshold}[/dim]")
-    print("[dim]The middleware will summarize the conversation once token usage exceeds the threshold.[/dim]\n")
+    print("[dim]The middleware will summarize a session once its estimated context exceeds the threshold.[/dim]")
+    print("[dim]Summaries run in the background after a turn and are swapped in before the next one.[/dim]\n")
 
     session = agent.create_session()
 
@@ -273,7 +486,19 @@ async def main() -> None:
     response = await agent.run(user_msg, session=session)
     print(f"[green]Agent:[/green] {response.text}\n")
 
-    # Turn 4 — this should trigger summarization
+    # A second session on the same agent keeps its own token count, so it neither triggers
+    # nor is affected by the first session's compaction
+    other_session = agent.create_session()
+    user_msg = "Quick question: is it sunny in Miami today?"
+    print(f"[blue]User (second session):[/blue] {user_msg}")
+    response = await agent.run(user_msg, session=other_session)
+    print(f"[green]Agent:[/green] {response.text}\n")
+    print(
+        f"[dim]Second session: ~{summarization_middleware.context_tokens(other_session)} tokens, "
+        f"first session: ~{summarization_middleware.context_tokens(session)} tokens[/dim]\n"
+    )
+
+    # Turn 4 — by now a background summary should have been started, and is swapped in first
     user_msg = "Of all the cities we discussed, which one has the best combination of weather and activities?"
     print(f"[blue]User:[/blue] {user_msg}")
     response = await agent.run(user_msg, session=session)
@@ -285,16 +510,18 @@ async def main() -> None:
     response = await agent.run(user_msg, session=session)
     print(f"[green]Agent:[/green] {response.text}\n")
 
-    print(f"[dim]Final context token count: {summarization_middleware.context_tokens}[/dim]")
+    print(f"[dim]Final context token count: ~{summarization_middleware.context_tokens(session)}[/dim]")
 
     if async_credential:
         await async_credential.close()
 
 
 if __name__ == "__main__":
+    setup_logging()
     if "--devui" in sys.argv:
         from agent_framework.devui import serve
 
+        agent, _ = create_agent(create_client()[0])
         serve(entities=[agent], auto_open=True)
     else:
         asyncio.run(main())
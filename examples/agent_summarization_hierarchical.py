@@ -0,0 +1,465 @@
+"""
+Hierarchical summaries with on-demand drill-down for very long sessions.
+
+A single running summary loses detail over hundreds of turns: every update
+summarizes the summary again, and the losses compound. This example compacts
+a session in levels instead:
+
+  - every ``segment_messages`` messages of the conversation form a segment
+    with its own leaf summary (level 0),
+  - every ``fanout`` consecutive summaries of one level are rolled up into
+    one summary of the next level,
+  - the raw messages are never deleted; they stay in the store.
+
+On each turn the model only sees the summaries that haven't been rolled up
+yet (fewer than ``fanout`` per level), followed by the messages that aren't in
+a segment yet, so the prompt grows with the logarithm of the conversation
+length. When the model needs detail, it calls the ``read_segment`` tool with
+a summary's id: a higher-level summary returns the summaries it was built
+from, and a leaf summary returns the original messages of its segment.
+
+Diagram (fanout = 2):
+
+ level 2   #7 ─────────────────────┐
+ level 1   #3 ────────┐  #6 ───────┤  #10 ───────┐
+ level 0   #1   #2    │  #4   #5   │  #8   #9    │  #11
+ messages  ▒▒▒▒ ▒▒▒▒  │  ▒▒▒▒ ▒▒▒▒ │  ▒▒▒▒ ▒▒▒▒  │  ▒▒▒▒  ▒▒ (not in a segment yet)
+
+ prompt:   #7, #10, #11 + the newest messages
+
+Run:
+    uv run examples/agent_summarization_hierarchical.py
+"""
+
+import asyncio
+import logging
+import os
+import random
+import sqlite3
+import sys
+import uuid
+from collections.abc import Sequence
+from typing import Annotated, Any
+
+from agent_framework import (
+    Agent,
+    AgentSession,
+    BaseHistoryProvider,
+    FunctionTool,
+    Message,
+    SessionContext,
+    SupportsAgentRun,
+    tool,
+)
+from agent_framework.openai import OpenAIChatClient
+from agent_history_sqlite import estimate_tokens
+from azure.identity.aio import DefaultAzureCredential, get_bearer_token_provider
+from dotenv import load_dotenv
+from pydantic import Field
+from rich import print
+from rich.logging import RichHandler
+from rich.tree import Tree
+
+# ── Logging ──────────────────────────────────────────────────────────
+handler = RichHandler(show_path=False, rich_tracebacks=True, show_level=False)
+logging.basicConfig(level=logging.WARNING, handlers=[handler], force=True, format="%(message)s")
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# ── OpenAI client ────────────────────────────────────────────────────
+load_dotenv(override=True)
+API_HOST = os.getenv("API_HOST", "github")
+
+async_credential = None
+if API_HOST == "azure":
+    async_credential = DefaultAzureCredential()
+    token_provider = get_bearer_token_provider(async_credential, "https://cognitiveservices.azure.com/.default")
+    client = OpenAIChatClient(
+        base_url=f"{os.environ['AZURE_OPENAI_ENDPOINT']}/openai/v1/",
+        api_key=token_provider,
+        model_id=os.environ["AZURE_OPENAI_CHAT_DEPLOYMENT"],
+    )
+elif API_HOST == "github":
+    client = OpenAIChatClient(
+        base_url="https://models.github.ai/inference",
+        api_key=os.environ["GITHUB_TOKEN"],
+        model_id=os.getenv("GITHUB_MODEL", "openai/gpt-4.1-mini"),
+    )
+else:
+    client = OpenAIChatClient(api_key=os.environ["OPENAI_API_KEY"], model_id=os.environ.get("OPENAI_MODEL", "gpt-4o"))
+
+
+# ── Tools ────────────────────────────────────────────────────────────
+
+
+@tool
+def get_weather(
+    city: Annotated[str, Field(description="The city to get the weather for.")],
+) -> str:
+    """Return weather data for a given city."""
+    conditions = ["sunny", "cloudy", "rainy", "snowy"]
+    temp = random.randint(30, 90)
+    return f"The weather in {city} is {random.choice(conditions)} with a high of {temp}°F."
+
+
+@tool
+def get_activities(
+    city: Annotated[str, Field(description="The city to find activities in.")],
+) -> str:
+    """Return popular weekend activities for a given city."""
+    all_activities = [
+        "Visit the farmer's market",
+        "Hike at the local state park",
+        "Check out a food truck festival",
+        "Go to the art museum",
+        "Take a walking tour of downtown",
+        "Visit the botanical garden",
+        "Catch a live music show",
+        "Try a new brunch spot",
+    ]
+    picked = random.sample(all_activities, k=3)
+    return f"Popular activities in {city}: {', '.join(picked)}."
+
+
+# ── Hierarchical history provider ────────────────────────────────────
+
+
+def format_messages(messages: list[Message]) -> str:
+    """Format conversation messages into a text block, for the summarizer or the read_segment tool."""
+    lines: list[str] = []
+    for msg in messages:
+        for content in msg.contents:
+            if content.type == "text" and content.text:
+                lines.append(f"{msg.role}: {content.text}")
+            elif content.type == "function_call":
+                lines.append(f"{msg.role} called {content.name}({content.arguments})")
+            elif content.type == "function_result":
+                lines.append(f"tool result: {content.result}")
+    return "\n".join(lines)
+
+
+LEAF_PROMPT = (
+    "You are a summarization assistant. Condense the following part of a conversation "
+    "into a concise summary that preserves all key facts, decisions, and context. "
+    "Write the summary in third person. Keep specific cities, weather conditions, "
+    "and recommendations."
+)
+
+ROLL_UP_PROMPT = (
+    "You are a summarization assistant. The following are summaries of consecutive parts "
+    "of one conversation, oldest first. Combine them into one concise summary in third "
+    "person that keeps the main facts and decisions of each part."
+)
+
+SUMMARY_HEADER = "[Summaries of earlier conversation, oldest first. Call read_segment with an id for details.]\n"
+
+READ_SEGMENT_INSTRUCTIONS = (
+    "Earlier parts of this conversation are summarized. If you need details that a summary "
+    "leaves out, call read_segment with its id to see what it was built from."
+)
+
+
+def is_summary(message: Message) -> bool:
+    """Whether ``message`` holds the summaries written by HierarchicalHistoryProvider."""
+    return message.additional_properties.get("summary") is True
+
+
+class HierarchicalHistoryProvider(BaseHistoryProvider):
+    """A SQLite history provider that compacts each session into a tree of summaries.
+
+    Raw messages are kept in the ``messages`` table (laid out like agent_history_sqlite.py,
+    so sqlite_viewer.py can browse it) and summaries in ``summaries``: each covers the
+    message ids ``first_id..last_id`` and, once rolled up, records its parent. The
+    summaries without a parent are the ones sent to the model.
+
+    Compaction runs after each turn is saved: full segments are cut from the messages
+    not yet summarized, keeping at least ``keep_last_messages`` of them, and a segment
+    is extended rather than separating a tool call from its results. Each new summary
+    rolls up its level once ``fanout`` of them are waiting, which can cascade upwards.
+    """
+
+    def __init__(
+        self,
+        db_path: str,
+        client: OpenAIChatClient,
+        *,
+        segment_messages: int = 8,
+        fanout: int = 4,
+        keep_last_messages: int = 4,
+    ):
+        super().__init__("hierarchical-history")
+        self.client = client
+        self.segment_messages = segment_messages
+        self.fanout = fanout
+        self.keep_last_messages = keep_last_messages
+        self.conn = sqlite3.connect(db_path)
+        self.conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS messages (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                session_id TEXT NOT NULL,
+                message_json TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS messages_session_id ON messages (session_id, id);
+            CREATE TABLE IF NOT EXISTS summaries (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                session_id TEXT NOT NULL,
+                level INTEGER NOT NULL,
+                first_id INTEGER NOT NULL,
+                last_id INTEGER NOT NULL,
+                message_count INTEGER NOT NULL,
+                parent_id INTEGER,
+                text TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS summaries_session_id ON summaries (session_id, parent_id, level);
+            """
+        )
+
+    def _top_summaries(self, session_id: str) -> list[tuple[int, int, int, int, str]]:
+        """Return (id, level, last_id, message_count, text) of the summaries not yet rolled up, oldest first."""
+        return self.conn.execute(
+            "SELECT id, level, last_id, message_count, text FROM summaries "
+            "WHERE session_id = ? AND parent_id IS NULL ORDER BY first_id",
+            (session_id,),
+        ).fetchall()
+
+    def _unsummarized(self, session_id: str, after_id: int) -> list[tuple[int, Message]]:
+        rows = self.conn.execute(
+            "SELECT id, message_json FROM messages WHERE session_id = ? AND id > ? ORDER BY id",
+            (session_id, after_id),
+        )
+        return [(id, Message.from_json(message_json)) for id, message_json in rows]
+
+    async def get_messages(
+        self, session_id: str | None, *, state: dict[str, Any] | None = None, **kwargs: Any
+    ) -> list[Message]:
+        """Return the summaries not yet rolled up, as one message, followed by the messages not yet summarized."""
+        if session_id is None:
+            return []
+        summaries = self._top_summaries(session_id)
+        recent = [message for _, message in self._unsummarized(session_id, summaries[-1][2] if summaries else 0)]
+        if not summaries:
+            return recent
+        text = SUMMARY_HEADER + "\n".join(
+            f"#{id} (level {level}, {count} messages): {summary}" for id, level, _, count, summary in summaries
+        )
+        history = [Message(role="assistant", text=text, additional_properties={"summary": True}), *recent]
+        logger.info(
+            "[🌳 History] Loaded %d summaries covering %d messages + %d recent messages (~%d tokens)",
+            len(summaries),
+            sum(count for _, _, _, count, _ in summaries),
+            len(recent),
+            sum(estimate_tokens(m) for m in history),
+        )
+        return history
+
+    async def save_messages(self, session_id: str | None, messages: Sequence[Message], **kwargs: Any) -> None:
+        """Append messages to the session's raw history."""
+        if session_id is None or not messages:
+            return
+        with self.conn:
+            self.conn.executemany(
+                "INSERT INTO messages (session_id, message_json) VALUES (?, ?)",
+                [(session_id, message.to_json()) for message in messages],
+            )
+
+    async def before_run(
+        self,
+        *,
+        agent: SupportsAgentRun,
+        session: AgentSession,
+        context: SessionContext,
+        state: dict[str, Any],
+    ) -> None:
+        """Load the history and, once there are summaries, offer the read_segment tool for this session."""
+        history = await self.get_messages(context.session_id, state=state)
+        context.extend_messages(self, history)
+        if history and is_summary(history[0]):
+            context.extend_tools(self.source_id, [self._read_segment_tool(context.session_id)])
+            context.extend_instructions(self.source_id, READ_SEGMENT_INSTRUCTIONS)
+
+    async def after_run(
+        self,
+        *,
+        agent: SupportsAgentRun,
+        session: AgentSession,
+        context: SessionContext,
+        state: dict[str, Any],
+    ) -> None:
+        """Save the turn's messages, then summarize any full segments."""
+        await super().after_run(agent=agent, session=session, context=context, state=state)
+        if context.session_id is not None:
+            await self.compact(context.session_id)
+
+    async def compact(self, session_id: str) -> None:
+        """Cut full segments from the messages not yet summarized, and roll up each level that fills up."""
+        summaries = self._top_summaries(session_id)
+        pending = self._unsummarized(session_id, summaries[-1][2] if summaries else 0)
+        while len(pending) - self.keep_last_messages >= self.segment_messages:
+            end = self.segment_messages
+            while end < len(pending) and pending[end][1].role == "tool":
+                end += 1  # keep the results with the tool call that produced them
+            segment, pending = pending[:end], pending[end:]
+            text = await self._summarize(LEAF_PROMPT, format_messages([message for _, message in segment]))
+            with self.conn:
+                cursor = self.conn.execute(
+                    "INSERT INTO summaries (session_id, level, first_id, last_id, message_count, text) "
+                    "VALUES (?, 0, ?, ?, ?, ?)",
+                    (session_id, segment[0][0], segment[-1][0], len(segment), text),
+                )
+            logger.info("[🌳 History] Summarized %d messages as leaf #%d", len(segment), cursor.lastrowid)
+            await self._roll_up(session_id)
+
+    async def _roll_up(self, session_id: str) -> None:
+        """Combine ``fanout`` summaries of a level into one of the next level, from level 0 upwards."""
+        level = 0
+        while True:
+            children = self.conn.execute(
+                "SELECT id, first_id, last_id, message_count, text FROM summaries "
+                "WHERE session_id = ? AND level = ? AND parent_id IS NULL ORDER BY first_id",
+                (session_id, level),
+            ).fetchall()
+            if not children:
+                return
+            if len(children) >= self.fanout:
+                group = children[: self.fanout]
+                text = await self._summarize(ROLL_UP_PROMPT, "\n\n".join(summary for *_, summary in group))
+                with self.conn:
+                    cursor = self.conn.execute(
+                        "INSERT INTO summaries (session_id, level, first_id, last_id, message_count, text) "
+                        "VALUES (?, ?, ?, ?, ?, ?)",
+                        (session_id, level + 1, group[0][1], group[-1][2], sum(row[3] for row in group), text),
+                    )
+                    self.conn.executemany(
+                        "UPDATE summaries SET parent_id = ? WHERE id = ?",
+                        [(cursor.lastrowid, row[0]) for row in group],
+                    )
+                logger.info(
+                    "[🌳 History] Rolled up %s into level %d summary #%d",
+                    ", ".join(f"#{row[0]}" for row in group),
+                    level + 1,
+                    cursor.lastrowid,
+                )
+            level += 1
+
+    async def _summarize(self, prompt: str, text: str) -> str:
+        response = await self.client.get_response(
+            [Message(role="system", text=prompt), Message(role="user", text=text)]
+        )
+        return response.text or "No summary available."
+
+    def read_segment(self, session_id: str, segment_id: int) -> str:
+        """Return what a summary was built from: its child summaries, or for a leaf its raw messages."""
+        row = self.conn.execute(
+            "SELECT level, first_id, last_id FROM summaries WHERE session_id = ? AND id = ?",
+            (session_id, segment_id),
+        ).fetchone()
+        if row is None:
+            return f"There is no summary #{segment_id} in this conversation."
+        level, first_id, last_id = row
+        if level == 0:
+            rows = self.conn.execute(
+                "SELECT message_json FROM messages WHERE session_id = ? AND id BETWEEN ? AND ? ORDER BY id",
+                (session_id, first_id, last_id),
+            )
+            return format_messages([Message.from_json(message_json) for (message_json,) in rows])
+        children = self.conn.execute(
+            "SELECT id, level, message_count, text FROM summaries WHERE session_id = ? AND parent_id = ? "
+            "ORDER BY first_id",
+            (session_id, segment_id),
+        )
+        return "\n".join(f"#{id} (level {lvl}, {count} messages): {text}" for id, lvl, count, text in children)
+
+    def _read_segment_tool(self, session_id: str) -> FunctionTool:
+        """Build the read_segment tool for one session, so it can only read that session's segments."""
+
+        def read_segment(
+            segment_id: Annotated[int, Field(description="The id of a summary, e.g. 7 for #7.")],
+        ) -> str:
+            """Return what a summary of earlier conversation was built from: its summaries or original messages."""
+            logger.info("[🌳 History] Agent drilled down into #%d", segment_id)
+            return self.read_segment(session_id, segment_id)
+
+        return tool(read_segment)
+
+    def summary_tree(self, session_id: str) -> Tree:
+        """Render the session's summaries as a tree, top-level summaries first."""
+        rows = self.conn.execute(
+            "SELECT id, level, message_count, parent_id, text FROM summaries WHERE session_id = ? ORDER BY first_id",
+            (session_id,),
+        ).fetchall()
+        root = Tree(f"[bold]Session {session_id}[/bold]")
+        nodes: dict[int | None, Tree] = {None: root}
+        # Parents are created after their children, so add the higher levels first
+        for id, level, count, parent_id, text in sorted(rows, key=lambda row: -row[1]):
+            preview = text[:80] + "..." if len(text) > 80 else text
+            nodes[id] = nodes[parent_id].add(
+                f"[cyan]#{id}[/cyan] [dim](level {level}, {count} messages)[/dim] {preview}"
+            )
+        return root
+
+    def close(self) -> None:
+        self.conn.close()
+
+
+# ── Agent setup ──────────────────────────────────────────────────────
+
+DB_PATH = "chat_history_hierarchical.sqlite3"
+
+# Small segments and fanout for demo purposes, so several levels build up quickly
+history_provider = HierarchicalHistoryProvider(DB_PATH, client, segment_messages=4, fanout=2, keep_last_messages=2)
+
+agent = Agent(
+    name="weekend-planner",
+    client=client,
+    instructions=(
+        "You are a helpful weekend-planning assistant. Help users plan "
+        "their weekends by checking weather and suggesting activities. "
+        "Keep each answer to two or three sentences."
+    ),
+    tools=[get_weather, get_activities],
+    context_providers=[history_provider],
+)
+
+
+async def main() -> None:
+    """Run a long conversation that builds up several levels of summaries, then needs an early detail."""
+    print("\n[bold]=== Hierarchical Summaries with Drill-down ===[/bold]")
+    print(
+        f"[dim]Segments of {history_provider.segment_messages} messages, "
+        f"{history_provider.fanout} summaries per roll-up[/dim]\n"
+    )
+
+    session = agent.create_session(session_id=str(uuid.uuid4()))
+    questions = [
+        "What's the weather like in San Francisco this weekend?",
+        "What can I do there?",
+        "How about Portland? What's the weather there?",
+        "And what activities does Portland have?",
+        "What about Seattle's weather?",
+        "Any activities in Seattle?",
+        "Let's also check Denver's weather.",
+        "What can I do in Denver?",
+        "Of all these cities, which would you pick for an outdoor weekend?",
+        # Needs a detail that only the raw messages of the first segment still have
+        "What exact high temperature did you report for San Francisco at the very start?",
+    ]
+    for question in questions:
+        print(f"[blue]User:[/blue] {question}")
+        response = await agent.run(question, session=session)
+        print(f"[green]Agent:[/green] {response.text}\n")
+
+    print(history_provider.summary_tree(session.session_id))
+
+    history_provider.close()
+    if async_credential:
+        await async_credential.close()
+
+
+if __name__ == "__main__":
+    if "--devui" in sys.argv:
+        from agent_framework.devui import serve
+
+        serve(entities=[agent], auto_open=True)
+    else:
+        asyncio.run(main())
@@ -1,15 +1,35 @@
-"""A simple script to view all keys and values stored in Redis, formatted with Rich."""
+"""A script to view the keys and values stored in Redis, formatted with Rich.
+
+Keys are iterated with SCAN (never KEYS), and each page of keys is fetched with
+two pipelined round-trips: one for the key types and one for the values. Large
+collections are shown truncated. That makes it safe to point at a production
+instance with millions of keys.
+
+Usage:
+    uv run examples/redis_viewer.py                         # list keys and their types
+    uv run examples/redis_viewer.py --values                # show values too
+    uv run examples/redis_viewer.py --match "chat_messages:*" --values --limit 20
+    uv run examples/redis_viewer.py --memory                # memory used per key prefix
+"""
 
 import argparse
+import heapq
 import json
 import os
 import sys
+from collections import defaultdict
+from collections.abc import Iterator
 
+import msgpack
 import redis
+import zstandard
+from agent_history_sqlite import MessageCodec
 from dotenv import load_dotenv
 from rich import print
+from rich.markup import escape
 from rich.panel import Panel
 from rich.syntax import Syntax
+from rich.table import Table
 from rich.text import Text
 
 load_dotenv(override=True)
@@ -17,9 +37,16 @@ REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379")
 
 parser = argparse.ArgumentParser(description="View keys and values in Redis.")
 parser.add_argument("--values", action="store_true", help="Show values for each key (default: list keys only)")
+parser.add_argument("--match", default="*", help="Only show keys matching this glob pattern (default: *)")
+parser.add_argument("--limit", type=int, help="Show at most this many keys")
+parser.add_argument("--page-size", type=int, default=200, help="Keys fetched per SCAN page and pipeline (default: 200)")
+parser.add_argument("--max-items", type=int, default=20, help="Items shown per list, hash, set or zset (default: 20)")
+parser.add_argument("--memory", action="store_true", help="Report MEMORY USAGE grouped by key prefix")
+parser.add_argument("--prefix-depth", type=int, default=1, help="Colon-separated segments that form a prefix")
 args = parser.parse_args()
 
 r = redis.from_url(REDIS_URL)
+codec = MessageCodec()
 
 try:
     r.ping()
@@ -27,78 +54,163 @@ except redis.ConnectionError:
     print(f"[red]Cannot connect to Redis at {REDIS_URL}[/red]")
     sys.exit(1)
 
-keys = sorted(k.decode() for k in r.keys("*"))
-
-if not keys:
-    print("[dim]No keys found in Redis.[/dim]")
-    sys.exit(0)
-
-print(f"\n[bold]Found {len(keys)} key(s) in Redis[/bold]\n")
 
-if not args.values:
-    for key in keys:
-        key_type = r.type(key).decode()
-        print(f"  [bold cyan]{key}[/bold cyan] [dim]({key_type})[/dim]")
-    print()
-    sys.exit(0)
+def scan_pages() -> Iterator[list[bytes]]:
+    """Yield pages of matching keys. SCAN may return a key more than once; duplicates are dropped per page."""
+    cursor = 0
+    page: list[bytes] = []
+    while True:
+        cursor, keys = r.scan(cursor, match=args.match, count=args.page_size)
+        page.extend(keys)
+        if len(page) >= args.page_size or (cursor == 0 and page):
+            yield sorted(set(page))
+            page = []
+        if cursor == 0:
+            return
 
-for key in keys:
-    key_type = r.type(key).decode()
 
-    if key_type == "string":
-        raw = r.get(key).decode()
+def decode(raw: bytes) -> str:
+    """Decode a stored value to text, unpacking messages written by MessageCodec (agent_history_sqlite.py)."""
+    if raw[:1] in (MessageCodec.MSGPACK, MessageCodec.ZSTD):
         try:
-            formatted = json.dumps(json.loads(raw), indent=2)
-            content = Syntax(formatted, "json", theme="monokai", word_wrap=True)
-        except json.JSONDecodeError:
-            content = Text(raw)
-        print(Panel(content, title=f"[bold cyan]{key}[/bold cyan] [dim]({key_type})[/dim]"))
-
-    elif key_type == "list":
-        items = r.lrange(key, 0, -1)
-        parts = []
-        for item in items:
-            raw = item.decode()
-            try:
-                formatted = json.dumps(json.loads(raw), indent=2)
-            except json.JSONDecodeError:
-                formatted = raw
-            parts.append(formatted)
-        combined = "\n---\n".join(parts)
+            return json.dumps(codec.decode(raw).to_dict(), indent=2)
+        except (ValueError, msgpack.UnpackException, zstandard.ZstdError) as e:
+            # e.g. compressed with a dictionary the viewer doesn't have
+            return f"<{len(raw)} bytes that don't decode as a message: {e}>"
+    try:
+        text = raw.decode()
+    except UnicodeDecodeError:
+        return f"<{len(raw)} bytes of binary data>"
+    try:
+        return json.dumps(json.loads(text), indent=2)
+    except json.JSONDecodeError:
+        return text
+
+
+def fetch_values(keys: list[bytes], types: list[str]) -> list[tuple[int | None, object]]:
+    """Fetch (size, value) for each key in one pipeline. Collections are capped at --max-items."""
+    pipe = r.pipeline(transaction=False)
+    last = args.max_items - 1
+    for key, key_type in zip(keys, types):
+        if key_type == "string":
+            pipe.strlen(key)
+            pipe.getrange(key, 0, 64 * 1024 - 1)
+        elif key_type == "list":
+            pipe.llen(key)
+            pipe.lrange(key, 0, last)
+        elif key_type == "hash":
+            pipe.hlen(key)
+            pipe.hscan(key, 0, count=args.max_items)
+        elif key_type == "set":
+            pipe.scard(key)
+            pipe.sscan(key, 0, count=args.max_items)
+        elif key_type == "zset":
+            pipe.zcard(key)
+            pipe.zrange(key, 0, last, withscores=True)
+    results = iter(pipe.execute())
+    values = []
+    for key_type in types:
+        if key_type in ("string", "list", "hash", "set", "zset"):
+            values.append((next(results), next(results)))
+        else:
+            values.append((None, None))
+    return values
+
+
+def render(key: str, key_type: str, size: int | None, value: object) -> Panel:
+    title = f"[bold cyan]{escape(key)}[/bold cyan] [dim]({key_type})[/dim]"
+    if key_type == "string":
+        text = decode(value)
+        content = Syntax(text, "json", theme="monokai", word_wrap=True) if text[:1] in "{[" else Text(text)
+        return Panel(content, title=title, subtitle=f"[dim]{size:,} bytes[/dim]")
+    if key_type == "list":
+        combined = "\n---\n".join(decode(item) for item in value)
         content = Syntax(combined, "json", theme="monokai", word_wrap=True)
-        print(
-            Panel(
-                content,
-                title=f"[bold cyan]{key}[/bold cyan] [dim]({key_type})[/dim]",
-                subtitle=f"[dim]{len(items)} item(s)[/dim]",
-            )
-        )
-
     elif key_type == "hash":
-        fields = r.hgetall(key)
-        lines = []
-        for field, val in fields.items():
-            lines.append(f"[bold]{field.decode()}[/bold]: {val.decode()}")
-        print(
-            Panel("\n".join(lines), title=f"[bold cyan]{key}[/bold cyan] [dim]({key_type})[/dim]")
+        _, fields = value
+        content = "\n".join(
+            f"[bold]{escape(field.decode())}[/bold]: {escape(decode(val))}" for field, val in fields.items()
         )
-
     elif key_type == "set":
-        members = sorted(m.decode() for m in r.smembers(key))
-        print(
-            Panel(
-                "\n".join(members), title=f"[bold cyan]{key}[/bold cyan] [dim]({key_type})[/dim]"
-            )
-        )
-
+        _, members = value
+        content = Text("\n".join(sorted(decode(m) for m in members)))
     elif key_type == "zset":
-        items = r.zrange(key, 0, -1, withscores=True)
-        lines = [f"{m.decode()}: {s}" for m, s in items]
-        print(
-            Panel("\n".join(lines), title=f"[bold cyan]{key}[/bold cyan] [dim]({key_type})[/dim]")
-        )
-
+        content = Text("\n".join(f"{decode(m)}: {s}" for m, s in value))
     else:
-        print(Panel(f"[dim]Unsupported type: {key_type}[/dim]", title=f"[bold cyan]{key}[/bold cyan] [dim]({key_type})[/dim]"))
-
-    print()
+        return Panel(f"[dim]Unsupported type: {key_type}[/dim]", title=title)
+    shown = min(size, args.max_items)
+    return Panel(content, title=title, subtitle=f"[dim]{shown} of {size:,} item(s)[/dim]")
+
+
+def show_keys() -> None:
+    shown = 0
+    for keys in scan_pages():
+        if args.limit is not None:
+            keys = keys[: args.limit - shown]
+        pipe = r.pipeline(transaction=False)
+        for key in keys:
+            pipe.type(key)
+        types = [t.decode() for t in pipe.execute()]
+        if not args.values:
+            for key, key_type in zip(keys, types):
+                print(f"  [bold cyan]{escape(key.decode())}[/bold cyan] [dim]({key_type})[/dim]")
+        else:
+            for key, key_type, (size, value) in zip(keys, types, fetch_values(keys, types)):
+                if key_type == "none":  # deleted between SCAN and TYPE
+                    continue
+                print(render(key.decode(), key_type, size, value))
+                print()
+        shown += len(keys)
+        if shown == args.limit:
+            break
+    if not shown:
+        print("[dim]No keys found in Redis.[/dim]")
+    else:
+        print(f"\n[dim]{shown:,} key(s) matching {escape(repr(args.match))}[/dim]\n")
+
+
+def show_memory() -> None:
+    """Sum MEMORY USAGE per key prefix, e.g. memory_demo for the keys agent_memory_redis.py writes."""
+    keys_per_prefix: dict[str, int] = defaultdict(int)
+    bytes_per_prefix: dict[str, int] = defaultdict(int)
+    largest: list[tuple[int, str]] = []  # min-heap of the 10 largest keys
+    scanned = 0
+    for keys in scan_pages():
+        pipe = r.pipeline(transaction=False)
+        for key in keys:
+            pipe.memory_usage(key)
+        for key, usage in zip(keys, pipe.execute()):
+            name = key.decode(errors="replace")
+            prefix = ":".join(name.split(":")[: args.prefix_depth])
+            keys_per_prefix[prefix] += 1
+            bytes_per_prefix[prefix] += usage or 0
+            (heapq.heappush if len(largest) < 10 else heapq.heappushpop)(largest, (usage or 0, name))
+        scanned += len(keys)
+        if sys.stdout.isatty():
+            print(f"[dim]Scanned {scanned:,} keys...[/dim]", end="\r")
+
+    if not scanned:
+        print("[dim]No keys found in Redis.[/dim]")
+        return
+    used_memory = r.info("memory").get("used_memory", 0)
+    total = sum(bytes_per_prefix.values())
+    table = Table(title=f"Memory usage by prefix ({scanned:,} keys matching {escape(repr(args.match))})")
+    for column in ("Prefix", "Keys", "Bytes", "Bytes/key", "Share"):
+        table.add_column(column, justify="left" if column == "Prefix" else "right")
+    for prefix, size in sorted(bytes_per_prefix.items(), key=lambda item: item[1], reverse=True):
+        count = keys_per_prefix[prefix]
+        table.add_row(escape(prefix), f"{count:,}", f"{size:,}", f"{size / count:,.0f}", f"{size / max(total, 1):.1%}")
+    print(table)
+    table = Table(title="Largest keys")
+    table.add_column("Key")
+    table.add_column("Bytes", justify="right")
+    for size, name in sorted(largest, reverse=True):
+        table.add_row(escape(name), f"{size:,}")
+    print(table)
+    print(f"[dim]Keys total {total:,} bytes; the server reports {used_memory:,} bytes used overall.[/dim]\n")
+
+
+if args.memory:
+    show_memory()
+else:
+    show_keys()
@@ -1,23 +1,53 @@
-"""A simple script to view all sessions and messages stored in SQLite, formatted with Rich."""
+"""A script to browse the sessions and messages stored in SQLite, formatted with Rich.
+
+Everything is streamed with keyset pagination (``WHERE id > ? ORDER BY id LIMIT ?``),
+so it is safe to point at a history database with millions of rows: memory use is
+one page, and a page only reads the index range it shows.
+
+Usage:
+    uv run examples/sqlite_viewer.py                          # list sessions with message counts
+    uv run examples/sqlite_viewer.py --values                 # stream messages, oldest first
+    uv run examples/sqlite_viewer.py --values --session ID    # one session's messages
+    uv run examples/sqlite_viewer.py --values --since 1200 --limit 100
+    uv run examples/sqlite_viewer.py --stats                  # aggregate statistics, computed in SQL
+    uv run examples/sqlite_viewer.py --stats --sample 1000    # decode fewer encoded messages for the tool-call counts
+"""
 
 import argparse
 import json
 import sqlite3
 import sys
+from collections import Counter
+from collections.abc import Iterator
+from typing import Any
 
+from agent_history_sqlite import MessageCodec
 from rich import print
-from rich.panel import Panel
 from rich.syntax import Syntax
+from rich.table import Table
 
 DB_PATH = "chat_history.sqlite3"
 
 parser = argparse.ArgumentParser(description="View sessions and messages in the SQLite chat history database.")
 parser.add_argument("--db", default=DB_PATH, help="Path to the SQLite database (default: chat_history.sqlite3)")
-parser.add_argument("--values", action="store_true", help="Show messages for each session (default: list sessions only)")
+parser.add_argument("--values", action="store_true", help="Show messages (default: list sessions only)")
+parser.add_argument("--session", help="Only show this session")
+parser.add_argument("--since", type=int, default=0, help="Only show messages with a row id greater than this")
+parser.add_argument("--limit", type=int, help="Show at most this many sessions or messages")
+parser.add_argument("--page-size", type=int, default=50, help="Rows fetched (and shown) per page (default: 50)")
+parser.add_argument("--json", action="store_true", help="Print each message as full JSON instead of a summary")
+parser.add_argument("--stats", action="store_true", help="Show aggregate statistics instead of rows")
+parser.add_argument(
+    "--sample",
+    type=int,
+    default=10_000,
+    help="With --stats, decode at most this many of the newest encoded messages to count tool calls (default: 10000)",
+)
 args = parser.parse_args()
 
 try:
-    conn = sqlite3.connect(args.db)
+    # Read-only, so the viewer can never modify (or lock for writing) a live database
+    conn = sqlite3.connect(f"file:{args.db}?mode=ro", uri=True)
     # Verify the table exists
     cursor = conn.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='messages'")
     if not cursor.fetchone():
@@ -27,44 +57,201 @@ except sqlite3.Error as e:
     print(f"[red]Cannot open database {args.db}: {e}[/red]")
     sys.exit(1)
 
-# Get all sessions with message counts
-sessions = conn.execute(
-    "SELECT session_id, COUNT(*) as count FROM messages GROUP BY session_id ORDER BY session_id"
-).fetchall()
 
-if not sessions:
-    print("[dim]No sessions found in the database.[/dim]")
-    sys.exit(0)
+# ── Decoding ─────────────────────────────────────────────────────────
+# Rows are JSON text, or BLOBs written by MessageCodec in agent_history_sqlite.py,
+# compressed with the dictionaries saved next to them.
 
-print(f"\n[bold]Found {len(sessions)} session(s) in {args.db}[/bold]\n")
+dictionaries = []
+if conn.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='codec_dictionaries'").fetchone():
+    dictionaries = [data for (data,) in conn.execute("SELECT data FROM codec_dictionaries ORDER BY rowid")]
+codec = MessageCodec(dictionaries=dictionaries)
 
-if not args.values:
-    for session_id, count in sessions:
-        print(f"  [bold cyan]{session_id}[/bold cyan] [dim]({count} messages)[/dim]")
-    print()
-    sys.exit(0)
 
-for session_id, count in sessions:
-    rows = conn.execute(
-        "SELECT message_json FROM messages WHERE session_id = ? ORDER BY id", (session_id,)
-    ).fetchall()
+def decode(value: str | bytes) -> dict[str, Any]:
+    """Decode a stored message to its dict form, whichever format it was written in."""
+    return codec.decode(value).to_dict()
+
 
+def summarize(message: dict[str, Any]) -> str:
+    """One line per message: its text, or the tool calls and results it carries."""
     parts = []
-    for message_json, in rows:
-        try:
-            formatted = json.dumps(json.loads(message_json), indent=2)
-        except json.JSONDecodeError:
-            formatted = message_json
-        parts.append(formatted)
-    combined = "\n---\n".join(parts)
-    content = Syntax(combined, "json", theme="monokai", word_wrap=True)
-    print(
-        Panel(
-            content,
-            title=f"[bold cyan]{session_id}[/bold cyan]",
-            subtitle=f"[dim]{count} item(s)[/dim]",
+    for content in message.get("contents", []):
+        if content.get("type") == "text":
+            parts.append(content.get("text", ""))
+        elif content.get("type") == "function_call":
+            parts.append(f"[yellow]→ {content.get('name')}({json.dumps(content.get('arguments'))})[/yellow]")
+        elif content.get("type") == "function_result":
+            parts.append(f"[dim]← {str(content.get('result'))[:200]}[/dim]")
+    return " ".join(parts).replace("\n", " ")
+
+
+# ── Paging ───────────────────────────────────────────────────────────
+
+
+def next_page() -> bool:
+    """Pause between pages when attached to a terminal. Returns False if the user quits."""
+    if not sys.stdin.isatty() or not sys.stdout.isatty():
+        return True
+    answer = input("-- more (Enter), q to quit -- ")
+    return answer.strip().lower() != "q"
+
+
+def stream_sessions() -> Iterator[tuple[str, int, int]]:
+    """Yield (session_id, messages, newest row id) in session order, one page of sessions at a time."""
+    after = ""
+    while True:
+        rows = conn.execute(
+            "SELECT session_id, COUNT(*), MAX(id) FROM messages WHERE session_id > ? "
+            "AND (? IS NULL OR session_id = ?) GROUP BY session_id ORDER BY session_id LIMIT ?",
+            (after, args.session, args.session, args.page_size),
+        ).fetchall()
+        yield from rows
+        if len(rows) < args.page_size:
+            return
+        after = rows[-1][0]
+
+
+def stream_messages() -> Iterator[tuple[int, str, str | bytes]]:
+    """Yield (id, session_id, stored value) in id order, one page at a time."""
+    after = args.since
+    while True:
+        if args.session:
+            rows = conn.execute(
+                "SELECT id, session_id, message_json FROM messages WHERE session_id = ? AND id > ? ORDER BY id LIMIT ?",
+                (args.session, after, args.page_size),
+            ).fetchall()
+        else:
+            rows = conn.execute(
+                "SELECT id, session_id, message_json FROM messages WHERE id > ? ORDER BY id LIMIT ?",
+                (after, args.page_size),
+            ).fetchall()
+        yield from rows
+        if len(rows) < args.page_size:
+            return
+        after = rows[-1][0]
+
+
+def list_sessions() -> None:
+    shown = 0
+    for session_id, count, last_id in stream_sessions():
+        print(f"  [bold cyan]{session_id}[/bold cyan] [dim]({count} messages, newest id {last_id})[/dim]")
+        shown += 1
+        if shown == args.limit:
+            break
+        if shown % args.page_size == 0 and not next_page():
+            break
+    if not shown:
+        print("[dim]No sessions found in the database.[/dim]")
+
+
+def show_messages() -> None:
+    shown = 0
+    last_id = args.since
+    for row_id, session_id, value in stream_messages():
+        message = decode(value)
+        role = message.get("role", "?")
+        print(f"[dim]{row_id:>8}[/dim] [cyan]{session_id[:12]}[/cyan] [bold]{role:>9}[/bold]: {summarize(message)}")
+        if args.json:
+            print(Syntax(json.dumps(message, indent=2), "json", theme="monokai", word_wrap=True))
+        shown += 1
+        last_id = row_id
+        if shown == args.limit:
+            break
+        if shown % args.page_size == 0 and not next_page():
+            break
+    if not shown:
+        print("[dim]No messages found.[/dim]")
+    else:
+        print(f"\n[dim]{shown} message(s); continue with --since {last_id}[/dim]")
+
+
+# ── Statistics ───────────────────────────────────────────────────────
+
+HISTOGRAM_BUCKETS = [(1, 9), (10, 49), (50, 99), (100, 499), (500, 999), (1000, None)]
+
+
+def show_stats() -> None:
+    """Aggregate statistics, computed in SQL so only the results are loaded into Python."""
+    sessions, messages, total_bytes = conn.execute(
+        "SELECT COUNT(DISTINCT session_id), COUNT(*), COALESCE(SUM(LENGTH(CAST(message_json AS BLOB))), 0) "
+        "FROM messages"
+    ).fetchone()
+    print(f"\n[bold]{args.db}[/bold]: {sessions:,} sessions, {messages:,} messages, {total_bytes / 1e6:,.1f} MB stored")
+    if not messages:
+        return
+
+    bucket = " ".join(
+        f"WHEN n BETWEEN {low} AND {high} THEN '{low}-{high}'" if high else f"WHEN n >= {low} THEN '{low}+'"
+        for low, high in HISTOGRAM_BUCKETS
+    )
+    histogram = dict(
+        conn.execute(
+            f"SELECT CASE {bucket} END AS bucket, COUNT(*) "
+            "FROM (SELECT COUNT(*) AS n FROM messages GROUP BY session_id) GROUP BY bucket"
+        ).fetchall()
+    )
+    table = Table(title="Messages per session")
+    table.add_column("Messages")
+    table.add_column("Sessions", justify="right")
+    table.add_column("")
+    largest = max(histogram.values())
+    for low, high in HISTOGRAM_BUCKETS:
+        label = f"{low}-{high}" if high else f"{low}+"
+        count = histogram.get(label, 0)
+        table.add_row(label, f"{count:,}", "█" * round(30 * count / largest))
+    print(table)
+
+    table = Table(title="Largest sessions by stored bytes")
+    for column in ("Session", "Messages", "Bytes", "Bytes/message"):
+        table.add_column(column, justify="left" if column == "Session" else "right")
+    for session_id, count, size in conn.execute(
+        "SELECT session_id, COUNT(*), SUM(LENGTH(CAST(message_json AS BLOB))) AS size "
+        "FROM messages GROUP BY session_id ORDER BY size DESC LIMIT 10"
+    ):
+        table.add_row(session_id, f"{count:,}", f"{size:,}", f"{size / count:,.0f}")
+    print(table)
+    per_session, per_message = total_bytes / sessions, total_bytes / messages
+    print(f"[dim]Average: {per_session:,.0f} bytes per session, {per_message:,.0f} per message[/dim]")
+
+    # Tool calls are counted in SQL for JSON rows. Encoded (BLOB) rows can't be parsed by SQLite and
+    # decoding them all would be a full pass in Python, so only the newest --sample of them are decoded.
+    tool_calls = Counter(
+        dict(
+            conn.execute(
+                "SELECT json_extract(content.value, '$.name'), COUNT(*) "
+                "FROM messages, json_each(messages.message_json, '$.contents') AS content "
+                "WHERE typeof(messages.message_json) = 'text' "
+                "AND json_extract(content.value, '$.type') = 'function_call' "
+                "GROUP BY 1"
+            ).fetchall()
         )
     )
+    (encoded,) = conn.execute("SELECT COUNT(*) FROM messages WHERE typeof(message_json) = 'blob'").fetchone()
+    for (value,) in conn.execute(
+        "SELECT message_json FROM messages WHERE typeof(message_json) = 'blob' ORDER BY id DESC LIMIT ?",
+        (args.sample,),
+    ):
+        for content in decode(value).get("contents", []):
+            if content.get("type") == "function_call":
+                tool_calls[content.get("name")] += 1
+    table = Table(title="Top tool calls")
+    table.add_column("Tool")
+    table.add_column("Calls", justify="right")
+    for name, count in tool_calls.most_common(10):
+        table.add_row(str(name), f"{count:,}")
+    print(table if tool_calls else "[dim]No tool calls found.[/dim]")
+    if encoded > args.sample:
+        print(f"[dim]Counted from the newest {args.sample:,} of {encoded:,} encoded messages (--sample)[/dim]")
+
+
+if args.stats:
+    show_stats()
+elif args.values:
+    show_messages()
+else:
+    print(f"\n[bold]Sessions in {args.db}[/bold]\n")
+    list_sessions()
     print()
 
 conn.close()
@@ -4,27 +4,97 @@ Demonstrates: Executor subclasses, @handler, typed WorkflowContext, and
 WorkflowBuilder with explicit edges — no AI agents involved.
 
 Pipeline:
-    Extract → Chunk → Embed
+    Extract → Chunk → Dedup → Embed ⟲ → Store
+
+The Chunk step makes one pass over the markdown and packs sentences into
+chunks of a target token size, with a small overlap between neighbours.
+Chunks never cross a heading, and each one carries its heading path
+(e.g. "Benefits > Health plans") as metadata.
+
+The Dedup step drops near-duplicate chunks (repeated headers, disclaimers,
+footers) before they cost an embedding call. It compares MinHash signatures
+through an in-memory LSH index that lives as long as the workflow, so it
+catches copies within a document and across documents ingested earlier in
+the same process.
+
+The Embed step packs chunks into token-bounded batches and sends them
+concurrently (with a cap on in-flight requests) through an async client,
+instead of one blocking request per chunk. Embeddings are requested in
+base64 and decoded straight into a float32 matrix per batch (4 bytes per
+dimension, versus ~30 for a Python list of floats); each EmbeddedChunk
+holds a row view of that matrix.
+
+The Store step persists embedded chunks, keyed on a hash of the chunk text
+so re-ingesting a document never writes a chunk twice. Set RAG_STORE to pick
+the backend:
+  - sqlite (default): a local file with the vector as a float32 BLOB and an
+    FTS5 index for keyword search, written in batched transactions
+  - postgres: a document_chunks table shaped like the products table in
+    agent_knowledge_pg.py (pgvector + full-text index), loaded with binary COPY
+
+Re-runs are incremental. A SQLite manifest records each document's mtime,
+size and content hash, and the hash of every chunk stored from it:
+  - a document whose mtime and size are unchanged is skipped without being read,
+  - a document whose bytes hash the same is skipped before extraction,
+  - a changed document is re-chunked, only chunks with new hashes are embedded,
+    and chunks it no longer contains are deleted from the store.
+Store writes the manifest rows only after the chunks they describe are
+committed, so an interrupted run never marks unsaved work as done.
+
+Runs are checkpointed. Embed writes its batches once to a spool table in
+the checkpoint file and works through them a few at a time, one wave per
+superstep. The workflow saves a checkpoint to that file after every
+superstep: Embed's cursor into the spool, the embedded batches on their
+way to Store, and the ids of batches Store has written. Checkpoints stay
+the same small size however large the document is.
+Re-running with the same --run-id resumes from the last checkpoint instead
+of starting over. A batch replayed after a crash is harmless, because the
+store skips chunk hashes it already has, so each chunk is written once.
 
 Run:
     uv run examples/workflow_rag_ingest.py
+    uv run examples/workflow_rag_ingest.py doc1.pdf doc2.pdf  (ingest several files; duplicates collapse across them)
+    uv run examples/workflow_rag_ingest.py --run-id nightly   (resume the "nightly" run if it was interrupted)
     uv run examples/workflow_rag_ingest.py --devui  (opens DevUI at http://localhost:8090)
+    uv run examples/workflow_rag_ingest.py --benchmark  (chunker MB/s, memory per 1M chunks, embedding chunks/sec)
 
 In the DevUI, enter a filename relative to the examples/ folder, e.g.: sample_document.pdf
 """
 
+import argparse
 import asyncio
+import base64
+import hashlib
 import logging
 import os
+import pickle
+import random
+import re
+import sqlite3
 import sys
-from dataclasses import dataclass, field
+import time
+import tracemalloc
+import uuid
+import zlib
+from dataclasses import asdict, dataclass, field
+from datetime import datetime
 from pathlib import Path
+from typing import Any, Protocol
 
-from agent_framework import Executor, WorkflowBuilder, WorkflowContext, handler
-from azure.identity import DefaultAzureCredential, get_bearer_token_provider
+import numpy as np
+import openai
+from agent_framework import (
+    Executor,
+    WorkflowBuilder,
+    WorkflowCheckpoint,
+    WorkflowCheckpointException,
+    WorkflowContext,
+    handler,
+)
+from azure.identity.aio import DefaultAzureCredential, get_bearer_token_provider
 from dotenv import load_dotenv
 from markitdown import MarkItDown
-from openai import OpenAI
+from openai import AsyncOpenAI
 from rich.logging import RichHandler
 from typing_extensions import Never
 
@@ -36,105 +106,1342 @@ logger.setLevel(logging.INFO)
 load_dotenv(override=True)
 API_HOST = os.getenv("API_HOST", "github")
 EMBEDDING_DIMENSIONS = 256  # Smaller dimension for efficiency
+RAG_STORE = os.getenv("RAG_STORE", "sqlite")
+SQLITE_PATH = os.getenv("RAG_SQLITE_PATH", "rag_chunks.sqlite3")
+POSTGRES_URL = os.getenv("POSTGRES_URL", "postgresql://admin:LocalPasswordOnly@db:5432/postgres")
+CHECKPOINT_PATH = os.getenv("RAG_CHECKPOINT_PATH", "rag_checkpoints.sqlite3")
+MANIFEST_PATH = os.getenv("RAG_MANIFEST_PATH", "rag_manifest.sqlite3")
 
-# Configure the embedding client based on the API host
+# Configure the async embedding client based on the API host
+async_credential = None
 if API_HOST == "azure":
-    sync_credential = DefaultAzureCredential()
-    sync_token_provider = get_bearer_token_provider(sync_credential, "https://cognitiveservices.azure.com/.default")
-    embed_client = OpenAI(
+    async_credential = DefaultAzureCredential()
+    token_provider = get_bearer_token_provider(async_credential, "https://cognitiveservices.azure.com/.default")
+    embed_client = AsyncOpenAI(
         base_url=f"{os.environ['AZURE_OPENAI_ENDPOINT']}/openai/v1/",
-        api_key=sync_token_provider(),
+        api_key=token_provider,
     )
     embed_model = os.environ.get("AZURE_OPENAI_EMBEDDING_DEPLOYMENT", "text-embedding-3-small")
 elif API_HOST == "github":
-    embed_client = OpenAI(
+    embed_client = AsyncOpenAI(
         base_url="https://models.github.ai/inference",
         api_key=os.environ["GITHUB_TOKEN"],
     )
     embed_model = "text-embedding-3-small"
 else:
-    embed_client = OpenAI(api_key=os.environ["OPENAI_API_KEY"])
+    embed_client = AsyncOpenAI(api_key=os.environ["OPENAI_API_KEY"])
     embed_model = "text-embedding-3-small"
 
 
+def chunk_hash(text: str) -> str:
+    """Content hash of a chunk, the idempotency key in the vector store and the manifest."""
+    return hashlib.blake2b(text.encode(), digest_size=16).hexdigest()
+
+
 @dataclass
+class DocumentRecord:
+    """Manifest entry for a document: what it looked like when it was ingested.
+
+    ``stale_chunks`` are the hashes of chunks stored from an earlier version of the
+    document that the current version no longer contains.
+    """
+
+    source: str
+    mtime_ns: int
+    size: int
+    doc_hash: str
+    stale_chunks: list[str] = field(default_factory=list)
+
+
+@dataclass
+class Document:
+    """A converted document and the file it came from."""
+
+    source: str
+    markdown: str
+    record: DocumentRecord | None = None
+
+
+@dataclass(slots=True)
+class TextChunk:
+    """A chunk of text, the headings it sits under, and the document it came from."""
+
+    text: str
+    heading_path: tuple[str, ...] = ()
+    tokens: int = 0
+    source: str = ""
+
+    @property
+    def chunk_hash(self) -> str:
+        return chunk_hash(self.text)
+
+
+@dataclass(slots=True)
 class EmbeddedChunk:
-    """A text chunk paired with its embedding vector."""
+    """A text chunk paired with its embedding vector.
+
+    ``vector`` is a 1-D float32 array, usually a row view into the 2-D matrix of the
+    batch it was embedded in. pgvector's psycopg adapter accepts it as-is.
+    """
 
     text: str
-    vector: list[float] = field(default_factory=list)
+    vector: np.ndarray
+    heading_path: tuple[str, ...] = ()
+    source: str = ""
+
+    @property
+    def chunk_hash(self) -> str:
+        return chunk_hash(self.text)
+
+    def vector_blob(self) -> memoryview:
+        """The raw float32 bytes, for a SQLite BLOB column, without copying."""
+        return self.vector.data
+
+
+@dataclass
+class EmbeddedBatch:
+    """One embedded batch on its way to the store. ``batch_id`` is stable within a run."""
+
+    batch_id: int
+    chunks: list[EmbeddedChunk]
+
+
+@dataclass
+class EmbedNext:
+    """Tells Embed to send the next wave of batches."""
+
+
+@dataclass
+class EndOfDocument:
+    """Sent by Embed after its last batch, so Store can report totals."""
+
+    batches: int
+
+
+# ── Ingestion manifest (SQLite) ──────────────────────────────────────
+
+
+class IngestManifest:
+    """Tracks which documents and chunks are already in the vector store.
+
+    The connection is opened on first use, so importing this module creates no file.
+    """
+
+    def __init__(self, db_path: str) -> None:
+        self._db_path = db_path
+        self._conn: sqlite3.Connection | None = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(self._db_path)
+            self._conn.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS documents (
+                    source TEXT PRIMARY KEY,
+                    mtime_ns INTEGER NOT NULL,
+                    size INTEGER NOT NULL,
+                    doc_hash TEXT NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS chunks (
+                    source TEXT NOT NULL,
+                    chunk_hash TEXT NOT NULL,
+                    PRIMARY KEY (source, chunk_hash)
+                ) WITHOUT ROWID;
+                CREATE INDEX IF NOT EXISTS chunks_by_hash ON chunks (chunk_hash);
+                """
+            )
+        return self._conn
+
+    def get_document(self, source: str) -> DocumentRecord | None:
+        row = (
+            self._connect()
+            .execute("SELECT mtime_ns, size, doc_hash FROM documents WHERE source = ?", (source,))
+            .fetchone()
+        )
+        return DocumentRecord(source, *row) if row else None
+
+    def chunk_hashes(self, source: str) -> set[str]:
+        rows = self._connect().execute("SELECT chunk_hash FROM chunks WHERE source = ?", (source,))
+        return {row[0] for row in rows}
+
+    def touch_document(self, record: DocumentRecord) -> None:
+        """Refresh mtime/size for a document whose content hash did not change."""
+        conn = self._connect()
+        with conn:
+            conn.execute(
+                "UPDATE documents SET mtime_ns = ?, size = ? WHERE source = ?",
+                (record.mtime_ns, record.size, record.source),
+            )
+
+    def record_chunks(self, chunks: list[TextChunk] | list[EmbeddedChunk]) -> None:
+        """Record chunks whose store write has committed."""
+        conn = self._connect()
+        with conn:
+            conn.executemany(
+                "INSERT OR IGNORE INTO chunks (source, chunk_hash) VALUES (?, ?)",
+                [(c.source, c.chunk_hash) for c in chunks],
+            )
+
+    def unreferenced(self, source: str, hashes: list[str]) -> list[str]:
+        """The hashes no other document has a chunk with, so their store rows can go."""
+        conn = self._connect()
+        return [
+            h
+            for h in hashes
+            if conn.execute("SELECT 1 FROM chunks WHERE chunk_hash = ? AND source != ?", (h, source)).fetchone() is None
+        ]
+
+    def record_document(self, record: DocumentRecord) -> None:
+        """Drop the document's stale chunks and upsert its entry, once all its chunks are stored."""
+        conn = self._connect()
+        with conn:
+            conn.executemany(
+                "DELETE FROM chunks WHERE source = ? AND chunk_hash = ?",
+                [(record.source, h) for h in record.stale_chunks],
+            )
+            conn.execute(
+                "INSERT OR REPLACE INTO documents (source, mtime_ns, size, doc_hash) VALUES (?, ?, ?, ?)",
+                (record.source, record.mtime_ns, record.size, record.doc_hash),
+            )
+
+    def close(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+def file_hash(path: str | Path) -> str:
+    """Hash a file's bytes, reading it in 1 MB blocks."""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        while block := f.read(1 << 20):
+            digest.update(block)
+    return digest.hexdigest()
 
 
 class ExtractExecutor(Executor):
-    """Convert a local file to plain markdown text."""
+    """Convert a local file to plain markdown text, unless the manifest shows it is unchanged."""
+
+    def __init__(self, *, manifest: IngestManifest | None = None, id: str = "extract") -> None:
+        super().__init__(id=id)
+        self._manifest = manifest
 
     @handler
-    async def extract(self, path: str, ctx: WorkflowContext[str]) -> None:
+    async def extract(self, path: str, ctx: WorkflowContext[Document]) -> None:
         """Convert the file at the given path to markdown.
 
         Accepts an absolute path or a filename relative to the examples folder
         (e.g. ``sample_document.pdf``). Surrounding quotes are stripped automatically.
-        WorkflowContext[str] means this node sends a str to the next node.
+        WorkflowContext[Document] means this node sends a Document to the next node.
+        A document the manifest already has in this version sends nothing, which ends the run.
         """
         path = path.strip("'\"")
         resolved = Path(path) if Path(path).is_absolute() else Path(__file__).parent.parent / path
+        # Keyed by absolute path, like workflow_rag_ingest_corpus.py, so files with the same name don't collide
+        source = str(resolved.resolve())
+        stat = resolved.stat()
+        known = self._manifest.get_document(source) if self._manifest else None
+        if known and (known.mtime_ns, known.size) == (stat.st_mtime_ns, stat.st_size):
+            logger.info(f"→ {resolved.name} is unchanged (same mtime and size), skipped")
+            return
+        doc_hash = await asyncio.to_thread(file_hash, resolved)
+        record = DocumentRecord(source, stat.st_mtime_ns, stat.st_size, doc_hash)
+        if known and known.doc_hash == doc_hash:
+            # Touched but identical bytes: remember the new mtime so the next run skips on stat alone
+            assert self._manifest is not None
+            self._manifest.touch_document(record)
+            logger.info(f"→ {resolved.name} is unchanged (same content hash), skipped")
+            return
         result = MarkItDown().convert(str(resolved))
-        await ctx.send_message(result.text_content)
+        await ctx.send_message(Document(source=source, markdown=result.text_content, record=record))
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (~4 characters per token for English text)."""
+    return len(text) // 4 + 1
+
+
+HEADING_RE = re.compile(r"^(#{1,6})\s+(.*?)[\s#]*$")
+# A sentence ends at . ! or ? followed by whitespace and something that can start a sentence
+SENTENCE_BREAK_RE = re.compile(r"(?<=[.!?])\s+(?=[\"'(\[]?[A-Z0-9])")
+
+
+class MarkdownChunker:
+    """Split markdown into token-sized chunks in a single pass over its lines.
+
+    Sentences are the unit of packing: a chunk is closed before the sentence that
+    would push it past ``target_tokens``, and the next chunk starts with the last
+    sentences of the previous one, up to ``overlap_tokens``. Headings always close
+    the current chunk (no overlap across sections) and update the heading path.
+    A sentence longer than the target on its own is split at word boundaries.
+
+    ``split`` chunks a whole document. To chunk one that is read in parts, call
+    ``feed`` with each part (cut at line boundaries) and ``finish`` after the last;
+    the chunks, headings and overlaps come out the same as from ``split``.
+    """
+
+    def __init__(self, *, target_tokens: int = 400, overlap_tokens: int = 60, min_tokens: int = 16) -> None:
+        if not 0 <= overlap_tokens < target_tokens:
+            raise ValueError("overlap_tokens must be smaller than target_tokens")
+        self.target_tokens = target_tokens
+        self.overlap_tokens = overlap_tokens
+        self.min_tokens = min_tokens
+        self.reset()
+
+    def split(self, markdown: str) -> list[TextChunk]:
+        self.reset()
+        return self.feed(markdown) + self.finish()
+
+    def reset(self) -> None:
+        """Forget any partly fed document."""
+        self._chunks: list[TextChunk] = []
+        self._headings: list[str] = []
+        # Sentences of the chunk being built, as (separator, sentence, tokens); joined once when emitted
+        self._window: list[tuple[str, str, int]] = []
+        self._window_tokens = 0
+        self._fresh = 0  # sentences in the window that no earlier chunk contains
+        self._paragraph: list[str] = []
+        self._in_fence = False
+
+    def feed(self, markdown: str) -> list[TextChunk]:
+        """Chunk the next part of a document and return the chunks it completed."""
+        paragraph = self._paragraph
+        in_fence = self._in_fence
+        for line in markdown.splitlines():
+            stripped = line.strip()
+            if stripped.startswith("```"):
+                in_fence = not in_fence
+            heading = None if in_fence else HEADING_RE.match(stripped)
+            if heading:
+                self._add_paragraph(paragraph)
+                self._emit(keep_overlap=False)
+                level = len(heading[1])
+                del self._headings[level - 1 :]
+                self._headings.append(heading[2])
+            elif stripped:
+                paragraph.append(stripped)
+            else:
+                self._add_paragraph(paragraph)
+        self._in_fence = in_fence
+        chunks, self._chunks = self._chunks, []
+        return chunks
+
+    def finish(self) -> list[TextChunk]:
+        """Chunk what is left of the document and return the last chunks."""
+        self._add_paragraph(self._paragraph)
+        self._emit(keep_overlap=False)
+        chunks = self._chunks
+        self.reset()
+        return chunks
+
+    def _add_paragraph(self, lines: list[str]) -> None:
+        if not lines:
+            return
+        separator = "\n\n"
+        for sentence in SENTENCE_BREAK_RE.split(" ".join(lines)):
+            tokens = estimate_tokens(sentence)
+            if tokens > self.target_tokens:
+                for piece in self._split_long(sentence):
+                    self._add_sentence(separator, piece, estimate_tokens(piece))
+                    separator = " "
+            else:
+                self._add_sentence(separator, sentence, tokens)
+            separator = " "
+        lines.clear()
+
+    def _split_long(self, sentence: str) -> list[str]:
+        """Cut an oversize sentence into word-aligned pieces of about ``target_tokens``."""
+        max_chars = (self.target_tokens - 1) * 4
+        pieces: list[str] = []
+        words: list[str] = []
+        size = 0
+        for word in sentence.split():
+            if words and size + len(word) + 1 > max_chars:
+                pieces.append(" ".join(words))
+                words, size = [], 0
+            words.append(word)
+            size += len(word) + 1
+        if words:
+            pieces.append(" ".join(words))
+        return pieces
+
+    def _add_sentence(self, separator: str, sentence: str, tokens: int) -> None:
+        if self._fresh and self._window_tokens + tokens > self.target_tokens:
+            self._emit(keep_overlap=True)
+            # Trim the overlap if it would not leave room for this sentence
+            while self._window and self._window_tokens + tokens > self.target_tokens:
+                self._window_tokens -= self._window.pop(0)[2]
+        self._window.append((separator, sentence, tokens))
+        self._window_tokens += tokens
+        self._fresh += 1
+
+    def _emit(self, *, keep_overlap: bool) -> None:
+        window = self._window
+        if self._fresh and self._window_tokens >= self.min_tokens:
+            text = "".join([part for separator, sentence, _ in window for part in (separator, sentence)][1:])
+            self._chunks.append(TextChunk(text, tuple(self._headings), self._window_tokens))
+        keep, kept_tokens = len(window), 0
+        if keep_overlap:
+            while keep > 0 and kept_tokens + window[keep - 1][2] <= self.overlap_tokens:
+                keep -= 1
+                kept_tokens += window[keep][2]
+        self._window = window[keep:]
+        self._window_tokens = kept_tokens
+        self._fresh = 0
 
 
 class ChunkExecutor(Executor):
-    """Split markdown into paragraphs, keeping only substantive ones."""
+    """Split markdown into overlapping, token-sized chunks that respect sentences and headings.
+
+    Chunks the manifest already lists for the document are dropped, and the document's
+    manifest entry (with the hashes of chunks it no longer has) goes straight to Store.
+    """
+
+    def __init__(
+        self,
+        *,
+        manifest: IngestManifest | None = None,
+        target_tokens: int = 400,
+        overlap_tokens: int = 60,
+        min_tokens: int = 16,
+        id: str = "chunk",
+    ) -> None:
+        super().__init__(id=id)
+        self._manifest = manifest
+        self._chunker = MarkdownChunker(
+            target_tokens=target_tokens, overlap_tokens=overlap_tokens, min_tokens=min_tokens
+        )
 
     @handler
-    async def chunk(self, markdown: str, ctx: WorkflowContext[list[str]]) -> None:
-        """Split on blank lines and filter out headings and short fragments.
+    async def chunk(self, document: Document, ctx: WorkflowContext[list[TextChunk] | DocumentRecord]) -> None:
+        """Chunk the document in one linear pass.
 
-        WorkflowContext[list[str]] means this node sends a list[str] downstream.
+        WorkflowContext[list[TextChunk] | DocumentRecord] means this node sends either type downstream;
+        each goes to the executors that handle it.
         """
-        paragraphs = markdown.split("\n\n")
-        chunks = [p.strip() for p in paragraphs if len(p.strip()) >= 80 and not p.strip().startswith("#")]
-        logger.info(f"→ {len(chunks)} chunks extracted")
+        chunks = self._chunker.split(document.markdown)
+        for text_chunk in chunks:
+            text_chunk.source = document.source
+        logger.info(f"→ {len(chunks)} chunks extracted (target {self._chunker.target_tokens} tokens)")
+        if self._manifest and document.record:
+            known = self._manifest.chunk_hashes(document.source)
+            current = {text_chunk.chunk_hash for text_chunk in chunks}
+            document.record.stale_chunks = sorted(known - current)
+            chunks = [text_chunk for text_chunk in chunks if text_chunk.chunk_hash not in known]
+            logger.info(
+                f"→ {len(current & known)} chunks unchanged since the last ingestion, "
+                f"{len(document.record.stale_chunks)} no longer in the document"
+            )
+        if document.record:
+            await ctx.send_message(document.record)
         await ctx.send_message(chunks)
 
 
+# ── Near-duplicate detection (MinHash + LSH) ──────────────────────────
+
+MINHASH_PRIME = (1 << 61) - 1
+WORD_RE = re.compile(r"\w+")
+
+
+class MinHasher:
+    """Compute MinHash signatures over word shingles with NumPy.
+
+    Words are hashed once (CRC32), shingle hashes are combined from them with
+    vectorized polynomial hashing, and all ``num_perm`` permutations are applied
+    to every shingle in one array operation.
+    """
+
+    def __init__(self, *, num_perm: int = 128, shingle_words: int = 5, seed: int = 1) -> None:
+        rng = np.random.default_rng(seed)
+        # Coefficients below 2**31 keep a * hash + b (hash < 2**32) inside uint64 without overflow
+        self._a = rng.integers(1, 1 << 31, size=(num_perm, 1), dtype=np.uint64)
+        self._b = rng.integers(0, 1 << 31, size=(num_perm, 1), dtype=np.uint64)
+        self._shingle_words = shingle_words
+        self._powers = [pow(0x01000193, j, 1 << 32) for j in range(shingle_words)]
+
+    def signature(self, text: str) -> np.ndarray | None:
+        """The MinHash signature of ``text``, or None if it has no words (only punctuation or symbols)."""
+        words = WORD_RE.findall(text.lower())
+        if not words:
+            return None
+        word_hashes = np.fromiter((zlib.crc32(w.encode()) for w in words), dtype=np.uint64, count=len(words))
+        k = min(self._shingle_words, len(words))
+        count = len(words) - k + 1
+        shingles = np.zeros(count, dtype=np.uint64)
+        for j in range(k):
+            # uint64 arithmetic wraps, which is harmless since only the low 32 bits are kept
+            shingles += word_hashes[j : j + count] * np.uint64(self._powers[j])
+        shingles &= np.uint64(0xFFFFFFFF)
+        return ((self._a * shingles + self._b) % np.uint64(MINHASH_PRIME)).min(axis=1)
+
+
+class DedupExecutor(Executor):
+    """Collapse near-duplicate chunks before they are embedded.
+
+    Candidate pairs come from LSH banding: the signature is cut into ``bands``
+    bands, and chunks sharing any band are compared. A candidate counts as a
+    duplicate when the estimated Jaccard similarity reaches ``threshold``. The
+    first copy seen is kept. Chunks without any words (a table rule, a run of
+    symbols) have no signature and are always kept.
+
+    The index lives in memory for as long as the executor does, so it spans every
+    document of a run (and later runs of the same workflow object), but it is not
+    saved with the manifest: an incremental re-run only compares the chunks it
+    embeds with each other, not with chunks that earlier runs stored.
+    """
+
+    def __init__(
+        self,
+        *,
+        threshold: float = 0.8,
+        num_perm: int = 128,
+        bands: int = 16,
+        shingle_words: int = 5,
+        id: str = "dedup",
+    ) -> None:
+        super().__init__(id=id)
+        if num_perm % bands:
+            raise ValueError("num_perm must be divisible by bands")
+        self._hasher = MinHasher(num_perm=num_perm, shingle_words=shingle_words)
+        self._threshold = threshold
+        self._bands = bands
+        self._rows = num_perm // bands
+        self._signatures: list[np.ndarray] = []
+        self._buckets: list[dict[bytes, list[int]]] = [{} for _ in range(bands)]
+        self.tokens_saved = 0
+
+    def _find_duplicate(self, signature: np.ndarray, keys: list[bytes]) -> int | None:
+        checked: set[int] = set()
+        for band, key in enumerate(keys):
+            for candidate in self._buckets[band].get(key, ()):
+                if candidate in checked:
+                    continue
+                checked.add(candidate)
+                if np.mean(self._signatures[candidate] == signature) >= self._threshold:
+                    return candidate
+        return None
+
+    def unique(self, chunks: list[TextChunk]) -> tuple[list[TextChunk], int, int]:
+        """Index ``chunks`` and return the ones to keep.
+
+        Also returns how many were collapsed into a chunk of the same list, and how
+        many into a chunk seen in an earlier call.
+        """
+        first_new = len(self._signatures)
+        unique: list[TextChunk] = []
+        within = across = 0
+        for chunk in chunks:
+            signature = self._hasher.signature(chunk.text)
+            if signature is None:
+                unique.append(chunk)
+                continue
+            keys = [signature[b * self._rows : (b + 1) * self._rows].tobytes() for b in range(self._bands)]
+            duplicate_of = self._find_duplicate(signature, keys)
+            if duplicate_of is not None:
+                if duplicate_of >= first_new:
+                    within += 1
+                else:
+                    across += 1
+                self.tokens_saved += estimate_tokens(chunk.text)
+                continue
+            for band, key in enumerate(keys):
+                self._buckets[band].setdefault(key, []).append(len(self._signatures))
+            self._signatures.append(signature)
+            unique.append(chunk)
+        return unique, within, across
+
+    @handler
+    async def dedup(self, chunks: list[TextChunk], ctx: WorkflowContext[list[TextChunk]]) -> None:
+        """Forward only the first copy of each group of near-duplicate chunks."""
+        start = time.perf_counter()
+        tokens_before = self.tokens_saved
+        unique, within, across = self.unique(chunks)
+        logger.info(
+            f"→ {within + across} near-duplicate chunks collapsed ({within} within the document, "
+            f"{across} seen in earlier documents), ~{self.tokens_saved - tokens_before} embedding tokens saved "
+            f"in {time.perf_counter() - start:.2f}s"
+        )
+        await ctx.send_message(unique)
+
+
+def pack_batches(chunks: list[str], max_batch_tokens: int, max_batch_size: int) -> list[list[int]]:
+    """Group chunk indices into consecutive batches that stay under the token and size limits.
+
+    A single chunk larger than ``max_batch_tokens`` still gets its own batch.
+    """
+    batches: list[list[int]] = []
+    current: list[int] = []
+    current_tokens = 0
+    for index, chunk in enumerate(chunks):
+        tokens = estimate_tokens(chunk)
+        if current and (current_tokens + tokens > max_batch_tokens or len(current) >= max_batch_size):
+            batches.append(current)
+            current, current_tokens = [], 0
+        current.append(index)
+        current_tokens += tokens
+    if current:
+        batches.append(current)
+    return batches
+
+
+class BatchSpool:
+    """Embedding batches waiting in SQLite, written once so that checkpoints only need a cursor.
+
+    Rows are keyed by a spool id (one per run of Embed) and batch id. The connection
+    is opened on first use; the default ``":memory:"`` keeps the spool in memory.
+    """
+
+    def __init__(self, db_path: str = ":memory:") -> None:
+        self._db_path = db_path
+        self._conn: sqlite3.Connection | None = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(self._db_path)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS spooled_batches (spool_id TEXT NOT NULL, batch_id INTEGER NOT NULL, "
+                "chunks BLOB NOT NULL, PRIMARY KEY (spool_id, batch_id)) WITHOUT ROWID"
+            )
+        return self._conn
+
+    def write(self, spool_id: str, batches: list[tuple[int, list[TextChunk]]]) -> None:
+        conn = self._connect()
+        with conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO spooled_batches VALUES (?, ?, ?)",
+                [
+                    (spool_id, batch_id, pickle.dumps([(c.text, c.heading_path, c.tokens, c.source) for c in chunks]))
+                    for batch_id, chunks in batches
+                ],
+            )
+
+    def read(self, spool_id: str, first: int, stop: int) -> list[tuple[int, list[TextChunk]]]:
+        """The batches with ids ``first`` up to (not including) ``stop``."""
+        rows = self._connect().execute(
+            "SELECT batch_id, chunks FROM spooled_batches WHERE spool_id = ? AND batch_id >= ? AND batch_id < ? "
+            "ORDER BY batch_id",
+            (spool_id, first, stop),
+        )
+        return [(batch_id, [TextChunk(*fields) for fields in pickle.loads(blob)]) for batch_id, blob in rows]
+
+    def delete(self, spool_id: str) -> None:
+        conn = self._connect()
+        with conn:
+            conn.execute("DELETE FROM spooled_batches WHERE spool_id = ?", (spool_id,))
+
+
+# Errors worth retrying with backoff; anything else is raised (or bisected, see _embed_batch)
+RETRYABLE_ERRORS = (
+    openai.RateLimitError,
+    openai.APIConnectionError,
+    openai.APITimeoutError,
+    openai.InternalServerError,
+)
+
+
 class EmbedExecutor(Executor):
-    """Embed each chunk with the configured OpenAI embedding model."""
+    """Embed chunks in token-bounded batches with a cap on concurrent requests."""
+
+    def __init__(
+        self,
+        *,
+        client: AsyncOpenAI,
+        model: str,
+        dimensions: int = EMBEDDING_DIMENSIONS,
+        max_batch_tokens: int = 8000,
+        max_batch_size: int = 128,
+        max_concurrency: int = 4,
+        max_retries: int = 5,
+        spool: BatchSpool | None = None,
+        id: str = "embed",
+    ) -> None:
+        """Initialize the executor.
+
+        Args:
+            client: Async OpenAI-compatible client used for the embeddings API.
+            model: Embedding model (or Azure deployment) name.
+            dimensions: Output dimensions requested from the model.
+            max_batch_tokens: Estimated token budget for the inputs of a single request.
+            max_batch_size: Maximum number of inputs in a single request.
+            max_concurrency: Maximum number of embedding requests in flight at once.
+            max_retries: Retries per batch for rate limits and transient server errors.
+            spool: Where queued batches wait; in memory unless given. Use a file to resume from checkpoints.
+        """
+        super().__init__(id=id)
+        self._client = client
+        self._model = model
+        self._dimensions = dimensions
+        self._max_batch_tokens = max_batch_tokens
+        self._max_batch_size = max_batch_size
+        self._max_concurrency = max_concurrency
+        self._max_retries = max_retries
+        self._spool = spool or BatchSpool()
+        # Batches cursor..next_batch_id - 1 are waiting in the spool; only these three values are checkpointed
+        self._spool_id: str | None = None
+        self._cursor = 0
+        self._next_batch_id = 0
+
+    async def _request(self, texts: list[str]) -> np.ndarray:
+        """Send one embeddings request, retrying transient failures with exponential backoff.
+
+        Returns a (len(texts), dimensions) float32 matrix.
+        """
+        for attempt in range(self._max_retries + 1):
+            try:
+                # Ask for base64 explicitly so the SDK hands back raw float32 bytes instead of a list of floats
+                response = await self._client.embeddings.create(
+                    input=texts, model=self._model, dimensions=self._dimensions, encoding_format="base64"
+                )
+                matrix = np.empty((len(texts), self._dimensions), dtype=np.float32)
+                # The API returns one item per input, tagged with its position in the request
+                for item in response.data:
+                    matrix[item.index] = np.frombuffer(base64.b64decode(item.embedding), dtype=np.float32)
+                return matrix
+            except RETRYABLE_ERRORS as error:
+                if attempt == self._max_retries:
+                    raise
+                delay = min(2**attempt, 30) + random.random()
+                logger.warning(
+                    f"→ Embedding batch of {len(texts)} failed ({type(error).__name__}), retry in {delay:.1f}s"
+                )
+                await asyncio.sleep(delay)
+        raise AssertionError("unreachable")
+
+    async def _embed_batch(self, texts: list[str]) -> np.ndarray:
+        """Embed a batch; if the service rejects it, split it so one bad input can't sink the rest."""
+        try:
+            return await self._request(texts)
+        except openai.BadRequestError:
+            if len(texts) == 1:
+                raise
+            middle = len(texts) // 2
+            logger.warning(f"→ Batch of {len(texts)} rejected, retrying as two halves")
+            return np.vstack([await self._embed_batch(texts[:middle]), await self._embed_batch(texts[middle:])])
+
+    async def embed_chunks(self, chunks: list[TextChunk]) -> list[EmbeddedChunk]:
+        """Embed one batch of chunks in one request; the vectors are rows of the batch's float32 matrix.
+
+        Also usable outside the workflow, e.g. by workflow_rag_ingest_streaming.py.
+        """
+        vectors = await self._embed_batch([chunk.text for chunk in chunks])
+        return [
+            EmbeddedChunk(text=chunk.text, vector=vector, heading_path=chunk.heading_path, source=chunk.source)
+            for chunk, vector in zip(chunks, vectors)
+        ]
+
+    async def _embed_wave(self, ctx: WorkflowContext[EmbeddedBatch | EmbedNext | EndOfDocument]) -> None:
+        """Embed up to ``max_concurrency`` queued batches concurrently, then re-schedule.
+
+        One wave per superstep keeps each checkpoint within a few batches of the work done.
+        """
+        if self._spool_id is None or self._cursor == self._next_batch_id:
+            await ctx.send_message(EndOfDocument(batches=self._next_batch_id))
+            if self._spool_id is not None:
+                self._spool.delete(self._spool_id)
+            self._spool_id = None
+            self._cursor = self._next_batch_id = 0
+            return
+        stop = min(self._cursor + self._max_concurrency, self._next_batch_id)
+        wave = self._spool.read(self._spool_id, self._cursor, stop)
+        self._cursor = stop
+        results = await asyncio.gather(*(self.embed_chunks(chunks) for _, chunks in wave))
+        for (batch_id, _), embedded in zip(wave, results):
+            await ctx.send_message(EmbeddedBatch(batch_id=batch_id, chunks=embedded))
+        logger.info(f"→ Embedded batches {wave[0][0]}–{wave[-1][0]}, {self._next_batch_id - self._cursor} left")
+        await ctx.send_message(EmbedNext())
+
+    @handler
+    async def embed(
+        self, chunks: list[TextChunk], ctx: WorkflowContext[EmbeddedBatch | EmbedNext | EndOfDocument]
+    ) -> None:
+        """Pack the chunks into token-bounded batches, spool them, and embed the first wave."""
+        texts = [chunk.text for chunk in chunks]
+        batches: list[tuple[int, list[TextChunk]]] = []
+        for indices in pack_batches(texts, self._max_batch_tokens, self._max_batch_size):
+            batches.append((self._next_batch_id, [chunks[i] for i in indices]))
+            self._next_batch_id += 1
+        if self._spool_id is None:
+            self._spool_id = uuid.uuid4().hex
+        self._spool.write(self._spool_id, batches)
+        logger.info(
+            f"→ {len(chunks)} chunks in {self._next_batch_id - self._cursor} batch(es), "
+            f"up to {self._max_concurrency} at once"
+        )
+        await self._embed_wave(ctx)
 
     @handler
-    async def embed(self, chunks: list[str], ctx: WorkflowContext[Never, list[EmbeddedChunk]]) -> None:
-        """Call the embeddings API for each chunk and yield the results.
+    async def next_wave(self, _: EmbedNext, ctx: WorkflowContext[EmbeddedBatch | EmbedNext | EndOfDocument]) -> None:
+        """Embed the next wave of queued batches."""
+        await self._embed_wave(ctx)
+
+    async def on_checkpoint_save(self) -> dict[str, Any]:
+        return {"spool_id": self._spool_id, "cursor": self._cursor, "next_batch_id": self._next_batch_id}
+
+    async def on_checkpoint_restore(self, state: dict[str, Any]) -> None:
+        self._spool_id = state["spool_id"]
+        self._cursor = state["cursor"]
+        self._next_batch_id = state["next_batch_id"]
+
+
+# ── Vector store sink ────────────────────────────────────────────────
+
+
+class VectorStore(Protocol):
+    """Persists embedded chunks, skipping any whose chunk hash is already stored."""
+
+    def write(self, chunks: list[EmbeddedChunk]) -> int:
+        """Write one batch in a single transaction and return how many rows were new."""
+        ...
+
+    def delete(self, chunk_hashes: list[str]) -> int:
+        """Delete the chunks with these hashes in a single transaction and return how many were removed."""
+        ...
+
+    def close(self) -> None: ...
+
+
+class SQLiteVectorStore:
+    """Chunks with float32 BLOB vectors in SQLite, plus an FTS5 index over the text."""
+
+    def __init__(self, db_path: str) -> None:
+        self._db_path = db_path
+        self._conn: sqlite3.Connection | None = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            # Writes run in a worker thread (one at a time), so the connection may not stay on its creating thread
+            self._conn = sqlite3.connect(self._db_path, check_same_thread=False)
+            self._conn.executescript(
+                """
+                PRAGMA journal_mode = WAL;
+                PRAGMA synchronous = NORMAL;
+                CREATE TABLE IF NOT EXISTS chunks (
+                    id INTEGER PRIMARY KEY,
+                    chunk_hash TEXT NOT NULL UNIQUE,
+                    source TEXT NOT NULL,
+                    heading_path TEXT NOT NULL,
+                    content TEXT NOT NULL,
+                    embedding BLOB NOT NULL
+                );
+                CREATE VIRTUAL TABLE IF NOT EXISTS chunks_fts
+                    USING fts5(content, content='chunks', content_rowid='id');
+                """
+            )
+        return self._conn
+
+    def write(self, chunks: list[EmbeddedChunk]) -> int:
+        conn = self._connect()
+        with conn:
+            last_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM chunks").fetchone()[0]
+            conn.executemany(
+                "INSERT OR IGNORE INTO chunks (chunk_hash, source, heading_path, content, embedding) "
+                "VALUES (?, ?, ?, ?, ?)",
+                [(c.chunk_hash, c.source, " > ".join(c.heading_path), c.text, c.vector_blob()) for c in chunks],
+            )
+            # Index only the rows this batch actually inserted
+            written = conn.execute(
+                "INSERT INTO chunks_fts (rowid, content) SELECT id, content FROM chunks WHERE id > ?", (last_id,)
+            ).rowcount
+        return written
+
+    def delete(self, chunk_hashes: list[str]) -> int:
+        if not chunk_hashes:
+            return 0
+        conn = self._connect()
+        rows = [(h,) for h in chunk_hashes]
+        with conn:
+            # chunks_fts is an external-content index, so its rows are removed with the 'delete' command
+            conn.executemany(
+                "INSERT INTO chunks_fts (chunks_fts, rowid, content) "
+                "SELECT 'delete', id, content FROM chunks WHERE chunk_hash = ?",
+                rows,
+            )
+            return conn.executemany("DELETE FROM chunks WHERE chunk_hash = ?", rows).rowcount
+
+    def close(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+
+
+class PgVectorStore:
+    """Chunks in a pgvector table, bulk-loaded with binary COPY through a staging table."""
 
-        WorkflowContext[Never, list[EmbeddedChunk]] means this terminal node
+    def __init__(self, url: str, dimensions: int = EMBEDDING_DIMENSIONS) -> None:
+        self._url = url
+        self._dimensions = dimensions
+        self._conn = None
+
+    def _connect(self):
+        if self._conn is None:
+            import psycopg
+            from pgvector.psycopg import register_vector
+
+            self._conn = psycopg.connect(self._url)
+            self._conn.execute("CREATE EXTENSION IF NOT EXISTS vector")
+            register_vector(self._conn)
+            self._conn.execute(
+                f"""
+                CREATE TABLE IF NOT EXISTS document_chunks (
+                    id           SERIAL PRIMARY KEY,
+                    chunk_hash   TEXT NOT NULL UNIQUE,
+                    source       TEXT NOT NULL,
+                    heading_path TEXT NOT NULL,
+                    content      TEXT NOT NULL,
+                    embedding    vector({self._dimensions})
+                )
+                """
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS document_chunks_fts "
+                "ON document_chunks USING GIN (to_tsvector('english', content))"
+            )
+            self._conn.commit()
+        return self._conn
+
+    def write(self, chunks: list[EmbeddedChunk]) -> int:
+        conn = self._connect()
+        with conn.transaction(), conn.cursor() as cursor:
+            # COPY can't skip conflicts, so load a staging table and insert from it
+            cursor.execute(
+                f"CREATE TEMP TABLE chunk_staging (chunk_hash TEXT, source TEXT, heading_path TEXT, "
+                f"content TEXT, embedding vector({self._dimensions})) ON COMMIT DROP"
+            )
+            copy_sql = "COPY chunk_staging FROM STDIN WITH (FORMAT BINARY)"
+            with cursor.copy(copy_sql) as copy:
+                copy.set_types(["text", "text", "text", "text", "vector"])
+                for c in chunks:
+                    copy.write_row((c.chunk_hash, c.source, " > ".join(c.heading_path), c.text, c.vector))
+            cursor.execute(
+                "INSERT INTO document_chunks (chunk_hash, source, heading_path, content, embedding) "
+                "SELECT DISTINCT ON (chunk_hash) * FROM chunk_staging ON CONFLICT (chunk_hash) DO NOTHING"
+            )
+            return cursor.rowcount
+
+    def delete(self, chunk_hashes: list[str]) -> int:
+        if not chunk_hashes:
+            return 0
+        conn = self._connect()
+        with conn.transaction():
+            return conn.execute("DELETE FROM document_chunks WHERE chunk_hash = ANY(%s)", (chunk_hashes,)).rowcount
+
+    def close(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+
+
+@dataclass
+class StoreResult:
+    """What the Store step wrote for one run."""
+
+    written: int
+    skipped: int
+    seconds: float
+    removed: int = 0
+
+
+class StoreExecutor(Executor):
+    """Write embedded batches to a vector store, off the event loop, and track which batches are done.
+
+    With a manifest, each batch's chunks are recorded in it once the batch has been
+    written. Document entries arrive from Chunk and are held until the end of the run:
+    then the chunks a document no longer has are deleted from the store (unless another
+    document still has them), and the entry is recorded.
+    """
+
+    def __init__(self, *, store: VectorStore, manifest: IngestManifest | None = None, id: str = "store") -> None:
+        super().__init__(id=id)
+        self._store = store
+        self._manifest = manifest
+        self._reset()
+
+    def _reset(self) -> None:
+        self._stored_batches: set[int] = set()
+        self._documents: list[DocumentRecord] = []
+        self._written = 0
+        self._skipped = 0
+        self._seconds = 0.0
+
+    @handler
+    async def track(self, record: DocumentRecord, ctx: WorkflowContext[Never, StoreResult]) -> None:
+        """Hold a document's manifest entry until all of its chunks are stored."""
+        self._documents.append(record)
+
+    @handler
+    async def store(self, batch: EmbeddedBatch, ctx: WorkflowContext[Never, StoreResult]) -> None:
+        """Persist one batch, unless an earlier attempt of this run already did."""
+        if batch.batch_id in self._stored_batches:
+            return
+        start = time.perf_counter()
+        written = await asyncio.to_thread(self._store.write, batch.chunks)
+        self._seconds += time.perf_counter() - start
+        self._written += written
+        self._skipped += len(batch.chunks) - written
+        self._stored_batches.add(batch.batch_id)
+        if self._manifest:
+            self._manifest.record_chunks(batch.chunks)
+
+    @handler
+    async def finish(self, end: EndOfDocument, ctx: WorkflowContext[Never, StoreResult]) -> None:
+        """Yield how many chunks were new, with write throughput.
+
+        WorkflowContext[Never, StoreResult] means this terminal node
         yields workflow output but does not forward messages further.
         """
+        removed = 0
+        if self._manifest:
+            for record in self._documents:
+                stale = self._manifest.unreferenced(record.source, record.stale_chunks)
+                removed += await asyncio.to_thread(self._store.delete, stale)
+                self._manifest.record_document(record)
+        total = self._written + self._skipped
+        rate = total / self._seconds if self._seconds else 0.0
+        logger.info(
+            f"→ {self._written} new chunks stored, {self._skipped} already present "
+            f"in {len(self._stored_batches)}/{end.batches} batch(es) ({rate:,.0f} chunks/s), {removed} stale removed"
+        )
+        await ctx.yield_output(
+            StoreResult(written=self._written, skipped=self._skipped, seconds=self._seconds, removed=removed)
+        )
+        self._reset()
 
-        embedded = []
-        for chunk in chunks:
-            response = embed_client.embeddings.create(input=chunk, model=embed_model, dimensions=EMBEDDING_DIMENSIONS)
-            embedded.append(EmbeddedChunk(text=chunk, vector=response.data[0].embedding))
-        logger.info(f"→ {len(embedded)} chunks embedded ({EMBEDDING_DIMENSIONS}d each)")
-        await ctx.yield_output(embedded)
+    async def on_checkpoint_save(self) -> dict[str, Any]:
+        return {
+            "stored_batches": sorted(self._stored_batches),
+            "documents": [asdict(record) for record in self._documents],
+            "written": self._written,
+            "skipped": self._skipped,
+            "seconds": self._seconds,
+        }
+
+    async def on_checkpoint_restore(self, state: dict[str, Any]) -> None:
+        self._stored_batches = set(state["stored_batches"])
+        self._documents = [DocumentRecord(**record) for record in state["documents"]]
+        self._written = state["written"]
+        self._skipped = state["skipped"]
+        self._seconds = state["seconds"]
+
+
+# ── Checkpoint storage (SQLite) ──────────────────────────────────────
+
+
+class SQLiteCheckpointStorage:
+    """CheckpointStorage that keeps the checkpoints of one ingestion run in a SQLite file.
+
+    Like FileCheckpointStorage, checkpoints are pickled, so only load files you trust.
+    Only the newest ``keep`` checkpoints of a run are kept.
+    """
+
+    def __init__(self, db_path: str, run_id: str, keep: int = 2) -> None:
+        self.run_id = run_id
+        self._keep = keep
+        self._conn = sqlite3.connect(db_path)
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS checkpoints (
+                checkpoint_id TEXT PRIMARY KEY,
+                run_id TEXT NOT NULL,
+                workflow_name TEXT NOT NULL,
+                timestamp TEXT NOT NULL,
+                data BLOB NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS checkpoints_by_run ON checkpoints (run_id, workflow_name, timestamp);
+            CREATE TABLE IF NOT EXISTS runs (run_id TEXT PRIMARY KEY, completed_at TEXT NOT NULL);
+            """
+        )
+
+    async def save(self, checkpoint: WorkflowCheckpoint) -> str:
+        with self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO checkpoints VALUES (?, ?, ?, ?, ?)",
+                (
+                    checkpoint.checkpoint_id,
+                    self.run_id,
+                    checkpoint.workflow_name,
+                    checkpoint.timestamp,
+                    pickle.dumps(checkpoint.to_dict()),
+                ),
+            )
+            self._conn.execute(
+                "DELETE FROM checkpoints WHERE run_id = ? AND workflow_name = ? AND checkpoint_id NOT IN "
+                "(SELECT checkpoint_id FROM checkpoints WHERE run_id = ? AND workflow_name = ? "
+                "ORDER BY timestamp DESC LIMIT ?)",
+                (self.run_id, checkpoint.workflow_name, self.run_id, checkpoint.workflow_name, self._keep),
+            )
+        return checkpoint.checkpoint_id
+
+    async def load(self, checkpoint_id: str) -> WorkflowCheckpoint:
+        row = self._conn.execute(
+            "SELECT data FROM checkpoints WHERE checkpoint_id = ? AND run_id = ?", (checkpoint_id, self.run_id)
+        ).fetchone()
+        if row is None:
+            raise WorkflowCheckpointException(f"No checkpoint found with ID {checkpoint_id}")
+        return WorkflowCheckpoint.from_dict(pickle.loads(row[0]))
+
+    async def list_checkpoints(self, *, workflow_name: str) -> list[WorkflowCheckpoint]:
+        return [
+            await self.load(checkpoint_id)
+            for checkpoint_id in await self.list_checkpoint_ids(workflow_name=workflow_name)
+        ]
+
+    async def delete(self, checkpoint_id: str) -> bool:
+        with self._conn:
+            cursor = self._conn.execute(
+                "DELETE FROM checkpoints WHERE checkpoint_id = ? AND run_id = ?", (checkpoint_id, self.run_id)
+            )
+        return cursor.rowcount > 0
+
+    async def get_latest(self, *, workflow_name: str) -> WorkflowCheckpoint | None:
+        ids = await self.list_checkpoint_ids(workflow_name=workflow_name)
+        return await self.load(ids[-1]) if ids else None
+
+    async def list_checkpoint_ids(self, *, workflow_name: str) -> list[str]:
+        rows = self._conn.execute(
+            "SELECT checkpoint_id FROM checkpoints WHERE run_id = ? AND workflow_name = ? ORDER BY timestamp",
+            (self.run_id, workflow_name),
+        )
+        return [row[0] for row in rows]
+
+    def is_complete(self) -> bool:
+        return self._conn.execute("SELECT 1 FROM runs WHERE run_id = ?", (self.run_id,)).fetchone() is not None
+
+    def mark_complete(self) -> None:
+        """Record that the run finished and drop its checkpoints."""
+        with self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO runs VALUES (?, ?)", (self.run_id, datetime.now().isoformat()))
+            self._conn.execute("DELETE FROM checkpoints WHERE run_id = ?", (self.run_id,))
+
+    def close(self) -> None:
+        self._conn.close()
 
 
 # Create executor instances
-extract = ExtractExecutor(id="extract")
-chunk = ChunkExecutor(id="chunk")
-embed = EmbedExecutor(id="embed")
+manifest = IngestManifest(MANIFEST_PATH)
+extract = ExtractExecutor(manifest=manifest, id="extract")
+chunk = ChunkExecutor(manifest=manifest, id="chunk")
+dedup = DedupExecutor(id="dedup")
+embed = EmbedExecutor(client=embed_client, model=embed_model, spool=BatchSpool(CHECKPOINT_PATH))
+vector_store = PgVectorStore(POSTGRES_URL) if RAG_STORE == "postgres" else SQLiteVectorStore(SQLITE_PATH)
+store = StoreExecutor(store=vector_store, manifest=manifest)
 
-# Build the workflow: Extract → Chunk → Embed
-workflow = WorkflowBuilder(start_executor=extract).add_edge(extract, chunk).add_edge(chunk, embed).build()
+# Build the workflow: Extract → Chunk → Dedup → Embed ⟲ → Store, plus Chunk → Store for manifest entries.
+# A fixed name lets a new process find the checkpoints of an interrupted run;
+# Embed takes one superstep per wave of batches, so allow plenty of iterations.
+workflow = (
+    WorkflowBuilder(name="rag_ingest", start_executor=extract, max_iterations=100_000)
+    .add_edge(extract, chunk)
+    .add_edge(chunk, dedup)
+    .add_edge(chunk, store)
+    .add_edge(dedup, embed)
+    .add_edge(embed, embed)
+    .add_edge(embed, store)
+    .build()
+)
+
+parser = argparse.ArgumentParser(description="Ingest documents into a vector store.")
+parser.add_argument("paths", nargs="*", default=["sample_document.pdf"], help="Files relative to examples/")
+parser.add_argument("--run-id", help="Name of the run; re-use it to resume an interrupted run")
 
 
 async def main():
-    pdf_path = str(Path(__file__).parent / "sample_document.pdf")
-    logger.info("Processing: %s", pdf_path)
-    events = await workflow.run(pdf_path)
-    outputs = events.get_outputs()
-    for result in outputs:
-        logger.info(f"Embedded {len(result)} chunks:")
-        for chunk in result:
-            preview = chunk.text[:80].replace("\n", " ")
-            logger.info(f"  [{len(chunk.vector)}d] {preview}…")
+    args = parser.parse_args()
+    run_id = args.run_id or datetime.now().strftime("%Y%m%d-%H%M%S")
+    logger.info(f"Run id: {run_id} (re-run with --run-id {run_id} to resume if interrupted)")
+    for path in args.paths:
+        pdf_path = str(Path(__file__).parent / path)
+        checkpoints = SQLiteCheckpointStorage(CHECKPOINT_PATH, run_id=f"{run_id}:{path}")
+        if checkpoints.is_complete():
+            logger.info(f"Skipping {path}: already completed in run {run_id}")
+            checkpoints.close()
+            continue
+        latest = await checkpoints.get_latest(workflow_name=workflow.name)
+        if latest:
+            logger.info(f"Resuming {path} from the checkpoint after superstep {latest.iteration_count}")
+            events = await workflow.run(checkpoint_id=latest.checkpoint_id, checkpoint_storage=checkpoints)
+        else:
+            logger.info("Processing: %s", pdf_path)
+            events = await workflow.run(pdf_path, checkpoint_storage=checkpoints)
+        for result in events.get_outputs():
+            logger.info(
+                f"Stored {result.written} new chunk(s) in {RAG_STORE}, skipped {result.skipped} existing, "
+                f"removed {result.removed} stale"
+            )
+        checkpoints.mark_complete()
+        checkpoints.close()
+    if len(args.paths) > 1:
+        logger.info(f"Near-duplicate elimination saved ~{dedup.tokens_saved} embedding tokens in total")
+
+    vector_store.close()
+    manifest.close()
+    await embed_client.close()
+    if async_credential:
+        await async_credential.close()
+
+
+# ── Throughput benchmark ─────────────────────────────────────────────
+
+
+class SimulatedEmbeddings:
+    """Stand-in for ``client.embeddings`` with a fixed per-request latency plus a small per-input cost."""
+
+    def __init__(self, request_latency: float = 0.05, per_input_latency: float = 0.0005):
+        self.request_latency = request_latency
+        self.per_input_latency = per_input_latency
+
+    async def create(self, *, input: str | list[str], model: str, dimensions: int, encoding_format: str = "float"):
+        texts = [input] if isinstance(input, str) else input
+        await asyncio.sleep(self.request_latency + self.per_input_latency * len(texts))
+        if encoding_format == "base64":
+            embedding = base64.b64encode(np.zeros(dimensions, dtype=np.float32).tobytes()).decode()
+        else:
+            embedding = [0.0] * dimensions
+        data = [
+            openai.types.Embedding.model_construct(embedding=embedding, index=i, object="embedding")
+            for i in range(len(texts))
+        ]
+        return openai.types.CreateEmbeddingResponse(
+            data=data, model=model, object="list", usage={"prompt_tokens": 0, "total_tokens": 0}
+        )
+
+
+class SimulatedClient:
+    def __init__(self) -> None:
+        self.embeddings = SimulatedEmbeddings()
+
+
+class CollectExecutor(Executor):
+    """Benchmark sink that yields every embedded chunk, in batch order, at the end of the run."""
+
+    def __init__(self, id: str = "collect") -> None:
+        super().__init__(id=id)
+        self._batches: dict[int, list[EmbeddedChunk]] = {}
+
+    @handler
+    async def collect(self, batch: EmbeddedBatch, ctx: WorkflowContext[Never, list[EmbeddedChunk]]) -> None:
+        self._batches[batch.batch_id] = batch.chunks
+
+    @handler
+    async def finish(self, end: EndOfDocument, ctx: WorkflowContext[Never, list[EmbeddedChunk]]) -> None:
+        await ctx.yield_output([chunk for batch_id in sorted(self._batches) for chunk in self._batches[batch_id]])
+        self._batches = {}
+
+
+def synthetic_markdown(megabytes: float) -> str:
+    """Build a large markdown document with nested headings and paragraphs of varying length."""
+    words = "the plan covers preventive care claims deductible network provider annual benefit employee".split()
+    parts: list[str] = []
+    size = 0
+    section = 0
+    while size < megabytes * 1_000_000:
+        section += 1
+        parts.append(f"# Part {section}\n\n## Section {section}.1\n\n")
+        for _ in range(random.randint(3, 12)):
+            sentences = [
+                " ".join(random.choices(words, k=random.randint(6, 30))).capitalize() + "."
+                for _ in range(random.randint(1, 8))
+            ]
+            parts.append(" ".join(sentences) + "\n\n")
+            size += len(parts[-1])
+    return "".join(parts)
+
+
+def benchmark_chunker(megabytes: float = 20) -> None:
+    """Measure chunker throughput in MB/s and the spread of chunk sizes."""
+    markdown = synthetic_markdown(megabytes)
+    size_mb = len(markdown.encode()) / 1_000_000
+
+    start = time.perf_counter()
+    paragraphs = [p.strip() for p in markdown.split("\n\n") if len(p.strip()) >= 80 and not p.strip().startswith("#")]
+    naive_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    chunks = MarkdownChunker().split(markdown)
+    chunker_seconds = time.perf_counter() - start
+
+    def spread(sizes: list[int]) -> str:
+        return f"min {min(sizes)}, mean {sum(sizes) / len(sizes):.0f}, max {max(sizes)} tokens"
+
+    logger.info(f"Chunking {size_mb:.1f} MB of markdown:")
+    logger.info(
+        f"  Blank-line split:    {size_mb / naive_seconds:8.1f} MB/s, {len(paragraphs)} chunks "
+        f"({spread([estimate_tokens(p) for p in paragraphs])})"
+    )
+    logger.info(
+        f"  Token-aware chunker: {size_mb / chunker_seconds:8.1f} MB/s, {len(chunks)} chunks "
+        f"({spread([c.tokens for c in chunks])})"
+    )
+
+
+def benchmark_memory(num_chunks: int = 1_000_000, sample: int = 20_000) -> None:
+    """Compare memory for list[float] vectors in a regular dataclass against float32 rows in a slotted record.
+
+    Measures ``sample`` chunks with tracemalloc and scales to ``num_chunks`` (the list-of-floats
+    version of 1M chunks would need several GB). Chunk text is shared, so only vectors and records count.
+    """
+
+    @dataclass
+    class ListEmbeddedChunk:
+        text: str
+        vector: list[float]
+        heading_path: tuple[str, ...] = ()
+
+    text = "shared chunk text"
+    values = np.random.default_rng(0).random((sample, EMBEDDING_DIMENSIONS), dtype=np.float32)
+
+    tracemalloc.start()
+    listed = [ListEmbeddedChunk(text, row.tolist()) for row in values]
+    list_bytes = tracemalloc.get_traced_memory()[0]
+    del listed
+    tracemalloc.stop()
+
+    tracemalloc.start()
+    matrix = values.copy()  # the batch matrix the embed step decodes into
+    compact = [EmbeddedChunk(text, matrix[i]) for i in range(sample)]
+    compact_bytes = tracemalloc.get_traced_memory()[0]
+    del compact, matrix
+    tracemalloc.stop()
+
+    scale = num_chunks / sample
+    logger.info(f"Memory for {num_chunks:,} chunks x {EMBEDDING_DIMENSIONS}d (measured on {sample:,}, scaled):")
+    logger.info(f"  list[float] + dataclass: {list_bytes * scale / 1e9:6.2f} GB ({list_bytes / sample:,.0f} B/chunk)")
+    logger.info(
+        f"  float32 rows + slots:    {compact_bytes * scale / 1e9:6.2f} GB ({compact_bytes / sample:,.0f} B/chunk, "
+        f"{list_bytes / compact_bytes:.1f}x smaller)"
+    )
+
+
+async def benchmark(num_chunks: int = 500) -> None:
+    """Compare chunks/sec of the per-chunk loop against the Embed step as the workflow runs it.
+
+    Embed runs in a two-node workflow (Embed ⟲ → a collecting sink), so the number includes
+    the spool, one wave of concurrent requests per superstep, and the superstep overhead.
+    """
+    benchmark_chunker()
+    benchmark_memory()
+    chunks = [
+        TextChunk(f"Chunk {i}: " + "lorem ipsum dolor sit amet " * random.randint(20, 80)) for i in range(num_chunks)
+    ]
+    simulated = SimulatedClient()
+
+    start = time.perf_counter()
+    for chunk in chunks:
+        await simulated.embeddings.create(input=chunk.text, model="simulated", dimensions=EMBEDDING_DIMENSIONS)
+    sequential_rate = num_chunks / (time.perf_counter() - start)
+
+    batched = EmbedExecutor(client=simulated, model="simulated", id="embed-benchmark")  # type: ignore[arg-type]
+    collect = CollectExecutor()
+    pipeline = (
+        WorkflowBuilder(start_executor=batched, max_iterations=100_000)
+        .add_edge(batched, batched)
+        .add_edge(batched, collect)
+        .build()
+    )
+    start = time.perf_counter()
+    embedded = (await pipeline.run(chunks)).get_outputs()[0]
+    batched_rate = num_chunks / (time.perf_counter() - start)
+    assert [c.text for c in embedded] == [c.text for c in chunks], "results must come back in chunk order"
+
+    logger.info(f"Per-chunk loop:       {sequential_rate:8.1f} chunks/sec")
+    logger.info(f"Embed step (waves):   {batched_rate:8.1f} chunks/sec ({batched_rate / sequential_rate:.1f}x)")
 
 
 if __name__ == "__main__":
@@ -142,5 +1449,7 @@ if __name__ == "__main__":
         from agent_framework.devui import serve
 
         serve(entities=[workflow], port=8090, auto_open=True)
+    elif "--benchmark" in sys.argv:
+        asyncio.run(benchmark())
     else:
         asyncio.run(main())
@@ -0,0 +1,445 @@
+"""RAG ingestion for a whole corpus: parallel extraction with a process pool.
+
+workflow_rag_ingest.py ingests one file per run, and MarkItDown's PDF/Office
+parsing is CPU-bound work that blocks the event loop. This example takes a
+directory or glob pattern instead, fans MarkItDown conversions out across
+a ProcessPoolExecutor sized to the machine's cores, and streams converted
+documents into the chunk, dedup, embed and store stages as they finish.
+
+Pipeline:
+
+    Extract ──Document──▶ Chunk ──ChunkBatch──▶ Dedup ──ChunkBatch──▶ Embed ──EmbeddedBatch──▶ Store
+     ▲  │   (as each        │    (multi-document)       (near-duplicates     (token-bounded)    ▲
+     └──┘    finishes)      │                            dropped)                              │
+   ExtractNext              └──────────────────────────DocumentRecord──────────────────────────┘
+   (self-loop: hand off finished documents every superstep)
+
+Extract keeps a bounded number of conversions queued on the pool. Each
+superstep it forwards whatever has finished, tops the pool back up, and
+re-schedules itself, so chunking and embedding overlap with extraction.
+A per-stage throughput report is printed at the end.
+
+The chunker, near-duplicate index, embedding request, vector store (RAG_STORE,
+sqlite or postgres) and Store step are the ones from workflow_rag_ingest.py,
+and so is the manifest that makes re-runs incremental. It records each document's mtime,
+size and content hash, plus the hash of every chunk already stored:
+
+  - a document whose mtime and size are unchanged is skipped without being read,
+  - a document whose bytes hash the same is skipped before extraction,
+  - a changed document is re-chunked, only chunks with new hashes are embedded,
+    and the chunks it no longer contains are deleted from the store.
+
+Chunk hashes are recorded only after Store has committed them, and document
+entries only at the end of the run, so an interrupted run re-extracts the
+unfinished documents but doesn't re-embed chunks that were already stored.
+
+Run:
+    uv run examples/workflow_rag_ingest_corpus.py                 (all PDFs in examples/)
+    uv run examples/workflow_rag_ingest_corpus.py path/to/docs    (every supported file, recursively)
+    uv run examples/workflow_rag_ingest_corpus.py "docs/**/*.pdf"
+    uv run examples/workflow_rag_ingest_corpus.py --full          (ignore the manifest and re-embed everything)
+"""
+
+import argparse
+import asyncio
+import glob
+import logging
+import os
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+
+from agent_framework import Executor, WorkflowBuilder, WorkflowContext, handler
+from markitdown import MarkItDown
+from openai import AsyncOpenAI
+from rich.logging import RichHandler
+
+# Chunking, embedding, the vector store and the manifest are shared with the single-document pipeline
+from workflow_rag_ingest import (
+    MANIFEST_PATH,
+    POSTGRES_URL,
+    RAG_STORE,
+    SQLITE_PATH,
+    Document,
+    DocumentRecord,
+    EmbeddedBatch,
+    EmbeddedChunk,
+    EndOfDocument,
+    IngestManifest,
+    MarkdownChunker,
+    PgVectorStore,
+    SQLiteVectorStore,
+    StoreExecutor,
+    StoreResult,
+    TextChunk,
+    async_credential,
+    embed_client,
+    embed_model,
+    file_hash,
+    pack_batches,
+)
+from workflow_rag_ingest import DedupExecutor as NearDuplicateIndex
+from workflow_rag_ingest import EmbedExecutor as BatchEmbedder
+
+log_handler = RichHandler(show_path=False, rich_tracebacks=True, show_level=False)
+logging.basicConfig(level=logging.WARNING, handlers=[log_handler], force=True, format="%(message)s")
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+SUPPORTED_SUFFIXES = {".pdf", ".docx", ".pptx", ".xlsx", ".html", ".htm", ".md", ".txt"}
+
+
+# ── Messages flowing between executors ───────────────────────────────
+
+
+@dataclass
+class ExtractNext:
+    """Tells Extract to hand off the next finished conversions."""
+
+
+@dataclass
+class ChunkBatch:
+    """New chunks from one or more documents, ready to embed."""
+
+    chunks: list[TextChunk]
+
+
+@dataclass
+class EndOfCorpus:
+    """Sent once every document has been extracted, so later stages can flush."""
+
+    documents: int
+
+
+@dataclass
+class StageStats:
+    """Throughput counters for one pipeline stage."""
+
+    name: str
+    unit: str
+    items: int = 0
+    busy_seconds: float = 0.0
+
+    def report(self, wall_seconds: float) -> str:
+        busy_rate = self.items / self.busy_seconds if self.busy_seconds else 0.0
+        wall_rate = self.items / wall_seconds if wall_seconds else 0.0
+        return (
+            f"{self.name:<8} {self.items:>7} {self.unit:<6} "
+            f"{wall_rate:9.1f} {self.unit}/s wall  {busy_rate:9.1f} {self.unit}/s busy"
+        )
+
+
+# ── Extraction in worker processes ───────────────────────────────────
+
+_worker_markitdown: MarkItDown | None = None
+
+
+def _init_worker() -> None:
+    """Create one MarkItDown converter per worker process."""
+    global _worker_markitdown
+    _worker_markitdown = MarkItDown()
+
+
+def convert_to_markdown(path: str, known_hash: str | None) -> tuple[str, str | None, float]:
+    """Hash one file and, unless the hash is ``known_hash``, convert it to markdown.
+
+    Runs in a worker process. Returns (file hash, markdown or None if unchanged, seconds).
+    """
+    start = time.perf_counter()
+    doc_hash = file_hash(path)
+    if doc_hash == known_hash:
+        return doc_hash, None, time.perf_counter() - start
+    assert _worker_markitdown is not None
+    markdown = _worker_markitdown.convert(path).text_content
+    return doc_hash, markdown, time.perf_counter() - start
+
+
+def expand_sources(pattern: str) -> list[str]:
+    """Resolve a directory (recursively) or a glob pattern to a sorted list of supported files."""
+    root = Path(pattern)
+    if root.is_dir():
+        paths = [p for p in root.rglob("*") if p.is_file() and p.suffix.lower() in SUPPORTED_SUFFIXES]
+    else:
+        paths = [Path(p) for p in glob.glob(pattern, recursive=True) if Path(p).is_file()]
+    return sorted(str(p.resolve()) for p in paths)
+
+
+# ── Executors ────────────────────────────────────────────────────────
+
+
+class ExtractExecutor(Executor):
+    """Fan conversions out to a process pool and hand off documents as they finish."""
+
+    def __init__(self, *, manifest: IngestManifest | None, max_workers: int | None = None, id: str = "extract") -> None:
+        super().__init__(id=id)
+        self._manifest = manifest
+        self._max_workers = max_workers or os.cpu_count() or 1
+        # Keep a couple of files queued per worker so no core sits idle between supersteps
+        self._max_pending = self._max_workers * 2
+        self._pool: ProcessPoolExecutor | None = None
+        self._queue: list[str] = []
+        self._pending: dict[Future, tuple[str, os.stat_result]] = {}
+        self._documents = 0
+        self.skipped = 0
+        self.stats = StageStats("extract", "docs")
+
+    def _top_up(self) -> None:
+        assert self._pool is not None
+        while self._queue and len(self._pending) < self._max_pending:
+            path = self._queue.pop()
+            stat = os.stat(path)
+            known = self._manifest.get_document(path) if self._manifest else None
+            if known and (known.mtime_ns, known.size) == (stat.st_mtime_ns, stat.st_size):
+                self.skipped += 1
+                continue
+            future = self._pool.submit(convert_to_markdown, path, known.doc_hash if known else None)
+            self._pending[future] = (path, stat)
+
+    async def _hand_off(self, ctx: WorkflowContext[Document | ExtractNext | EndOfCorpus]) -> None:
+        if not self._pending:
+            if self._pool is not None:
+                self._pool.shutdown()
+                self._pool = None
+            await ctx.send_message(EndOfCorpus(documents=self._documents))
+            return
+
+        # Wait for at least one conversion, then forward everything that has finished
+        await asyncio.wait([asyncio.wrap_future(f) for f in self._pending], return_when=asyncio.FIRST_COMPLETED)
+        for future in [f for f in self._pending if f.done()]:
+            path, stat = self._pending.pop(future)
+            try:
+                doc_hash, markdown, seconds = future.result()
+            except Exception:
+                logger.exception(f"→ Failed to extract {path}")
+                continue
+            self.stats.busy_seconds += seconds
+            record = DocumentRecord(path, stat.st_mtime_ns, stat.st_size, doc_hash)
+            if markdown is None:
+                # Touched but identical bytes: remember the new mtime so the next run skips on stat alone
+                assert self._manifest is not None
+                self._manifest.touch_document(record)
+                self.skipped += 1
+                continue
+            self.stats.items += 1
+            self._documents += 1
+            await ctx.send_message(Document(source=path, markdown=markdown, record=record))
+        self._top_up()
+        await ctx.send_message(ExtractNext())
+
+    @handler
+    async def start(self, pattern: str, ctx: WorkflowContext[Document | ExtractNext | EndOfCorpus]) -> None:
+        """Expand the directory or glob and start converting in the process pool."""
+        sources = expand_sources(pattern.strip("'\""))
+        logger.info(f"→ {len(sources)} document(s) found, extracting with {self._max_workers} worker process(es)")
+        self._queue = list(reversed(sources))
+        self._pool = ProcessPoolExecutor(max_workers=self._max_workers, initializer=_init_worker)
+        self._top_up()
+        await self._hand_off(ctx)
+
+    @handler
+    async def next_documents(self, _: ExtractNext, ctx: WorkflowContext[Document | ExtractNext | EndOfCorpus]) -> None:
+        """Forward the conversions that finished since the last superstep."""
+        await self._hand_off(ctx)
+
+
+class ChunkExecutor(Executor):
+    """Chunk documents and group their new chunks into multi-document batches.
+
+    Each document's manifest entry, with the hashes of the chunks it no longer
+    has, goes straight to Store, which records it at the end of the run.
+    """
+
+    def __init__(self, *, manifest: IngestManifest | None, batch_chunks: int = 256, id: str = "chunk") -> None:
+        super().__init__(id=id)
+        self._manifest = manifest
+        self._batch_chunks = batch_chunks
+        self._chunker = MarkdownChunker()
+        self._buffer: list[TextChunk] = []
+        self.unchanged_chunks = 0
+        self.stats = StageStats("chunk", "chunks")
+
+    @handler
+    async def chunk(self, document: Document, ctx: WorkflowContext[ChunkBatch | DocumentRecord]) -> None:
+        """Chunk one document and queue the chunks that aren't stored yet."""
+        start = time.perf_counter()
+        known = self._manifest.chunk_hashes(document.source) if self._manifest else set()
+        seen: set[str] = set()
+        for text_chunk in self._chunker.split(document.markdown):
+            digest = text_chunk.chunk_hash
+            if digest in seen:
+                continue
+            seen.add(digest)
+            self.stats.items += 1
+            if digest in known:
+                self.unchanged_chunks += 1
+            else:
+                text_chunk.source = document.source
+                self._buffer.append(text_chunk)
+        assert document.record is not None
+        document.record.stale_chunks = sorted(known - seen)
+        self.stats.busy_seconds += time.perf_counter() - start
+        await ctx.send_message(document.record)
+        if len(self._buffer) >= self._batch_chunks:
+            await self._send_batch(ctx)
+
+    async def _send_batch(self, ctx: WorkflowContext[ChunkBatch | DocumentRecord]) -> None:
+        await ctx.send_message(ChunkBatch(chunks=self._buffer))
+        self._buffer = []
+
+    @handler
+    async def flush(self, end: EndOfCorpus, ctx: WorkflowContext[ChunkBatch | DocumentRecord | EndOfCorpus]) -> None:
+        """Send the last partial batch, then pass the end marker along."""
+        if self._buffer:
+            await self._send_batch(ctx)
+        await ctx.send_message(end)
+
+
+class DedupExecutor(Executor):
+    """Drop chunks that are near-duplicates of a chunk seen earlier in the run, before they are embedded.
+
+    The index is held in memory for the run, so chunks already stored by an earlier
+    run are not compared against.
+    """
+
+    def __init__(self, *, id: str = "dedup") -> None:
+        super().__init__(id=id)
+        # Used only for its MinHash/LSH index
+        self._index = NearDuplicateIndex(id=f"{id}-index")
+        self.collapsed = 0
+        self.stats = StageStats("dedup", "chunks")
+
+    @property
+    def tokens_saved(self) -> int:
+        return self._index.tokens_saved
+
+    @handler
+    async def dedup(self, batch: ChunkBatch, ctx: WorkflowContext[ChunkBatch]) -> None:
+        """Forward the chunks of the batch that aren't near-duplicates."""
+        start = time.perf_counter()
+        unique, within, across = self._index.unique(batch.chunks)
+        self.collapsed += within + across
+        self.stats.items += len(batch.chunks)
+        self.stats.busy_seconds += time.perf_counter() - start
+        if unique:
+            await ctx.send_message(ChunkBatch(chunks=unique))
+
+    @handler
+    async def flush(self, end: EndOfCorpus, ctx: WorkflowContext[EndOfCorpus]) -> None:
+        """Pass the end marker along after the last batch."""
+        await ctx.send_message(end)
+
+
+class EmbedExecutor(Executor):
+    """Embed chunk batches with token-bounded requests and a cap on concurrent requests.
+
+    Each request's result goes to Store as its own EmbeddedBatch.
+    """
+
+    def __init__(
+        self,
+        *,
+        client: AsyncOpenAI,
+        model: str,
+        max_batch_tokens: int = 8000,
+        max_batch_size: int = 128,
+        max_concurrency: int = 4,
+        id: str = "embed",
+    ) -> None:
+        super().__init__(id=id)
+        # Used only for its batch request (retries, base64 float32 decoding, bisecting rejected batches)
+        self._embedder = BatchEmbedder(client=client, model=model, id=f"{id}-batches")
+        self._max_batch_tokens = max_batch_tokens
+        self._max_batch_size = max_batch_size
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._next_batch_id = 0
+        self.stats = StageStats("embed", "chunks")
+
+    async def _embed_group(self, chunks: list[TextChunk]) -> list[EmbeddedChunk]:
+        async with self._semaphore:
+            return await self._embedder.embed_chunks(chunks)
+
+    @handler
+    async def embed(self, batch: ChunkBatch, ctx: WorkflowContext[EmbeddedBatch]) -> None:
+        """Embed a batch concurrently and send each request's chunks to Store."""
+        start = time.perf_counter()
+        groups = pack_batches([c.text for c in batch.chunks], self._max_batch_tokens, self._max_batch_size)
+        results = await asyncio.gather(*(self._embed_group([batch.chunks[i] for i in group]) for group in groups))
+        self.stats.items += len(batch.chunks)
+        self.stats.busy_seconds += time.perf_counter() - start
+        for embedded in results:
+            await ctx.send_message(EmbeddedBatch(batch_id=self._next_batch_id, chunks=embedded))
+            self._next_batch_id += 1
+
+    @handler
+    async def finish(self, end: EndOfCorpus, ctx: WorkflowContext[EndOfDocument]) -> None:
+        """Tell Store that every batch has been sent."""
+        logger.info(f"→ Corpus done: {end.documents} document(s), {self.stats.items} chunks embedded")
+        await ctx.send_message(EndOfDocument(batches=self._next_batch_id))
+
+
+def create_workflow(manifest: IngestManifest | None):
+    """Build the workflow: Extract ⟲ → Chunk → Dedup → Embed → Store, plus Chunk → Store for manifest entries.
+
+    Extract loops once per superstep until the pool is drained, so allow plenty of iterations.
+    """
+    extract = ExtractExecutor(manifest=manifest)
+    chunk = ChunkExecutor(manifest=manifest)
+    dedup = DedupExecutor()
+    embed = EmbedExecutor(client=embed_client, model=embed_model)
+    vector_store = PgVectorStore(POSTGRES_URL) if RAG_STORE == "postgres" else SQLiteVectorStore(SQLITE_PATH)
+    store = StoreExecutor(store=vector_store, manifest=manifest)
+    workflow = (
+        WorkflowBuilder(start_executor=extract, max_iterations=100_000)
+        .add_edge(extract, extract)
+        .add_edge(extract, chunk)
+        .add_edge(chunk, dedup)
+        .add_edge(chunk, store)
+        .add_edge(dedup, embed)
+        .add_edge(embed, store)
+        .build()
+    )
+    return workflow, extract, chunk, dedup, embed, vector_store
+
+
+parser = argparse.ArgumentParser(description="Ingest a directory or glob of documents into a vector store.")
+parser.add_argument("pattern", nargs="?", default=str(Path(__file__).parent / "*.pdf"), help="Directory or glob")
+parser.add_argument("--manifest", default=MANIFEST_PATH, help="Path to the SQLite ingestion manifest")
+parser.add_argument("--full", action="store_true", help="Ignore the manifest and re-embed everything")
+
+
+async def main():
+    args = parser.parse_args()
+    manifest = None if args.full else IngestManifest(args.manifest)
+    workflow, extract, chunk, dedup, embed, vector_store = create_workflow(manifest)
+    pattern = args.pattern
+    logger.info("Ingesting: %s", pattern)
+    start = time.perf_counter()
+    store_stats = StageStats("store", "chunks")
+    removed = 0
+    async for event in workflow.run(pattern, stream=True):
+        if event.type == "output" and isinstance(event.data, StoreResult):
+            store_stats.items += event.data.written + event.data.skipped
+            store_stats.busy_seconds += event.data.seconds
+            removed += event.data.removed
+    wall_seconds = time.perf_counter() - start
+
+    logger.info(f"Per-stage throughput over {wall_seconds:.2f}s:")
+    for stats in (extract.stats, chunk.stats, dedup.stats, embed.stats, store_stats):
+        logger.info("  " + stats.report(wall_seconds))
+    logger.info(f"{dedup.collapsed} near-duplicate chunk(s) collapsed, ~{dedup.tokens_saved} embedding tokens saved")
+    if manifest:
+        logger.info(
+            f"Incremental: {extract.skipped} unchanged document(s) skipped, "
+            f"{chunk.unchanged_chunks} unchanged chunk(s) reused, {embed.stats.items} embedded, {removed} stale removed"
+        )
+        manifest.close()
+
+    vector_store.close()
+    await embed_client.close()
+    if async_credential:
+        await async_credential.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,284 @@
+"""Streaming RAG ingestion pipeline: chunks flow through the workflow in small batches.
+
+workflow_rag_ingest.py hands whole-document values between executors: the
+full markdown string, then a list of every chunk, then a list of every
+embedding. Memory grows with the document and each stage waits for the
+previous one to finish.
+
+Here the same Extract → Chunk → Embed pipeline streams instead:
+
+    Extract ──section──▶ Chunk ──ChunkBatch──▶ Embed ──▶ output (per batch)
+       ▲  │
+       └──┘ ReadNext (self-loop: read one more section per superstep)
+
+The workflow runs in supersteps, and executors with pending messages run
+concurrently within a superstep. Extract reads exactly one section per
+superstep and re-schedules itself with a ReadNext message, so while
+Extract reads section N+1, Chunk splits section N and Embed embeds the
+batches from section N-1. That one-message-per-stage cadence is the
+backpressure: Extract never runs ahead of the embedding stage, and only a
+few sections are held in memory at any time.
+
+Chunking and embedding are the ones from workflow_rag_ingest.py: Chunk
+feeds each section to a MarkdownChunker, which carries the heading path and
+the overlap across sections, and Embed sends each batch through that
+file's EmbedExecutor, so vectors are float32 rows of a batch matrix.
+
+Memory is bounded only for markdown and text files, which are read line by
+line from disk. MarkItDown can't convert PDF or Office files in parts, so for
+those (including the default sample_document.pdf) the whole converted text
+is held in memory while it is streamed section by section; only the chunk
+and embed stages stay bounded.
+
+Run:
+    uv run examples/workflow_rag_ingest_streaming.py
+    uv run examples/workflow_rag_ingest_streaming.py path/to/large.md
+"""
+
+import asyncio
+import logging
+import sys
+from collections.abc import Iterable, Iterator
+from dataclasses import dataclass
+from pathlib import Path
+
+from agent_framework import Executor, WorkflowBuilder, WorkflowContext, handler
+from markitdown import MarkItDown
+from openai import AsyncOpenAI
+from rich.logging import RichHandler
+from typing_extensions import Never
+
+# The chunker, embedding code and embedding client (configured from API_HOST) are shared with the batch pipeline
+from workflow_rag_ingest import (
+    EMBEDDING_DIMENSIONS,
+    EmbeddedChunk,
+    MarkdownChunker,
+    TextChunk,
+    async_credential,
+    embed_client,
+    embed_model,
+)
+from workflow_rag_ingest import EmbedExecutor as BatchEmbedder
+
+log_handler = RichHandler(show_path=False, rich_tracebacks=True, show_level=False)
+logging.basicConfig(level=logging.WARNING, handlers=[log_handler], force=True, format="%(message)s")
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+SECTION_CHARS = 8_000  # Approximate size of each section read by Extract
+CHUNK_BATCH_SIZE = 32  # Chunks per message from Chunk to Embed
+
+
+# ── Messages flowing between executors ───────────────────────────────
+
+
+@dataclass
+class Section:
+    """A slice of the document, cut on a paragraph boundary."""
+
+    source: str
+    index: int
+    text: str
+
+
+@dataclass
+class ReadNext:
+    """Tells Extract to read the next section of a document it has open."""
+
+    source: str
+
+
+@dataclass
+class ChunkBatch:
+    """A small batch of chunks ready to embed."""
+
+    source: str
+    chunks: list[TextChunk]
+
+
+@dataclass
+class EndOfDocument:
+    """Sent after the last section, so downstream stages can report totals."""
+
+    source: str
+    sections: int
+
+
+# ── Executors ────────────────────────────────────────────────────────
+
+TEXT_SUFFIXES = {".md", ".markdown", ".txt"}
+
+
+def iter_lines(text: str) -> Iterator[str]:
+    """Yield the lines of ``text`` with their line endings, without copying it all at once."""
+    start = 0
+    while start < len(text):
+        end = text.find("\n", start) + 1 or len(text)
+        yield text[start:end]
+        start = end
+
+
+def iter_sections(path: Path, max_chars: int) -> Iterator[str]:
+    """Yield the document in sections of roughly ``max_chars``, cut at blank lines.
+
+    Text files are read lazily from disk. Other formats are converted by MarkItDown
+    first, and the converted text stays in memory until the last section is read.
+    """
+    if path.suffix.lower() in TEXT_SUFFIXES:
+        with path.open(encoding="utf-8") as file:
+            yield from _cut_sections(file, max_chars)
+    else:
+        yield from _cut_sections(iter_lines(MarkItDown().convert(str(path)).text_content), max_chars)
+
+
+def _cut_sections(lines: Iterable[str], max_chars: int) -> Iterator[str]:
+    buffer: list[str] = []
+    size = 0
+    for line in lines:
+        buffer.append(line)
+        size += len(line)
+        if size >= max_chars and not line.strip():
+            yield "".join(buffer)
+            buffer, size = [], 0
+    if buffer:
+        yield "".join(buffer)
+
+
+class ExtractExecutor(Executor):
+    """Read a document one section per superstep."""
+
+    def __init__(self, *, section_chars: int = SECTION_CHARS, id: str = "extract") -> None:
+        super().__init__(id=id)
+        self._section_chars = section_chars
+        self._readers: dict[str, Iterator[str]] = {}
+        self._counts: dict[str, int] = {}
+
+    async def _read_next(self, source: str, ctx: WorkflowContext[Section | ReadNext | EndOfDocument]) -> None:
+        # Reading (and, for binary formats, the first MarkItDown conversion) happens off the event loop
+        text = await asyncio.to_thread(next, self._readers[source], None)
+        if text is None:
+            del self._readers[source]
+            await ctx.send_message(EndOfDocument(source=source, sections=self._counts.pop(source)))
+            return
+        await ctx.send_message(Section(source=source, index=self._counts[source], text=text))
+        self._counts[source] += 1
+        await ctx.send_message(ReadNext(source=source))
+
+    @handler
+    async def start(self, path: str, ctx: WorkflowContext[Section | ReadNext | EndOfDocument]) -> None:
+        """Open the document and emit its first section.
+
+        Accepts a path relative to the current directory or to the examples folder.
+        """
+        path = path.strip("'\"")
+        resolved = Path(path) if Path(path).exists() else Path(__file__).parent / path
+        source = str(resolved)
+        self._readers[source] = iter_sections(resolved, self._section_chars)
+        self._counts[source] = 0
+        await self._read_next(source, ctx)
+
+    @handler
+    async def next_section(self, message: ReadNext, ctx: WorkflowContext[Section | ReadNext | EndOfDocument]) -> None:
+        """Emit the next section of an open document."""
+        await self._read_next(message.source, ctx)
+
+
+class ChunkExecutor(Executor):
+    """Chunk each section as it arrives and forward the chunks in small batches.
+
+    Each open document has its own MarkdownChunker, so a section continues the
+    heading path and overlap of the one before it.
+    """
+
+    def __init__(self, *, batch_size: int = CHUNK_BATCH_SIZE, id: str = "chunk") -> None:
+        super().__init__(id=id)
+        self._batch_size = batch_size
+        self._chunkers: dict[str, MarkdownChunker] = {}
+
+    async def _send(self, source: str, chunks: list[TextChunk], ctx: WorkflowContext[ChunkBatch]) -> None:
+        for text_chunk in chunks:
+            text_chunk.source = source
+        for start in range(0, len(chunks), self._batch_size):
+            await ctx.send_message(ChunkBatch(source=source, chunks=chunks[start : start + self._batch_size]))
+
+    @handler
+    async def chunk(self, section: Section, ctx: WorkflowContext[ChunkBatch]) -> None:
+        """Feed the section to its document's chunker and send the chunks it completed."""
+        chunker = self._chunkers.setdefault(section.source, MarkdownChunker())
+        await self._send(section.source, chunker.feed(section.text), ctx)
+
+    @handler
+    async def finish(self, end: EndOfDocument, ctx: WorkflowContext[ChunkBatch | EndOfDocument]) -> None:
+        """Send the document's last chunks, then pass the end-of-document marker along."""
+        chunker = self._chunkers.pop(end.source, None)
+        if chunker is not None:
+            await self._send(end.source, chunker.finish(), ctx)
+        await ctx.send_message(end)
+
+
+class EmbedExecutor(Executor):
+    """Embed each incoming batch and yield it as soon as it is done."""
+
+    def __init__(
+        self,
+        *,
+        client: AsyncOpenAI,
+        model: str,
+        dimensions: int = EMBEDDING_DIMENSIONS,
+        max_retries: int = 5,
+        id: str = "embed",
+    ) -> None:
+        super().__init__(id=id)
+        # Used only for its batch request (retries, base64 float32 decoding, bisecting rejected batches)
+        self._embedder = BatchEmbedder(
+            client=client, model=model, dimensions=dimensions, max_retries=max_retries, id=f"{id}-batches"
+        )
+        self._embedded: dict[str, int] = {}
+
+    @handler
+    async def embed(self, batch: ChunkBatch, ctx: WorkflowContext[Never, list[EmbeddedChunk]]) -> None:
+        """Embed one batch and yield it immediately, so the caller can persist it and drop it."""
+        embedded = await self._embedder.embed_chunks(batch.chunks)
+        self._embedded[batch.source] = self._embedded.get(batch.source, 0) + len(batch.chunks)
+        await ctx.yield_output(embedded)
+
+    @handler
+    async def finish(self, end: EndOfDocument, ctx: WorkflowContext[Never, list[EmbeddedChunk]]) -> None:
+        """Report totals for a finished document."""
+        total = self._embedded.pop(end.source, 0)
+        logger.info(f"→ {Path(end.source).name}: {end.sections} section(s), {total} chunks embedded")
+
+
+# Create executor instances
+extract = ExtractExecutor()
+chunk = ChunkExecutor()
+embed = EmbedExecutor(client=embed_client, model=embed_model)
+
+# Build the workflow: Extract ⟲ → Chunk → Embed.
+# Each section costs one superstep, so raise the iteration cap for large documents.
+workflow = (
+    WorkflowBuilder(start_executor=extract, max_iterations=100_000)
+    .add_edge(extract, extract)
+    .add_edge(extract, chunk)
+    .add_edge(chunk, embed)
+    .build()
+)
+
+
+async def main():
+    path = sys.argv[1] if len(sys.argv) > 1 else "sample_document.pdf"
+    logger.info("Streaming: %s", path)
+    total = 0
+    async for event in workflow.run(path, stream=True):
+        if event.type == "output":
+            total += len(event.data)
+            preview = event.data[0].text[:60].replace("\n", " ") if event.data else ""
+            logger.info(f"  +{len(event.data)} chunks (total {total}) {preview}…")
+
+    await embed_client.close()
+    if async_credential:
+        await async_credential.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())